@@ -0,0 +1,233 @@
+from functools import lru_cache
+from os import environ
+from os.path import exists
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from athlete_search import ATHLETE_COLUMN, MISSING_ATHLETE, AthleteIndex, RowOffsets, athlete_ids
+
+# constants
+ALL_EVENTS_NAME = 'All'
+EVENT_500M = '500m'
+EVENT_1000M = '1000m'
+EVENT_1500M = '1500m'
+INDIVIDUAL_EVENTS = [EVENT_500M, EVENT_1000M, EVENT_1500M]
+DATA_BASE_FILEPATH = f'./data/{environ.get("DATASET", "full")}/'  # default to full dataset
+FULL_ROUNDS_FILEPATH = f'{DATA_BASE_FILEPATH}rounds_with_splits.csv'
+FULL_ROUNDS_PARQUET_FILEPATH = f'{DATA_BASE_FILEPATH}rounds_with_splits.parquet'
+LAPTIMES_FILENAME = 'individual_athlete_lap_data.csv'
+LAPTIMES_FILEPATH = f'{DATA_BASE_FILEPATH}{LAPTIMES_FILENAME}'
+LAPTIMES_COMPRESSED_FILEPATH = f'{DATA_BASE_FILEPATH}individual_athlete_lap_data.pk'
+LAPTIMES_PARQUET_FILEPATH = f'{DATA_BASE_FILEPATH}individual_athlete_lap_data.parquet'
+PROFILES_FILEPATH = f'{DATA_BASE_FILEPATH}athlete_profiles.parquet'
+DISTRIBUTIONS_FILEPATH = f'{DATA_BASE_FILEPATH}metric_distributions.parquet'
+DATA_FILEPATHS = [FULL_ROUNDS_FILEPATH, FULL_ROUNDS_PARQUET_FILEPATH, LAPTIMES_FILEPATH, LAPTIMES_COMPRESSED_FILEPATH,
+                  LAPTIMES_PARQUET_FILEPATH]
+
+# only the columns used by the dashboard are loaded
+RACE_COLUMNS = ['season', 'competition', 'event', 'instance_of_event_in_competition', 'gender', 'round', 'race', 'Name',
+                ATHLETE_COLUMN]
+ROUNDS_COLUMNS = RACE_COLUMNS + ['Place', 'Start Pos.', 'Qual.', 'lap_1_position', 'lap_1_laptime']
+LAPTIMES_COLUMNS = RACE_COLUMNS + ['lap', 'laptime', 'lap_start_position', 'lap_end_position', 'position_change']
+# lap-over-lap columns, which laptimes files saved by older versions of the pipeline don't have
+LAP_DELTA_COLUMNS = ['previous_laptime', 'lap_delta']
+
+# number of athletes whose rows are kept in memory, shared by every session served by the process
+ATHLETE_CACHE_SIZE = 64
+
+
+def load_rounds() -> pd.DataFrame:
+    """
+    Load the round-by-round data for individual events, from the typed Parquet dataset if it has been generated.
+    """
+    if exists(FULL_ROUNDS_PARQUET_FILEPATH):
+        return keyed_by_athlete(pd.read_parquet(FULL_ROUNDS_PARQUET_FILEPATH, columns=ROUNDS_COLUMNS,
+                                                filters=[('event', 'in', INDIVIDUAL_EVENTS)]))
+
+    rounds = pd.read_csv(FULL_ROUNDS_FILEPATH, usecols=ROUNDS_COLUMNS)
+    rounds[['lap_1_position', 'lap_1_laptime']] = rounds[['lap_1_position', 'lap_1_laptime']].replace(0.0, np.nan)
+    return keyed_by_athlete(rounds[rounds['event'].isin(INDIVIDUAL_EVENTS)])
+
+
+def available_laptimes_columns(columns) -> list:
+    """
+    The columns of a laptimes file which the dashboard uses.
+    """
+    return [c for c in LAPTIMES_COLUMNS + LAP_DELTA_COLUMNS if c in columns]
+
+
+def load_laptimes() -> pd.DataFrame:
+    """
+    Load the lap-by-lap data, from the typed Parquet dataset if it has been generated.
+    """
+    if exists(LAPTIMES_PARQUET_FILEPATH):
+        columns = available_laptimes_columns(pq.read_schema(LAPTIMES_PARQUET_FILEPATH).names)
+        laptimes = pd.read_parquet(LAPTIMES_PARQUET_FILEPATH, columns=columns)
+    elif exists(LAPTIMES_FILEPATH):
+        laptimes = pd.read_csv(LAPTIMES_FILEPATH, usecols=lambda c: c in LAPTIMES_COLUMNS + LAP_DELTA_COLUMNS)
+    else:
+        laptimes = pd.read_pickle(LAPTIMES_COMPRESSED_FILEPATH, compression='zip')
+        laptimes = laptimes[available_laptimes_columns(laptimes.columns)]
+    return with_lap_deltas(keyed_by_athlete(laptimes))
+
+
+def keyed_by_athlete(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    The rows of df which belong to an athlete with an ISU ID, with the ISU IDs as integers.
+    """
+    ids = athlete_ids(df[ATHLETE_COLUMN])
+    keyed = ids != MISSING_ATHLETE
+    return df[keyed].assign(**{ATHLETE_COLUMN: ids[keyed]})
+
+
+def with_lap_deltas(laptimes: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the laptime of each athlete's previous lap in the race (if it was recorded) and the change from it, for
+    laptimes data which doesn't already have them.
+    """
+    if set(LAP_DELTA_COLUMNS).issubset(laptimes.columns):
+        return laptimes
+
+    laps = laptimes.sort_values(RACE_COLUMNS + ['lap'], kind='stable')
+    previous_laps = laps.groupby(RACE_COLUMNS, observed=True, sort=False)[['lap', 'laptime']].shift()
+    laps['previous_laptime'] = previous_laps['laptime'].where(previous_laps['lap'] == laps['lap'] - 1)
+    laps['lap_delta'] = laps['laptime'] - laps['previous_laptime']
+    return laps.sort_index()
+
+
+def select_event_subset(df, e):
+    """
+    Return only the rows of df which belong to the requested event.
+    """
+    return df[df['event'] == e]
+
+
+@lru_cache(maxsize=None)
+def row_group_ranges(filepath: str, column: str = ATHLETE_COLUMN) -> pd.DataFrame:
+    """
+    The smallest and largest value of a column in each row group of a Parquet file, read from the file's metadata.
+    """
+    metadata = pq.ParquetFile(filepath).metadata
+    column_index = metadata.schema.names.index(column)
+    statistics = [metadata.row_group(i).column(column_index).statistics for i in range(metadata.num_row_groups)]
+    has_range = [s is not None and s.has_min_max for s in statistics]
+    return pd.DataFrame({'min': [s.min if ok else -np.inf for s, ok in zip(statistics, has_range)],
+                         'max': [s.max if ok else np.inf for s, ok in zip(statistics, has_range)]})
+
+
+def read_athlete_rows(filepath: str, athlete_id: int, columns: list = None) -> pd.DataFrame:
+    """
+    Read one athlete's rows from a Parquet file sorted by athlete, skipping every row group which can't contain the
+    athlete.
+    """
+    row_groups = row_group_ranges(filepath)
+    row_groups = row_groups[(row_groups['min'] <= athlete_id) & (row_groups['max'] >= athlete_id)].index.tolist()
+    rows = pq.ParquetFile(filepath).read_row_groups(row_groups, columns=columns).to_pandas()
+    return rows[rows[ATHLETE_COLUMN] == athlete_id].reset_index(drop=True)
+
+
+@lru_cache(maxsize=None)
+def row_group_starts(filepath: str) -> np.ndarray:
+    """
+    The offset of the first row of each row group of a Parquet file, followed by the number of rows in the file.
+    """
+    metadata = pq.ParquetFile(filepath).metadata
+    return np.cumsum([0] + [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)])
+
+
+def read_rows(filepath: str, offsets: np.ndarray, columns: list = None) -> pd.DataFrame:
+    """
+    Read the rows at some offsets of a Parquet file, in order. Only the row groups containing them are read.
+    """
+    group_starts = row_group_starts(filepath)
+    groups = np.searchsorted(group_starts, offsets, side='right') - 1
+    row_groups = np.unique(groups)
+    table = pq.ParquetFile(filepath).read_row_groups(row_groups.tolist(), columns=columns)
+
+    # where each row group's rows start in the table read
+    group_sizes = group_starts[row_groups + 1] - group_starts[row_groups]
+    table_starts = np.cumsum(group_sizes) - group_sizes
+    positions = table_starts[np.searchsorted(row_groups, groups)] + offsets - group_starts[groups]
+    return table.take(positions).to_pandas()
+
+
+@lru_cache(maxsize=1)
+def all_rounds() -> pd.DataFrame:
+    """
+    Every athlete's rounds, for when there is no Parquet dataset to read single athletes from.
+    """
+    return load_rounds()
+
+
+@lru_cache(maxsize=1)
+def all_laptimes() -> pd.DataFrame:
+    """
+    Every athlete's laps, for when there is no Parquet dataset to read single athletes from.
+    """
+    return load_laptimes()
+
+
+@lru_cache(maxsize=None)
+def athlete_index() -> AthleteIndex:
+    """
+    Every athlete who has raced an individual event, by ISU ID, with each spelling of their name. Only the athlete,
+    name, event and season columns are read.
+    """
+    columns = [ATHLETE_COLUMN, 'Name', 'season']
+    if exists(FULL_ROUNDS_PARQUET_FILEPATH):
+        rounds = pd.read_parquet(FULL_ROUNDS_PARQUET_FILEPATH, columns=columns,
+                                 filters=[('event', 'in', INDIVIDUAL_EVENTS)])
+    else:
+        rounds = pd.read_csv(FULL_ROUNDS_FILEPATH, usecols=columns + ['event'])
+        rounds = rounds[rounds['event'].isin(INDIVIDUAL_EVENTS)]
+    return AthleteIndex.from_rounds(rounds)
+
+
+@lru_cache(maxsize=None)
+def rounds_offsets() -> RowOffsets:
+    """
+    Where each athlete's rounds in individual events are in the Parquet dataset (or in all_rounds, without one). Only
+    the athlete and event columns are read.
+    """
+    if exists(FULL_ROUNDS_PARQUET_FILEPATH):
+        rounds = pd.read_parquet(FULL_ROUNDS_PARQUET_FILEPATH, columns=[ATHLETE_COLUMN, 'event'])
+        return RowOffsets(np.where(rounds['event'].isin(INDIVIDUAL_EVENTS), athlete_ids(rounds[ATHLETE_COLUMN]),
+                                   MISSING_ATHLETE))
+    return RowOffsets(all_rounds()[ATHLETE_COLUMN].to_numpy())
+
+
+@lru_cache(maxsize=None)
+def laptimes_offsets() -> RowOffsets:
+    """
+    Where each athlete's laps are in the Parquet dataset (or in all_laptimes, without one). Only the athlete column is
+    read.
+    """
+    if exists(LAPTIMES_PARQUET_FILEPATH):
+        laptimes = pd.read_parquet(LAPTIMES_PARQUET_FILEPATH, columns=[ATHLETE_COLUMN])
+        return RowOffsets(athlete_ids(laptimes[ATHLETE_COLUMN]))
+    return RowOffsets(all_laptimes()[ATHLETE_COLUMN].to_numpy())
+
+
+@lru_cache(maxsize=ATHLETE_CACHE_SIZE)
+def athlete_rounds(athlete_id: int) -> pd.DataFrame:
+    """
+    One athlete's rounds in individual events. The result is cached and shared, so it must not be modified.
+    """
+    if exists(FULL_ROUNDS_PARQUET_FILEPATH):
+        return keyed_by_athlete(read_rows(FULL_ROUNDS_PARQUET_FILEPATH, rounds_offsets().rows(athlete_id),
+                                          columns=ROUNDS_COLUMNS))
+    return all_rounds().iloc[rounds_offsets().rows(athlete_id)]
+
+
+@lru_cache(maxsize=ATHLETE_CACHE_SIZE)
+def athlete_laptimes(athlete_id: int) -> pd.DataFrame:
+    """
+    One athlete's laps. The result is cached and shared, so it must not be modified.
+    """
+    if exists(LAPTIMES_PARQUET_FILEPATH):
+        columns = available_laptimes_columns(pq.read_schema(LAPTIMES_PARQUET_FILEPATH).names)
+        laptimes = read_rows(LAPTIMES_PARQUET_FILEPATH, laptimes_offsets().rows(athlete_id), columns=columns)
+        return with_lap_deltas(keyed_by_athlete(laptimes))
+    return all_laptimes().iloc[laptimes_offsets().rows(athlete_id)]
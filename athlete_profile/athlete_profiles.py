@@ -0,0 +1,357 @@
+from functools import lru_cache
+from logging import warning
+from os.path import exists, getmtime
+
+import numpy as np
+import pandas as pd
+
+import pyarrow.parquet as pq
+
+from athlete_data import ALL_EVENTS_NAME, EVENT_500M, EVENT_1500M, INDIVIDUAL_EVENTS, DATA_FILEPATHS, \
+    PROFILES_FILEPATH, DISTRIBUTIONS_FILEPATH, load_rounds, load_laptimes, athlete_index, athlete_rounds, \
+    athlete_laptimes, read_athlete_rows
+from athlete_search import ATHLETE_COLUMN
+
+# one row per athlete, statistic, event, selection (start position or position change) and histogram bin
+PROFILE_COLUMNS = [ATHLETE_COLUMN, 'statistic', 'event', 'selection', 'bin', 'value']
+# one row per athlete value of each single-value metric, by event, gender and season
+DISTRIBUTION_COLUMNS = ['statistic', 'event', 'gender', 'season', 'value']
+ALL_SEASONS_NAME = 'All'
+
+# the single-value metrics, with the event they describe and the precision they are displayed with
+METRIC_NAMES = {'half_lap_500m_mean': 'Mean 500m Half-Lap Start Time',
+                'fastest_leading_laptimes': 'Fastest Leading Laptimes',
+                'fastest_following_laptimes': 'Fastest Following Laptimes',
+                'pacing_1500m_leading': '1500m Leading Pace',
+                'pacing_1500m_instigation': '1500m Pace Instigation'}
+METRIC_EVENTS = {'half_lap_500m_mean': EVENT_500M,
+                 'fastest_leading_laptimes': ALL_EVENTS_NAME,
+                 'fastest_following_laptimes': ALL_EVENTS_NAME,
+                 'pacing_1500m_leading': EVENT_1500M,
+                 'pacing_1500m_instigation': EVENT_1500M}
+METRIC_DECIMALS = {'half_lap_500m_mean': 3,
+                   'fastest_leading_laptimes': 3,
+                   'fastest_following_laptimes': 3,
+                   'pacing_1500m_leading': 2,
+                   'pacing_1500m_instigation': 3}
+ADVANCING_QUALIFICATIONS = ['Q', 'q', 'QA', 'qA']
+HALF_LAP_MAX_TIME = 9  # thresholding at 9s to remove outliers
+HALF_LAP_BIN_WIDTH = 0.05
+FASTEST_LAPS_COUNT = 25
+PROFILE_ROW_GROUP_SIZE = 10000
+PROFILE_CACHE_SIZE = 1024
+VIEW_CACHE_SIZE = 4096
+
+
+def numeric(column: pd.Series) -> pd.Series:
+    """
+    Read a column as floats, with NaN wherever a value can't be read as a number.
+    """
+    return pd.to_numeric(column.astype(object), errors='coerce').astype(float)
+
+
+def count_bins(df: pd.DataFrame, statistic: str, column: str, selection: str = None,
+               by_event: bool = True) -> pd.DataFrame:
+    """
+    Count each athlete's rows of df in each value of column. Counts are made per event plus once over all events
+    (ALL_EVENTS_NAME), or only over all events if not by_event, and are split by the value of the selection column.
+    """
+    values = pd.DataFrame({ATHLETE_COLUMN: df[ATHLETE_COLUMN],
+                           'event': df['event'].astype(str) if by_event else ALL_EVENTS_NAME,
+                           'selection': numeric(df[selection]) if selection else np.nan,
+                           'bin': numeric(df[column])}).dropna(subset=['bin'])
+    if by_event:
+        values = pd.concat([values, values.assign(event=ALL_EVENTS_NAME)], ignore_index=True)
+
+    counts = values.groupby([ATHLETE_COLUMN, 'event', 'selection', 'bin'], dropna=False).size()
+    return counts.rename('value').astype(float).reset_index().assign(statistic=statistic)
+
+
+def metric_values(rounds: pd.DataFrame, laptimes: pd.DataFrame, by: list, statistics: list = None) -> pd.DataFrame:
+    """
+    The single-value dashboard metrics for each group of rounds and laptimes (e.g. by=[ATHLETE_COLUMN] for one value
+    per athlete), with one row per group and metric. All metrics are computed unless only some statistics are given.
+    """
+    rounds_500m = rounds[rounds['event'] == EVENT_500M]
+    rounds_500m = rounds_500m.assign(lap_1_laptime=numeric(rounds_500m['lap_1_laptime']))
+
+    laps_1500m = laptimes[laptimes['event'] == EVENT_1500M]
+    early_laps_1500m = laps_1500m[(laps_1500m['lap'] > 1) & (laps_1500m['lap'] < 5)]
+    leading_laps_1500m = early_laps_1500m[(early_laps_1500m['lap_start_position'] == 1) &
+                                          (early_laps_1500m['position_change'] == 0)]
+    early_passes_to_front = early_laps_1500m[(early_laps_1500m['lap_start_position'] > 1) &
+                                             (early_laps_1500m['lap_end_position'] == 1)]
+
+    # the amount that the athlete picks up the pace on the lap they pass to the front, compared to the lap before
+    early_passes_to_front = early_passes_to_front.dropna(subset=['lap_delta'])
+    early_passes_to_front = early_passes_to_front.assign(speed_up=-early_passes_to_front['lap_delta'])
+
+    fastest_laps = laptimes[by + ['lap_end_position', 'laptime']].dropna(subset=['laptime'])
+    fastest_laps = fastest_laps.sort_values('laptime', kind='stable')
+    leading = fastest_laps['lap_end_position'] == 1
+
+    metrics = {
+        'half_lap_500m_mean': lambda: rounds_500m.groupby(by, observed=True)['lap_1_laptime'].mean(),
+        'fastest_leading_laptimes': lambda: fastest_laps[leading].groupby(by, observed=True).head(FASTEST_LAPS_COUNT)
+        .groupby(by, observed=True)['laptime'].mean(),
+        'fastest_following_laptimes': lambda: fastest_laps[~leading].groupby(by, observed=True)
+        .head(FASTEST_LAPS_COUNT).groupby(by, observed=True)['laptime'].mean(),
+        'pacing_1500m_leading': lambda: leading_laps_1500m.groupby(by, observed=True)['laptime'].mean(),
+        'pacing_1500m_instigation': lambda: early_passes_to_front.groupby(by, observed=True)['speed_up'].mean(),
+    }
+    return pd.concat([metrics[statistic]().round(METRIC_DECIMALS[statistic]).rename('value').reset_index()
+                      .assign(statistic=statistic, event=METRIC_EVENTS[statistic])
+                      for statistic in (statistics or metrics)], ignore_index=True)
+
+
+def profile_statistics(rounds: pd.DataFrame, laptimes: pd.DataFrame) -> dict:
+    """
+    How to compute each histogram statistic of the profiles, and the single-value metrics (together, as 'metrics'),
+    for every athlete in rounds and laptimes. Each is a function returning the statistic's profile rows.
+    """
+    rounds = rounds.assign(lap_1_laptime=numeric(rounds['lap_1_laptime']))
+    rounds_500m = rounds[rounds['event'] == EVENT_500M]
+    half_laps_500m = rounds_500m[rounds_500m['lap_1_laptime'] < HALF_LAP_MAX_TIME]
+    half_laps_500m = half_laps_500m.assign(
+        lap_1_laptime=(np.floor((half_laps_500m['lap_1_laptime'] / HALF_LAP_BIN_WIDTH).round(6)) *
+                       HALF_LAP_BIN_WIDTH).round(2))
+    advancing_races = rounds[rounds['Qual.'].isin(ADVANCING_QUALIFICATIONS)]
+
+    def metrics():
+        return metric_values(rounds, laptimes, [ATHLETE_COLUMN]).assign(selection=np.nan, bin=np.nan)
+
+    return {
+        'start_positions': lambda: count_bins(rounds, 'start_positions', 'Start Pos.'),
+        'position_changes': lambda: count_bins(laptimes, 'position_changes', 'position_change', by_event=False),
+        'first_lap_positions': lambda: count_bins(rounds, 'first_lap_positions', 'lap_1_position'),
+        'half_lap_500m_hist': lambda: count_bins(half_laps_500m, 'half_lap_500m_hist', 'lap_1_laptime'),
+        'start_performance_500m': lambda: count_bins(rounds_500m, 'start_performance_500m', 'lap_1_position',
+                                                     selection='Start Pos.'),
+        'likely_lap_to_pass': lambda: count_bins(laptimes, 'likely_lap_to_pass', 'lap', selection='position_change'),
+        'x_plus_y_position_selection': lambda: count_bins(advancing_races, 'x_plus_y_position_selection', 'Place'),
+        'metrics': metrics,
+    }
+
+
+def build_profiles(rounds: pd.DataFrame, laptimes: pd.DataFrame) -> pd.DataFrame:
+    """
+    Precompute every statistic shown on the dashboard, for every athlete in rounds and laptimes: histogram bin counts
+    per event, the single-value metrics and the widget options.
+    """
+    profiles = pd.concat([statistic() for statistic in profile_statistics(rounds, laptimes).values()],
+                         ignore_index=True)[PROFILE_COLUMNS]
+
+    for col in ['statistic', 'event']:
+        profiles[col] = profiles[col].astype('category')
+    return profiles.sort_values(PROFILE_COLUMNS[:-1], ignore_index=True)
+
+
+def build_metric_distributions(rounds: pd.DataFrame, laptimes: pd.DataFrame) -> pd.DataFrame:
+    """
+    The values of every single-value metric across all athletes, per event and gender, over all seasons
+    (ALL_SEASONS_NAME) and within each season. Values are sorted within each distribution.
+    """
+    distributions = pd.concat([
+        metric_values(rounds, laptimes, ['gender', ATHLETE_COLUMN]).assign(season=ALL_SEASONS_NAME),
+        metric_values(rounds, laptimes, ['gender', 'season', ATHLETE_COLUMN]),
+    ], ignore_index=True)[DISTRIBUTION_COLUMNS].dropna()
+
+    for col in ['statistic', 'event', 'gender', 'season']:
+        distributions[col] = distributions[col].astype(str).astype('category')
+    return distributions.sort_values(DISTRIBUTION_COLUMNS, ignore_index=True)
+
+
+def save_profiles(profiles: pd.DataFrame):
+    """
+    Write the precomputed profiles to the profile store, sorted by athlete so that one athlete's profile can be read
+    on its own.
+    """
+    profiles.to_parquet(PROFILES_FILEPATH, index=False, row_group_size=PROFILE_ROW_GROUP_SIZE)
+
+
+def save_metric_distributions(distributions: pd.DataFrame):
+    """
+    Write the metric distributions across athletes to the percentile index.
+    """
+    distributions.to_parquet(DISTRIBUTIONS_FILEPATH, index=False)
+
+
+@lru_cache(maxsize=None)
+def store_current(filepath: str, columns: tuple = ()) -> bool:
+    """
+    Whether a precomputed store exists, has the columns and was built after the data files were last modified. Checked
+    once per process.
+    """
+    data_modified = max([getmtime(filepath) for filepath in DATA_FILEPATHS if exists(filepath)], default=0)
+    return exists(filepath) and getmtime(filepath) >= data_modified and \
+        set(columns).issubset(pq.read_schema(filepath).names)
+
+
+@lru_cache(maxsize=None)
+def profiles_current() -> bool:
+    """
+    Whether the profile store can be read, warning once per process if it can't.
+    """
+    if store_current(PROFILES_FILEPATH, (ATHLETE_COLUMN,)):
+        return True
+    warning(f'{PROFILES_FILEPATH} is missing or out of date, so each athlete\'s profile is built from their data. '
+            f'Rebuild it with `python athlete_profile/athlete_profiles.py`.')
+    return False
+
+
+@lru_cache(maxsize=PROFILE_CACHE_SIZE)
+def athlete_profile(athlete_id: int) -> pd.DataFrame:
+    """
+    The profile rows of one athlete, read from the profile store. If the store is missing or out of date (or was built
+    by athlete name, before athletes were keyed by ISU ID), the profile is built from the athlete's data instead.
+    """
+    if profiles_current():
+        return read_athlete_rows(PROFILES_FILEPATH, athlete_id)
+    return build_profiles(athlete_rounds(athlete_id), athlete_laptimes(athlete_id))
+
+
+def athlete_search(query: str = '') -> dict:
+    """
+    The athletes best matching a search of their names, as {name: ISU ID} options for the athlete picker.
+    """
+    index = athlete_index()
+    return index.options(index.search(query))
+
+
+def athlete_statistic(athlete_id: int, statistic: str) -> pd.DataFrame:
+    """
+    One athlete's profile rows for one statistic.
+    """
+    profile = athlete_profile(athlete_id)
+    return profile[profile['statistic'] == statistic]
+
+
+def athlete_histogram(athlete_id: int, statistic: str, event: str = ALL_EVENTS_NAME, selection=None) -> pd.Series:
+    """
+    Bin counts of one of an athlete's histograms, indexed by bin.
+    """
+    rows = athlete_statistic(athlete_id, statistic)
+    rows = rows[rows['event'] == event]
+    if selection is not None:
+        rows = rows[rows['selection'] == selection]
+    return rows.set_index('bin')['value']
+
+
+def athlete_metric_value(athlete_id: int, statistic: str, default: float = np.nan) -> float:
+    """
+    One of an athlete's single-value metrics.
+    """
+    rows = athlete_statistic(athlete_id, statistic)
+    return rows['value'].iloc[0] if len(rows) else default
+
+
+@lru_cache(maxsize=VIEW_CACHE_SIZE)
+def athlete_options(athlete_id: int) -> (list, list, list):
+    """
+    The event distances, start positions and position changes available to select for one athlete.
+    """
+    start_positions = athlete_statistic(athlete_id, 'start_positions')
+    events = [event for event in INDIVIDUAL_EVENTS if event in start_positions['event'].values] + [ALL_EVENTS_NAME]
+    start_positions = start_positions[start_positions['event'] == ALL_EVENTS_NAME]['bin'].astype(int).tolist()
+    position_changes = athlete_statistic(athlete_id, 'position_changes')['bin'].astype(int).tolist()
+    return events, start_positions, position_changes
+
+
+@lru_cache(maxsize=VIEW_CACHE_SIZE)
+def athlete_view(athlete_id: int, event: str, start_position: int, position_change: int) -> dict:
+    """
+    Everything the dashboard displays for one athlete and one selection of event distance, start position and
+    position change.
+    """
+    return {
+        'first_lap_positions': athlete_histogram(athlete_id, 'first_lap_positions', event),
+        'half_lap_500m_mean': athlete_metric_value(athlete_id, 'half_lap_500m_mean'),
+        'half_lap_500m_hist': athlete_histogram(athlete_id, 'half_lap_500m_hist', EVENT_500M),
+        'start_performance_500m': athlete_histogram(athlete_id, 'start_performance_500m', EVENT_500M, start_position),
+        'fastest_leading_laptimes': athlete_metric_value(athlete_id, 'fastest_leading_laptimes'),
+        'fastest_following_laptimes': athlete_metric_value(athlete_id, 'fastest_following_laptimes'),
+        'likely_lap_to_pass': athlete_histogram(athlete_id, 'likely_lap_to_pass', event, position_change),
+        'x_plus_y_position_selection': athlete_histogram(athlete_id, 'x_plus_y_position_selection', event),
+        'pacing_1500m_leading': athlete_metric_value(athlete_id, 'pacing_1500m_leading'),
+        'pacing_1500m_instigation': athlete_metric_value(athlete_id, 'pacing_1500m_instigation', default=0),
+    }
+
+
+@lru_cache(maxsize=None)
+def metric_distributions() -> dict:
+    """
+    The sorted values of each single-value metric across athletes, keyed by (statistic, gender, season). Loaded once
+    per process from the percentile index, or None if it hasn't been built: building it here would load every
+    athlete's data into the dashboard process.
+    """
+    if not exists(DISTRIBUTIONS_FILEPATH):
+        warning(f'{DISTRIBUTIONS_FILEPATH} is missing, so athletes are not compared to each other. Build it with '
+                f'`python athlete_profile/athlete_profiles.py`.')
+        return None
+    if not store_current(DISTRIBUTIONS_FILEPATH):
+        warning(f'{DISTRIBUTIONS_FILEPATH} was built before the data was last updated. Rebuild it with '
+                f'`python athlete_profile/athlete_profiles.py`.')
+    distributions = pd.read_parquet(DISTRIBUTIONS_FILEPATH)
+    return {key: group['value'].to_numpy()
+            for key, group in distributions.groupby(['statistic', 'gender', 'season'], observed=True)}
+
+
+def comparison_available() -> bool:
+    """
+    Whether athletes can be compared to each other, i.e. the percentile index has been built.
+    """
+    return metric_distributions() is not None
+
+
+def percentile(values: np.ndarray, value: float) -> float:
+    """
+    The percentage of the sorted values which are no greater than value, found by binary search.
+    """
+    return 100 * np.searchsorted(values, value, side='right') / len(values)
+
+
+@lru_cache(maxsize=VIEW_CACHE_SIZE)
+def athlete_seasons(athlete_id: int) -> list:
+    """
+    The seasons an athlete can be compared to the other athletes in.
+    """
+    return [ALL_SEASONS_NAME] + sorted(athlete_rounds(athlete_id)['season'].astype(str).unique(), reverse=True)
+
+
+@lru_cache(maxsize=VIEW_CACHE_SIZE)
+def athlete_comparison(athlete_id: int, season: str = ALL_SEASONS_NAME) -> pd.DataFrame:
+    """
+    Each of an athlete's single-value metrics, with the median and the athlete's percentile among all athletes of the
+    same gender, over all seasons or within one season. The median and percentile are missing if the percentile
+    index hasn't been built.
+    """
+    distributions = metric_distributions() or dict()
+    rounds = athlete_rounds(athlete_id)
+    laptimes = athlete_laptimes(athlete_id)
+    if season != ALL_SEASONS_NAME:
+        rounds = rounds[rounds['season'] == season]
+        laptimes = laptimes[laptimes['season'] == season]
+    values = metric_values(rounds, laptimes, [ATHLETE_COLUMN]).set_index('statistic')['value']
+    gender = rounds['gender'].astype(str).mode()
+    gender = gender.iloc[0] if len(gender) else None
+
+    comparison = list()
+    for statistic, metric_name in METRIC_NAMES.items():
+        value = values.get(statistic, np.nan)
+        distribution = distributions.get((statistic, gender, season), np.array([]))
+        comparison.append({'Metric': metric_name,
+                           'Athlete': value,
+                           'Median': np.median(distribution) if len(distribution) else np.nan,
+                           'Percentile': round(percentile(distribution, value), 1)
+                           if len(distribution) and not np.isnan(value) else np.nan,
+                           'Athletes': len(distribution)})
+    return pd.DataFrame(comparison)
+
+
+if __name__ == '__main__':
+    # build the profile store and percentile index (also run by the pipeline after each crawl that adds races):
+    # `DATASET=full python athlete_profile/athlete_profiles.py`
+    all_rounds = load_rounds()
+    all_laptimes = load_laptimes()
+    save_profiles(build_profiles(all_rounds, all_laptimes))
+    save_metric_distributions(build_metric_distributions(all_rounds, all_laptimes))
@@ -0,0 +1,166 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# athletes are keyed by their ISU ID, which stays the same when their name is written differently from one season to
+# the next; rows without one (e.g. relay teams) are left out of the index
+ATHLETE_COLUMN = 'ISU ID'
+MISSING_ATHLETE = -1
+# number of athletes offered by the picker for a search
+SEARCH_LIMIT = 20
+# share of the trigrams of a search which a name must contain to be matched by trigrams
+TRIGRAM_MATCH_SHARE = 0.6
+NON_NAME_CHARS = re.compile(r'[\W_]+')
+
+
+def athlete_ids(column: pd.Series) -> np.ndarray:
+    """
+    The ISU ID of each row's athlete as an integer, with MISSING_ATHLETE where there is none.
+    """
+    ids = pd.to_numeric(column.astype(object), errors='coerce')
+    return ids.fillna(MISSING_ATHLETE).to_numpy(dtype=np.int64)
+
+
+def search_text(name: str) -> str:
+    """
+    A name (or a search) as it is matched: lower case, without spaces or punctuation (e.g. "KWAKYoon-Gy" becomes
+    "kwakyoongy", as does the search "Kwak Yoon Gy").
+    """
+    return NON_NAME_CHARS.sub('', str(name).casefold())
+
+
+def trigrams(text: str) -> set:
+    """
+    Every run of three characters in a search text.
+    """
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class RowOffsets(object):
+    """
+    Where each athlete's rows are in a store of rows (e.g. a Parquet file), as runs of consecutive row offsets. Stores
+    which are sorted by athlete have one run per athlete in each of their event and gender groups, but the offsets are
+    right for rows in any order.
+    """
+
+    def __init__(self, ids: np.ndarray):
+        ids = np.asarray(ids, dtype=np.int64)
+        run_starts = np.flatnonzero(np.diff(ids, prepend=MISSING_ATHLETE - 1))
+        run_stops = np.append(run_starts[1:], len(ids))
+        run_ids = ids[run_starts]
+        keep = run_ids != MISSING_ATHLETE
+        order = np.argsort(run_ids[keep], kind='stable')
+        self.run_ids = run_ids[keep][order]
+        self.starts = run_starts[keep][order]
+        self.stops = run_stops[keep][order]
+
+        # the first and last (exclusive) run of each athlete, for lookups without a search
+        athletes, first_runs, run_counts = np.unique(self.run_ids, return_index=True, return_counts=True)
+        self.athlete_runs = dict(zip(athletes.tolist(), zip(first_runs.tolist(), (first_runs + run_counts).tolist())))
+
+    def rows(self, athlete_id: int) -> np.ndarray:
+        """
+        The offsets of every row of one athlete, in store order.
+        """
+        first, last = self.athlete_runs.get(athlete_id, (0, 0))
+        if first == last:
+            return np.array([], dtype=np.int64)
+        return np.concatenate([np.arange(start, stop) for start, stop in zip(self.starts[first:last],
+                                                                              self.stops[first:last])])
+
+
+class AthleteIndex(object):
+    """
+    Every athlete who can be selected, keyed by ISU ID, with each spelling of their name that appears in the data.
+
+    Athletes are found by name with a type-ahead search: names starting with the search come first (found by binary
+    search in the sorted names), then names sharing most of its trigrams, which also finds text in the middle of a name
+    and near misspellings.
+    """
+
+    def __init__(self, athletes: pd.DataFrame):
+        # one row per athlete, indexed by ISU ID and sorted by name: the name shown and every spelling of it
+        self.athletes = athletes
+        positions = np.arange(len(athletes))
+
+        # every spelling of every name, sorted for prefix searches
+        variants = athletes['names'].explode()
+        variant_text = np.array([search_text(name) for name in variants], dtype=str)
+        order = np.argsort(variant_text, kind='stable')
+        self.variant_text = variant_text[order]
+        self.variant_athletes = np.repeat(positions, athletes['names'].map(len))[order]
+
+        # the athletes with each trigram in one of their names
+        postings = dict()
+        for position, names in zip(positions, athletes['names']):
+            for trigram in set().union(*(trigrams(search_text(name)) for name in names)):
+                postings.setdefault(trigram, list()).append(position)
+        self.trigram_athletes = {trigram: np.array(posting, dtype=np.int64) for trigram, posting in postings.items()}
+
+        # names shared by more than one athlete
+        self.shared_names = set(athletes['name'][athletes['name'].duplicated()])
+
+    @classmethod
+    def from_rounds(cls, rounds: pd.DataFrame) -> 'AthleteIndex':
+        """
+        Index the athletes of a rounds dataset (with at least the ISU ID, Name and season columns). An athlete
+        is shown by the name of their latest season.
+        """
+        rounds = pd.DataFrame({'athlete': athlete_ids(rounds[ATHLETE_COLUMN]),
+                               'name': rounds['Name'].astype(object),
+                               'season': rounds['season'].astype(str)}).dropna(subset=['name'])
+        rounds = rounds[rounds['athlete'] != MISSING_ATHLETE]
+        names = rounds.groupby(['athlete', 'name'], sort=False)['season'].max().reset_index()
+        names = names.sort_values(['athlete', 'season'], ascending=[True, False], kind='stable')
+        athletes = names.groupby('athlete')['name'].agg(name='first', names=tuple)
+        athletes.index.name = ATHLETE_COLUMN
+        return cls(athletes.sort_values('name', kind='stable'))
+
+    def __len__(self) -> int:
+        return len(self.athletes)
+
+    def __contains__(self, athlete_id) -> bool:
+        return athlete_id in self.athletes.index
+
+    def name(self, athlete_id: int) -> str:
+        return self.athletes.at[athlete_id, 'name']
+
+    def names(self, athlete_id: int) -> tuple:
+        """
+        Every spelling of an athlete's name, latest first.
+        """
+        return self.athletes.at[athlete_id, 'names']
+
+    def search(self, query: str = '', limit: int = SEARCH_LIMIT) -> list:
+        """
+        The ISU IDs of the athletes best matching a search, or the first athletes by name for an empty search.
+        """
+        text = search_text(query)
+        if not text:
+            return self.athletes.index[:limit].tolist()
+
+        # names starting with the search
+        first = np.searchsorted(self.variant_text, text, side='left')
+        last = np.searchsorted(self.variant_text, text + '\U0010ffff', side='left')
+        matches = list(dict.fromkeys(self.variant_athletes[first:last].tolist()))
+
+        # names sharing most of the search's trigrams, the most shared first
+        search_trigrams = trigrams(text)
+        if len(matches) < limit and search_trigrams:
+            postings = [self.trigram_athletes[trigram] for trigram in search_trigrams
+                        if trigram in self.trigram_athletes]
+            if postings:
+                shared = np.bincount(np.concatenate(postings), minlength=len(self.athletes))
+                candidates = np.flatnonzero(shared >= TRIGRAM_MATCH_SHARE * len(search_trigrams))
+                candidates = candidates[np.argsort(-shared[candidates], kind='stable')]
+                prefix_matches = set(matches)
+                matches.extend(position for position in candidates.tolist() if position not in prefix_matches)
+        return self.athletes.index[matches[:limit]].tolist()
+
+    def options(self, ids: list) -> dict:
+        """
+        Picker options for some athletes, as {label: ISU ID}. Athletes sharing a name are told apart by their ISU ID.
+        """
+        return {f'{name} ({athlete_id})' if name in self.shared_names else name: athlete_id
+                for athlete_id, name in zip(ids, self.athletes.loc[ids, 'name'])}
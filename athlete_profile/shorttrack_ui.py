@@ -1,302 +1,216 @@
-from os import environ
-from os.path import exists
-
-import pandas as pd
 import numpy as np
-
-import seaborn as sns
-import matplotlib.pyplot as plt
 import panel as pn
 import panel.widgets as pnw
+from bokeh.models import ColumnDataSource
+from bokeh.plotting import figure
+
+from athlete_data import ALL_EVENTS_NAME
+from athlete_profiles import HALF_LAP_BIN_WIDTH, ALL_SEASONS_NAME, athlete_search, athlete_options, athlete_view, \
+    athlete_seasons, athlete_comparison, comparison_available
 
 # constants
-ALL_EVENTS_NAME = 'All'
-EVENT_500M = '500m'
-EVENT_1000M = '1000m'
-EVENT_1500M = '1500m'
 DEFAULT_START_POSITION = 1
 DEFAULT_POSITION_CHANGE = 1
-DATA_BASE_FILEPATH = f'./data/{environ.get("DATASET", "full")}/'  # default to full dataset
-FULL_ROUNDS_FILEPATH = f'{DATA_BASE_FILEPATH}rounds_with_splits.csv'
-LAPTIMES_FILENAME = 'individual_athlete_lap_data.csv'
-LAPTIMES_FILEPATH = f'{DATA_BASE_FILEPATH}{LAPTIMES_FILENAME}'
-LAPTIMES_COMPRESSED_FILEPATH = f'{DATA_BASE_FILEPATH}individual_athlete_lap_data.pk'
+PLOT_HEIGHT = 300
 
 pn.config.sizing_mode = 'stretch_width'
 
-# data load: round-by-round
-full_rounds = pd.read_csv(FULL_ROUNDS_FILEPATH)
-pos_cols = [f'lap_{x}_position' for x in range(1, 46)]
-laptime_cols = [f'lap_{x}_laptime' for x in range(1, 46)]
-full_rounds[pos_cols] = full_rounds[pos_cols].replace(0.0, np.nan)
-full_rounds[laptime_cols] = full_rounds[laptime_cols].replace(0.0, np.nan)
-
-# data load: laptimes
-laptimes = pd.read_csv(LAPTIMES_FILEPATH) if exists(LAPTIMES_FILEPATH) else pd.read_pickle(LAPTIMES_COMPRESSED_FILEPATH)
-individual_events = full_rounds[full_rounds['event'].isin({'500m', '1000m', '1500m'})]
-
 
 # helper functions
-def select_event_subset(df, e):
-    """
-    Return only the rows of df which belong to the requested event.
-    """
-    return df[df['event'] == e]
-
-
-def get_ax():
-    fig = plt.Figure()
-    ax = fig.add_subplot(111)
-    return fig, ax
-
-
-# declare variable widgets
-athlete_name = pnw.Select(name='Athlete', options=list(individual_events['Name'].unique()))
-event_distance = pnw.RadioButtonGroup(name='Event', value=ALL_EVENTS_NAME)
-start_position = pnw.RadioButtonGroup(name='Start Position')
-position_gain_loss = pnw.RadioButtonGroup(name='Position Gain/Loss')
-athlete_races = pnw.DataFrame()
-athlete_races_single_event = pnw.DataFrame()
-athlete_laptimes = pnw.DataFrame()
-athlete_laptimes_single_event = pnw.DataFrame()
-
-
-def athlete_name_changed(event):
-    """
-    Triggering event is athlete_name.value
-    """
-    athlete_races.value = individual_events[individual_events['Name'] == event.new]
-    athlete_laptimes.value = laptimes[laptimes['Name'] == event.new]
-
-    event_distance.options = list(athlete_races.value['event'].unique()) + [ALL_EVENTS_NAME]
-    if event_distance.value not in event_distance.options:
-        # if the new event distance options don't contain the current event_distance value, default to ALL_EVENTS_NAME
-        event_distance.value = ALL_EVENTS_NAME
-    else:
-        # if there was no change, trigger the widget refresh manually
-        event_distance.param.trigger('value')
-
-
-def event_distance_changed(event):
-    """
-    Triggering event is event_distance.value
-    """
-    if event.new == ALL_EVENTS_NAME:
-        athlete_races_single_event.value = athlete_races.value
-        athlete_laptimes_single_event.value = athlete_laptimes.value
-    else:
-        athlete_races_single_event.value = athlete_races.value[athlete_races.value['event'] == event.new]
-        athlete_laptimes_single_event.value = athlete_laptimes.value[athlete_laptimes.value['event'] == event.new]
-
-    start_position.options = list(athlete_races.value['Start Pos.'].unique())
-    position_gain_loss.options = list(athlete_laptimes.value['position_change'].unique())
-
-    if start_position.value not in start_position.options:
-        start_position.value = DEFAULT_START_POSITION
-    if position_gain_loss.value not in position_gain_loss.options:
-        position_gain_loss.value = DEFAULT_POSITION_CHANGE
-
-
-# declare reloading between widgets
-athlete_name.param.watch(athlete_name_changed, 'value')
-event_distance.param.watch(event_distance_changed, 'value')
-
-# trigger initial widget dependencies
-athlete_name.param.trigger('value')
-
-
-@pn.depends(athlete_races_single_event)
-def first_lap_positions(athlete_races_single_event__):
-    """
-    The position in the pack that the athlete likes to start this event distance.
-    """
-    fig, ax = get_ax()
-    sns.histplot(data=athlete_races_single_event__,
-                 x="lap_1_position",
-                 stat="probability",
-                 ax=ax,
-                 discrete=True).set_title(f'Early Selection of Position in Pack - {event_distance.value}')
-    return fig
-
-
-@pn.depends(athlete_races)
-def half_lap_500m_mean(athlete_races__):
-    """
-    The athlete's average 500m half-lap start time.
-    """
-    athlete_races_500m = select_event_subset(athlete_races__, EVENT_500M)
-    mean_start_time = round(athlete_races_500m['lap_1_laptime'].astype('float').mean(), 3)
-    return pn.indicators.Number(name='Mean 500m Half-Lap Start Time',
-                                value=mean_start_time,
-                                format='{value}s')
-
-
-@pn.depends(athlete_races)
-def half_lap_500m_hist(athlete_races__):
-    """
-    Histogram of the athlete's 500m half-lap start time (thresholding at 9s to remove outliers).
-    """
-    athlete_races_500m = select_event_subset(athlete_races__, EVENT_500M)
-    athlete_races_500m = athlete_races_500m.astype({'lap_1_laptime': float})
-
-    thresholded_start_times = athlete_races_500m[athlete_races_500m['lap_1_laptime'] < 9]
-    fig, ax = get_ax()
-    sns.histplot(data=thresholded_start_times,
-                 ax=ax,
-                 x="lap_1_laptime").set_title('500m Half-Lap Start Times')
-
-    return fig
-
-
-@pn.depends(start_position, athlete_races)
-def start_performance_500m(start_position__, athlete_races__):
-    """
-    A histogram of the position the athlete is in after the first half-lap of the 500m, for the selected start position.
-    """
-    athlete_races_500m = athlete_races__[athlete_races__['event'] == EVENT_500M]
-    start_performances = athlete_races_500m[athlete_races_500m['Start Pos.'] == int(start_position__)]
-    start_performances = start_performances.astype({'lap_1_position': float})
-
-    fig, ax = get_ax()
-    sns.histplot(data=start_performances,
-                 x="lap_1_position",
-                 ax=ax).set_title(f'500m Start Result from Lane {start_position__}')
-    return fig
-
-
-@pn.depends(athlete_laptimes)
-def fastest_leading_laptimes(athlete_laptimes__):
-    """
-    The average of the 25 fastest laptimes achieved by the athlete when leading the race.
-    """
-    return pn.indicators.Number(name='Fastest Leading Laptimes',
-                                value=round(athlete_laptimes__[athlete_laptimes__['lap_end_position'] == 1][
-                                                'laptime'].nsmallest(25).mean(), 3),
-                                format='{value}s')
-
-
-@pn.depends(athlete_laptimes)
-def fastest_following_laptimes(athlete_laptimes__):
-    """
-    The average of the 25 fastest laptimes achieved by the athlete when not leading the race.
-    """
-    return pn.indicators.Number(name='Fastest Following Laptimes',
-                                value=round(athlete_laptimes__[athlete_laptimes__['lap_end_position'] != 1][
-                                                'laptime'].nsmallest(25).mean(), 3),
-                                format='{value}s')
-
-
-@pn.depends(athlete_laptimes_single_event, position_gain_loss)
-def likely_lap_to_pass(athlete_laptimes_single_event__, position_gain_loss__):
-    """
-    A histogram of how often an athlete makes a pass (or gets passed) on a particular lap, for the selected number of
-    positions gained/lost in the selected event distance.
-    """
-    selected_passes = athlete_laptimes_single_event__[
-        athlete_laptimes_single_event__['position_change'] == position_gain_loss__]
-
-    fig, ax = get_ax()
-    sns.histplot(data=selected_passes,
-                 x="lap",
-                 ax=ax).set_title(f'Passes on each Lap of {position_gain_loss__} Positions')
-    return fig
-
-
-@pn.depends(athlete_races_single_event)
-def x_plus_y_position_selection(athlete_races_single_event__):
-    """
-    A histogram displaying which advancing position an athlete selects, when there are multiple available.
-    """
-    advancing_races = athlete_races_single_event__[athlete_races_single_event__['Qual.'].isin(['Q', 'q', 'QA', 'qA'])]
-    advancing_races = advancing_races.astype({'Place': int})
-
-    fig, ax = get_ax()
-    sns.histplot(data=advancing_races,
-                 x="Place",
-                 ax=ax).set_title('X + Y Position Selection')
-    return fig
-
-
-@pn.depends(athlete_laptimes)
-def pacing_1500m_leading(athlete_laptimes__):
-    """
-    The average pace that the athlete likes to skate when leading the first 4 laps of the 1500m event.
-
-    The amount that the athlete likes to pick up the pace when making a pass in the first 4 laps of the 1500m distance
-    """
-    laps = select_event_subset(athlete_laptimes__, EVENT_1500M)
-    leading_pace = laps[(laps['lap'] > 1) &
-                        (laps['lap'] < 5) &
-                        (laps['lap_start_position'] == 1) &
-                        (laps['position_change'] == 0)]['laptime'].mean()
-
-    return pn.indicators.Number(name='1500m Leading Pace',
-                                value=round(leading_pace, 2),
-                                format='{value}s')
-
-
-@pn.depends(athlete_laptimes)
-def pacing_1500m_instigation(athlete_laptimes__):
-    """
-    The average pace that the athlete likes to skate when leading the first 4 laps of the 1500m event.
-
-    The amount that the athlete likes to pick up the pace when making a pass in the first 4 laps of the 1500m distance
-    """
-    laps = select_event_subset(athlete_laptimes__, EVENT_1500M)
-    early_passes_to_front = laps[(laps['lap'] > 1) &
-                                 (laps['lap'] < 5) &
-                                 (laps['lap_start_position'] > 1) &
-                                 (laps['lap_end_position'] == 1)]
-
-    speed_up_sum = 0
-    denominator = len(early_passes_to_front)
-
-    for idx, early_pass in early_passes_to_front.iterrows():
-        previous_laptime = laps[(laps['season'] == early_pass['season']) &
-                                (laps['competition'] == early_pass['competition']) &
-                                (laps['event'] == early_pass['event']) &
-                                (laps['gender'] == early_pass['gender']) &
-                                (laps['round'] == early_pass['round']) &
-                                (laps['race'] == early_pass['race']) &
-                                (laps['instance_of_event_in_competition'] ==
-                                 early_pass['instance_of_event_in_competition']) &
-                                (laps['lap'] == early_pass['lap'] - 1)]
-        if len(previous_laptime):
-            speed_up_sum += previous_laptime.iloc[0]['laptime'] - early_pass['laptime']
+def histogram_plot(x_label: str, y_label: str = 'Count', bar_width: float = 1) -> (figure, ColumnDataSource):
+    """
+    A bar chart of histogram bin counts. The plot is kept for the whole session, and its data source is updated in
+    place whenever the selection changes.
+    """
+    source = ColumnDataSource(data=dict(bin=np.array([]), value=np.array([])))
+    plot = figure(height=PLOT_HEIGHT, x_axis_label=x_label, y_axis_label=y_label, tools='', toolbar_location=None,
+                  sizing_mode='stretch_width')
+    plot.vbar(x='bin', top='value', width=bar_width, source=source, line_color='white')
+    plot.y_range.start = 0
+    return plot, source
+
+
+def update_histogram(plot: figure, source: ColumnDataSource, counts, title: str, bin_offset: float = 0,
+                     probability: bool = False):
+    """
+    Replace the bars of a histogram plot with the precomputed bin counts, indexed by bin. Only changes are sent to the
+    browser.
+    """
+    bins = counts.index.to_numpy(dtype=float) + bin_offset
+    values = counts.to_numpy(dtype=float)
+    if probability and values.sum():
+        values = values / values.sum()
+
+    if not (np.array_equal(source.data['bin'], bins) and np.array_equal(source.data['value'], values)):
+        source.data = dict(bin=bins, value=values)
+    if plot.title.text != title:
+        plot.title.text = title
+
+
+class AthleteProfileDashboard(object):
+    """
+    The widgets, plots and indicators of one dashboard session. The athlete data and profiles behind them are loaded
+    once per process and shared by every session.
+    """
+
+    def __init__(self):
+        # declare variable widgets; only the athletes matching the search are sent to the browser, by ISU ID
+        self.athlete_search = pnw.TextInput(name='Find Athlete', placeholder='Type part of a name')
+        self.athlete = pnw.Select(name='Athlete', options=athlete_search())
+        self.event_distance = pnw.RadioButtonGroup(name='Event', value=ALL_EVENTS_NAME)
+        self.start_position = pnw.RadioButtonGroup(name='Start Position')
+        self.position_gain_loss = pnw.RadioButtonGroup(name='Position Gain/Loss')
+        self.comparison_season = pnw.Select(name='Comparison Season', value=ALL_SEASONS_NAME)
+
+        # the position in the pack that the athlete likes to start this event distance
+        self.first_lap_positions = histogram_plot('lap_1_position', y_label='Probability')
+        # histogram of the athlete's 500m half-lap start time (thresholding at 9s to remove outliers)
+        self.half_lap_500m_hist = histogram_plot('lap_1_laptime', bar_width=HALF_LAP_BIN_WIDTH)
+        # the position the athlete is in after the first half-lap of the 500m, for the selected start position
+        self.start_performance_500m = histogram_plot('lap_1_position')
+        # how often an athlete makes a pass (or gets passed) on a particular lap, for the selected number of positions
+        # gained/lost in the selected event distance
+        self.likely_lap_to_pass = histogram_plot('lap')
+        # which advancing position an athlete selects, when there are multiple available
+        self.x_plus_y_position_selection = histogram_plot('Place')
+
+        # the athlete's average 500m half-lap start time
+        self.half_lap_500m_mean = pn.indicators.Number(name='Mean 500m Half-Lap Start Time', format='{value}s')
+        # the average of the 25 fastest laptimes achieved by the athlete when leading the race
+        self.fastest_leading_laptimes = pn.indicators.Number(name='Fastest Leading Laptimes', format='{value}s')
+        # the average of the 25 fastest laptimes achieved by the athlete when not leading the race
+        self.fastest_following_laptimes = pn.indicators.Number(name='Fastest Following Laptimes', format='{value}s')
+        # the average pace that the athlete likes to skate when leading the first 4 laps of the 1500m event
+        self.pacing_1500m_leading = pn.indicators.Number(name='1500m Leading Pace', format='{value}s')
+        # the amount that the athlete likes to pick up the pace when making a pass in the first 4 laps of the 1500m
+        self.pacing_1500m_instigation = pn.indicators.Number(name='1500m Pace Instigation', format='{value}s')
+
+        # the athlete's metrics compared to every other athlete of the same gender
+        self.comparison = pn.pane.DataFrame(index=False)
+
+        # declare reloading between widgets
+        self.athlete_search.param.watch(self.athlete_search_changed, 'value_input')
+        self.athlete.param.watch(self.athlete_changed, 'value')
+        for widget in [self.event_distance, self.start_position, self.position_gain_loss]:
+            widget.param.watch(self.refresh_view, 'value')
+        self.comparison_season.param.watch(self.refresh_comparison, 'value')
+
+        # trigger initial widget dependencies
+        self.athlete.param.trigger('value')
+
+    def current_view(self) -> dict:
+        """
+        The cached dashboard view for the current widget selections.
+        """
+        return athlete_view(self.athlete.value, self.event_distance.value, self.start_position.value,
+                            self.position_gain_loss.value)
+
+    def refresh_view(self, *events):
+        """
+        Triggering events are changes to any of the widget values. Pushes the current view into the persistent plots
+        and indicators.
+        """
+        view = self.current_view()
+
+        update_histogram(*self.first_lap_positions, view['first_lap_positions'],
+                         f'Early Selection of Position in Pack - {self.event_distance.value}', probability=True)
+        update_histogram(*self.half_lap_500m_hist, view['half_lap_500m_hist'], '500m Half-Lap Start Times',
+                         bin_offset=HALF_LAP_BIN_WIDTH / 2)
+        update_histogram(*self.start_performance_500m, view['start_performance_500m'],
+                         f'500m Start Result from Lane {self.start_position.value}')
+        update_histogram(*self.likely_lap_to_pass, view['likely_lap_to_pass'],
+                         f'Passes on each Lap of {self.position_gain_loss.value} Positions')
+        update_histogram(*self.x_plus_y_position_selection, view['x_plus_y_position_selection'],
+                         'X + Y Position Selection')
+
+        self.half_lap_500m_mean.value = view['half_lap_500m_mean']
+        self.fastest_leading_laptimes.value = view['fastest_leading_laptimes']
+        self.fastest_following_laptimes.value = view['fastest_following_laptimes']
+        self.pacing_1500m_leading.value = view['pacing_1500m_leading']
+        self.pacing_1500m_instigation.value = view['pacing_1500m_instigation']
+
+    def refresh_comparison(self, *events):
+        """
+        Triggering events are changes to the athlete or the comparison season.
+        """
+        self.comparison.object = athlete_comparison(self.athlete.value, self.comparison_season.value)
+
+    def athlete_search_changed(self, event):
+        """
+        Triggering event is athlete_search.value_input, on each keystroke. The athletes to pick from become the best
+        matches, keeping the current athlete selected.
+        """
+        options = athlete_search(event.new)
+        current = {label: athlete_id for label, athlete_id in self.athlete.options.items()
+                   if athlete_id == self.athlete.value}
+        self.athlete.options = {**options, **current}
+
+    def athlete_changed(self, event):
+        """
+        Triggering event is athlete.value
+        """
+        self.event_distance.options, self.start_position.options, self.position_gain_loss.options = \
+            athlete_options(event.new)
+
+        if self.event_distance.value not in self.event_distance.options:
+            # if the new event distance options don't contain the current value, default to ALL_EVENTS_NAME
+            self.event_distance.value = ALL_EVENTS_NAME
+        if self.start_position.value not in self.start_position.options:
+            self.start_position.value = DEFAULT_START_POSITION
+        if self.position_gain_loss.value not in self.position_gain_loss.options:
+            self.position_gain_loss.value = DEFAULT_POSITION_CHANGE
+        self.refresh_view()
+
+        self.comparison_season.options = athlete_seasons(event.new)
+        if self.comparison_season.value not in self.comparison_season.options:
+            self.comparison_season.value = ALL_SEASONS_NAME
+        self.refresh_comparison()
+
+    def view(self) -> pn.template.base.BasicTemplate:
+        """
+        Generate the UI dashboard.
+        """
+        ui_template = pn.template.MaterialTemplate(title='Short Track Athlete Profile')
+
+        # set up sidebar display
+        ui_template.sidebar.append(self.athlete_search)
+        ui_template.sidebar.append(self.athlete)
+        ui_template.sidebar.append(self.event_distance)
+        ui_template.sidebar.append(self.start_position)
+        ui_template.sidebar.append(self.position_gain_loss)
+        ui_template.sidebar.append(self.comparison_season)
+
+        # the comparison needs the percentile index, which is built along with the profile store
+        if comparison_available():
+            comparison_note = 'Percentile is the share of athletes of the same gender with the same or a lower value ' \
+                              '(lower laptimes are faster).'
         else:
-            denominator -= 1
+            comparison_note = 'Comparison unavailable: the percentile index of this dataset has not been built.'
 
-    return pn.indicators.Number(name='1500m Pace Instigation',
-                                value=round((speed_up_sum / denominator), 3) if denominator > 0 else 0,
-                                format='{value}s')
+        # set up main display
+        ui_template.main.append(
+            pn.Column(pn.Row(self.first_lap_positions[0], self.half_lap_500m_mean, self.half_lap_500m_hist[0]),
+                      pn.Row(self.start_performance_500m[0], self.fastest_leading_laptimes,
+                             self.fastest_following_laptimes),
+                      pn.Row(self.likely_lap_to_pass[0], self.x_plus_y_position_selection[0]),
+                      pn.Row(self.pacing_1500m_leading, self.pacing_1500m_instigation),
+                      pn.Column(pn.pane.Markdown('### Comparison to Other Athletes\n' + comparison_note),
+                                self.comparison))
+        )
+
+        return ui_template
 
 
 def view() -> pn.template.base.BasicTemplate:
     """
-    Generate the UI dashboard.
+    Generate the UI dashboard for a new session.
     """
-    ui_template = pn.template.MaterialTemplate(title='Short Track Athlete Profile')
-
-    # set up sidebar display
-    ui_template.sidebar.append(athlete_name)
-    ui_template.sidebar.append(event_distance)
-    ui_template.sidebar.append(start_position)
-    ui_template.sidebar.append(position_gain_loss)
-
-    # set up main display
-    ui_template.main.append(
-        pn.Column(pn.Row(first_lap_positions, half_lap_500m_mean, half_lap_500m_hist),
-                  pn.Row(start_performance_500m, fastest_leading_laptimes, fastest_following_laptimes),
-                  pn.Row(likely_lap_to_pass, x_plus_y_position_selection),
-                  pn.Row(pacing_1500m_leading, pacing_1500m_instigation))
-    )
-
-    return ui_template
+    return AthleteProfileDashboard().view()
 
 
 if __name__.startswith('bokeh'):
     # if run with `panel serve shorttrack_ui.py`
     view().servable(title='Short Track Athlete Profile')
-else:
+elif __name__ == '__main__':
     # if run directly (e.g. in Jupyter notebook, or with `python shorttrack_ui.py`)
     view().show()
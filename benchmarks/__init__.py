@@ -0,0 +1,4 @@
+# Performance benchmarks for the scraping pipeline and dashboard.
+#
+# Run each benchmark as a module from the repository root, e.g.
+#     python -m benchmarks.combine_rounds_splits
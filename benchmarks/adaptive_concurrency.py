@@ -0,0 +1,135 @@
+"""
+Compare the fixed crawl rate (a 0.1s download delay) with the adaptive concurrency middleware, against a local
+stand-in for the results server with limited capacity.
+
+    python -m benchmarks.adaptive_concurrency --pages 1000 --capacity 16
+
+The stand-in server takes --latency seconds per page while fewer than --capacity requests are in progress, slows down
+as more arrive, and rate limits (429 with Retry-After) beyond twice its capacity.
+"""
+import argparse
+import multiprocessing
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from time import sleep, perf_counter
+
+import scrapy
+
+FIXED_SETTINGS = dict(DOWNLOAD_DELAY=0.1, DOWNLOADER_MIDDLEWARES=dict())
+
+
+class LimitedCapacityHandler(BaseHTTPRequestHandler):
+    """
+    Serves a small page after a delay which grows with the number of requests in progress, and rate limits requests
+    beyond twice the server's capacity.
+    """
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_progress += 1
+            in_progress = server.in_progress
+        try:
+            if in_progress > 2 * server.capacity:
+                server.requests[429] += 1
+                self.send_response(429)
+                self.send_header('Retry-After', '1')
+                self.end_headers()
+                return
+
+            sleep(server.latency * max(1, in_progress / server.capacity))
+            server.requests[200] += 1
+            body = b'<html><body><p>page</p></body></html>'
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_progress -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+class LimitedCapacityServer(ThreadingHTTPServer):
+    # accept as many connections as the crawler opens, so that only the handler limits the request rate
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class PagesSpider(scrapy.Spider):
+    name = 'adaptive_concurrency'
+
+    def __init__(self, base_url: str, pages: int):
+        super().__init__(name=self.name)
+        self.base_url = base_url
+        self.pages = pages
+
+    async def start(self):
+        for request in self.start_requests():
+            yield request
+
+    def start_requests(self):
+        for page in range(self.pages):
+            yield scrapy.Request(url=f'{self.base_url}/page/{page}')
+
+    def parse(self, response):
+        pass
+
+
+def run_crawl(base_url: str, pages: int, overrides: dict, results):
+    """
+    Crawl the stand-in server once with the project's settings and any overrides (in a fresh process, since a Twisted
+    reactor can't be restarted), putting the crawl's time and statistics on the results queue.
+    """
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.settings import Settings
+
+    settings = Settings()
+    settings.setmodule('shorttrack_scrapy.settings')
+    settings.update(dict(HTTPCACHE_ENABLED=False, ITEM_PIPELINES=dict(), ROBOTSTXT_OBEY=False, LOG_LEVEL='WARNING',
+                         ADAPTIVE_STATS_INTERVAL=0))
+    settings.update(overrides)
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(PagesSpider)
+    process.crawl(crawler, base_url=base_url, pages=pages)
+    start = perf_counter()
+    process.start()
+    stats = crawler.stats.get_stats()
+    results.put(dict(elapsed=perf_counter() - start, pages=stats.get('response_received_count', 0),
+                     concurrency=[value for key, value in stats.items() if key.endswith('/concurrency')]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=1000, help='number of pages to crawl')
+    parser.add_argument('--capacity', type=int, default=16, help='requests the server handles without slowing down')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per page within capacity')
+    args = parser.parse_args()
+
+    server = LimitedCapacityServer(('127.0.0.1', 0), LimitedCapacityHandler)
+    server.capacity, server.latency = args.capacity, args.latency
+    server.lock, server.in_progress, server.requests = Lock(), 0, Counter()
+    Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    print(f'{"crawl":<10}{"seconds":>9}{"pages/s":>9}{"200s":>7}{"429s":>7}{"final concurrency":>19}')
+    for crawl, overrides in [('fixed', FIXED_SETTINGS), ('adaptive', dict())]:
+        server.requests.clear()
+        process = context.Process(target=run_crawl, args=(base_url, args.pages, overrides, results))
+        process.start()
+        result = results.get()
+        process.join()
+        concurrency = ', '.join(str(value) for value in result['concurrency']) or '-'
+        print(f'{crawl:<10}{result["elapsed"]:>9.2f}{args.pages / result["elapsed"]:>9.1f}{server.requests[200]:>7}'
+              f'{server.requests[429]:>7}{concurrency:>19}')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
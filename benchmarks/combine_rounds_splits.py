@@ -0,0 +1,95 @@
+"""
+Compare the vectorized round/split merge against the original per-race loop, and the same merge matching races on
+their integer IDs from the ID registry rather than on the seven text columns of the race key.
+
+    python -m benchmarks.combine_rounds_splits --scale 4
+"""
+import argparse
+import io
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.utils import scraped_from_light, time_call
+from shorttrack_scrapy.constants import UNIQUE_RACE_COLUMNS, RACE_ID_COLUMN, ID_COLUMNS
+from shorttrack_scrapy.processing import merge_rounds_splits
+from shorttrack_scrapy.registry import IdRegistry
+
+
+def legacy_merge_rounds_splits(all_rounds: pd.DataFrame, all_splits: pd.DataFrame) -> pd.DataFrame:
+    """
+    The original implementation of ShorttrackScrapyPipeline.combine_rounds_splits, kept as the reference.
+    """
+    individual_races = all_rounds.groupby(UNIQUE_RACE_COLUMNS)
+    rounds_splits_df = all_rounds.copy()
+
+    for race_details, athlete_race_data in individual_races:
+        athlete_indices = athlete_race_data.index
+        laps = all_splits[(all_splits['season'] == race_details[0]) &
+                          (all_splits['competition'] == race_details[1]) &
+                          (all_splits['event'] == race_details[2]) &
+                          (all_splits['instance_of_event_in_competition'] == race_details[3]) &
+                          (all_splits['gender'] == race_details[4]) &
+                          (all_splits['round'] == race_details[5]) &
+                          (all_splits['race'] == race_details[6])]
+        rounds_splits_df.loc[athlete_indices, 'laps_of_split_data'] = laps.shape[0]
+
+        if laps.shape[0] > 1:
+            for athlete_index in athlete_indices:
+                athlete_start_position = f'START_POS_{rounds_splits_df.loc[athlete_index, "Start Pos."]}'
+
+                if f'{athlete_start_position} POSITION' in laps.columns:
+                    for lap_number, (lap_index, lap_data) in enumerate(laps.iterrows()):
+                        rounds_splits_df.loc[athlete_index, f'lap_{lap_number + 1}_position'] = lap_data[
+                            f'{athlete_start_position} POSITION'] if lap_data[
+                            f'{athlete_start_position} POSITION'] else np.nan
+                        rounds_splits_df.loc[athlete_index, f'lap_{lap_number + 1}_laptime'] = lap_data[
+                            f'{athlete_start_position} LAP TIME']
+                        rounds_splits_df.loc[athlete_index, f'lap_{lap_number + 1}_elapsedtime'] = lap_data[
+                            f'{athlete_start_position} ELAPSED TIME']
+
+    # the full dataset always reaches 45 laps (5000m relay); pad the lap columns so smaller inputs don't fail here
+    for lap_column in [f'lap_{x}_{field}' for x in range(1, 46) for field in ['position', 'laptime', 'elapsedtime']]:
+        if lap_column not in rounds_splits_df.columns:
+            rounds_splits_df[lap_column] = np.nan
+
+    pos_cols = [f'lap_{x}_position' for x in range(1, 46)]
+    laptime_cols = [f'lap_{x}_laptime' for x in range(1, 46)]
+    rounds_splits_df[pos_cols] = rounds_splits_df[pos_cols].replace(0.0, np.nan)
+    rounds_splits_df[laptime_cols] = rounds_splits_df[laptime_cols].replace(0.0, np.nan)
+    return rounds_splits_df
+
+
+def to_csv_text(df: pd.DataFrame) -> str:
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', type=int, default=1, help='number of copies of the light dataset to merge')
+    parser.add_argument('--repeat', type=int, default=1, help='number of timed runs per implementation')
+    args = parser.parse_args()
+
+    all_rounds, all_splits = scraped_from_light(args.scale)
+    print(f'{len(all_rounds)} athlete-races, {len(all_splits)} split rows')
+
+    legacy_time, legacy_df = time_call(legacy_merge_rounds_splits, all_rounds, all_splits, repeat=args.repeat)
+    vectorized_time, vectorized_df = time_call(merge_rounds_splits, all_rounds, all_splits, repeat=args.repeat)
+
+    print(f'legacy:     {legacy_time:8.3f}s')
+    print(f'vectorized: {vectorized_time:8.3f}s ({legacy_time / vectorized_time:.0f}x)')
+    print(f'identical rounds_with_splits.csv: {to_csv_text(legacy_df) == to_csv_text(vectorized_df)}')
+
+    registry_time, (id_rounds, id_splits) = time_call(IdRegistry().scraped_with_ids, all_rounds, all_splits)
+    ids_time, ids_df = time_call(merge_rounds_splits, id_rounds, id_splits, race_columns=[RACE_ID_COLUMN],
+                                 repeat=args.repeat)
+    print(f'race IDs:   {ids_time:8.3f}s ({vectorized_time / ids_time:.1f}x vectorized, '
+          f'+{registry_time:.3f}s to assign the IDs)')
+    identical = to_csv_text(vectorized_df) == to_csv_text(ids_df.drop(columns=ID_COLUMNS))
+    print(f'identical rounds_with_splits.csv: {identical}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Load test for the athlete profile dashboard: N concurrent sessions repeatedly search for and switch between random
+athletes, and the latency of each switch is reported.
+
+    python -m benchmarks.dashboard_sessions --sessions 16 --switches 50 --dataset light
+
+Sessions are created in-process with the same per-session factory as `panel serve`, so the numbers measure the server
+work per interaction (athlete searches, cache lookups, profile reads and plot updates), not the network.
+"""
+import argparse
+import os
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import numpy as np
+
+
+def run_session(dashboard_class, athletes: dict, switches: int, seed: int) -> list:
+    """
+    Create one dashboard session and switch it between random athletes ({ISU ID: name}), typing the start of each
+    athlete's name into the search before picking them. Returns the latency of each switch.
+    """
+    rng = random.Random(seed)
+    session = dashboard_class()
+    latencies = list()
+    for _ in range(switches):
+        athlete_id, name = rng.choice(list(athletes.items()))
+        start = perf_counter()
+        for typed in range(1, min(len(name), 4) + 1):
+            session.athlete_search.value_input = name[:typed]
+        session.athlete.value = athlete_id
+        session.event_distance.value = rng.choice(session.event_distance.options)
+        latencies.append(perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=16, help='number of concurrent sessions')
+    parser.add_argument('--switches', type=int, default=50, help='number of athlete switches per session')
+    parser.add_argument('--dataset', default=os.environ.get('DATASET', 'light'), help='dataset directory under data/')
+    args = parser.parse_args()
+
+    # the dashboard modules read the dataset location when they are imported
+    os.environ['DATASET'] = args.dataset
+    sys.path.insert(0, 'athlete_profile')
+    from shorttrack_ui import AthleteProfileDashboard
+    from athlete_data import athlete_index
+
+    start = perf_counter()
+    athletes = athlete_index().athletes['name'].to_dict()
+    print(f'athlete index: {len(athletes)} athletes in {perf_counter() - start:.3f}s')
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as sessions:
+        results = sessions.map(run_session, [AthleteProfileDashboard] * args.sessions, [athletes] * args.sessions,
+                               [args.switches] * args.sessions, range(args.sessions))
+        latencies = np.concatenate([np.array(session_latencies) for session_latencies in results]) * 1000
+    elapsed = perf_counter() - start
+
+    print(f'{args.sessions} sessions x {args.switches} switches in {elapsed:.2f}s '
+          f'({len(latencies) / elapsed:.0f} switches/s)')
+    print(f'latency p50: {np.percentile(latencies, 50):8.2f}ms')
+    print(f'latency p99: {np.percentile(latencies, 99):8.2f}ms')
+    print(f'latency max: {latencies.max():8.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Compare the columnar lap extraction against the original per-athlete DataFrame.append loop.
+
+    python -m benchmarks.generate_laptimes --scale 4
+"""
+import argparse
+import filecmp
+from os.path import join
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.utils import light_rounds_splits, time_call
+from shorttrack_scrapy.constants import HALF_LAP_EVENTS, LONGEST_EVENT_LAPS
+from shorttrack_scrapy.processing import extract_laptimes, LAP_DELTA_COLUMNS
+from shorttrack_scrapy.utils import save_parsed_data
+
+
+def legacy_generate_laptimes(rounds_splits_df: pd.DataFrame, file_path: str):
+    """
+    The original implementation of ShorttrackScrapyPipeline.generate_laptimes, kept as the reference.
+    """
+    race_details_cols = list(rounds_splits_df.columns[:17])
+    lap_details_cols = race_details_cols.copy()
+    lap_details_cols.extend(['lap', 'laptime', 'lap_start_position', 'lap_end_position', 'position_change'])
+
+    for index, athlete_race in rounds_splits_df.iterrows():
+        laptimes = pd.DataFrame(columns=lap_details_cols)
+        start_lap = 2 if athlete_race['event'] in HALF_LAP_EVENTS else 1
+
+        for i in range(start_lap, LONGEST_EVENT_LAPS + 1):
+            try:
+                laptime = float(athlete_race[f'lap_{i}_laptime'])
+            except Exception:
+                laptime = np.nan
+
+            if not np.isnan(laptime) and laptime > 7.8:
+                lap_details = athlete_race[race_details_cols]
+                lap_details['lap'] = i
+                lap_details['laptime'] = laptime
+                lap_details['lap_start_position'] = float(athlete_race[f'lap_{i - 1}_position']) if i > 1 else float(
+                    athlete_race['Start Pos.'])
+                lap_details['lap_end_position'] = float(athlete_race[f'lap_{i}_position'])
+                lap_details['position_change'] = (-1) * (lap_details['lap_end_position'] -
+                                                         lap_details['lap_start_position'])
+
+                laptimes = laptimes.append(lap_details)
+
+        save_parsed_data(df=laptimes, file_path=file_path)
+
+
+def columnar_generate_laptimes(rounds_splits_df: pd.DataFrame, file_path: str):
+    laptimes_df = extract_laptimes(rounds_splits_df, list(rounds_splits_df.columns[:17]))
+    # the legacy implementation has no lap-over-lap columns
+    laptimes_df = laptimes_df.drop(columns=LAP_DELTA_COLUMNS)
+    laptimes_df.to_csv(file_path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', type=int, default=1, help='number of copies of the light dataset to process')
+    args = parser.parse_args()
+
+    rounds_splits_df = light_rounds_splits(args.scale)
+    print(f'{len(rounds_splits_df)} athlete-races')
+
+    with TemporaryDirectory() as output_dir:
+        legacy_file = join(output_dir, 'legacy.csv')
+        columnar_file = join(output_dir, 'columnar.csv')
+        legacy_time, _ = time_call(legacy_generate_laptimes, rounds_splits_df, legacy_file, repeat=1)
+        columnar_time, _ = time_call(columnar_generate_laptimes, rounds_splits_df, columnar_file, repeat=1)
+
+        print(f'legacy:   {legacy_time:8.3f}s')
+        print(f'columnar: {columnar_time:8.3f}s ({legacy_time / columnar_time:.0f}x)')
+        print(f'identical individual_athlete_lap_data.csv: {filecmp.cmp(legacy_file, columnar_file, shallow=False)}')
+
+
+if __name__ == '__main__':
+    main()
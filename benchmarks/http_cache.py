@@ -0,0 +1,133 @@
+"""
+Exercise the crawler's HTTP cache against a local stand-in for the results server, and report where each page came
+from on repeated crawls.
+
+    python -m benchmarks.http_cache --pages 200 --changed 20
+
+The stand-in server serves `past` pages (requested as permanently cacheable, like past seasons) and `current` pages
+(revalidated on every crawl), with an ETag for each page version. Three crawls are run with the project's cache
+settings: a cold crawl, a repeat crawl, and a crawl after some current pages have changed. Use --max-size to limit
+the cache size and see pages being evicted.
+"""
+import argparse
+import multiprocessing
+import os
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import Counter
+from tempfile import TemporaryDirectory
+from threading import Thread
+
+import scrapy
+
+CACHE_STATS = ['httpcache/miss', 'httpcache/hit', 'httpcache/revalidate', 'httpcache/store']
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Serves a small page for any path, with an ETag for its current version, and answers conditional requests for an
+    unchanged page with 304 Not Modified.
+    """
+
+    def do_GET(self):
+        version = self.server.versions[self.path]
+        etag = f'"{version}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.server.requests[304] += 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.server.requests[200] += 1
+        body = f'<html><body><p>{self.path} version {version}</p>{"<td>0:00.000</td>" * 500}</body></html>'.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class CacheSpider(scrapy.Spider):
+    name = 'http_cache'
+
+    def __init__(self, base_url: str, pages: int):
+        super().__init__(name=self.name)
+        self.base_url = base_url
+        self.pages = pages
+
+    async def start(self):
+        for request in self.start_requests():
+            yield request
+
+    def start_requests(self):
+        for page in range(self.pages):
+            yield scrapy.Request(url=f'{self.base_url}/past/{page}', meta=dict(cache_permanently=True))
+            yield scrapy.Request(url=f'{self.base_url}/current/{page}', meta=dict(cache_permanently=False))
+
+    def parse(self, response):
+        pass
+
+
+def run_crawl(base_url: str, pages: int, cache_dir: str, max_size: int, results):
+    """
+    Crawl the stand-in server once with the project's cache settings (in a fresh process, since a Twisted reactor
+    can't be restarted), putting the crawl's cache statistics on the results queue.
+    """
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.settings import Settings
+
+    settings = Settings()
+    settings.setmodule('shorttrack_scrapy.settings')
+    settings.update(dict(HTTPCACHE_DIR=cache_dir, HTTPCACHE_MAX_SIZE=max_size, ITEM_PIPELINES=dict(),
+                         ROBOTSTXT_OBEY=False, DOWNLOAD_DELAY=0, LOG_LEVEL='WARNING'))
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(CacheSpider)
+    process.crawl(crawler, base_url=base_url, pages=pages)
+    process.start()
+    results.put({stat: crawler.stats.get_value(stat, 0) for stat in CACHE_STATS})
+
+
+def cache_size(cache_dir: str) -> int:
+    return sum(os.path.getsize(os.path.join(directory, file))
+               for directory, _, files in os.walk(cache_dir) for file in files)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=200, help='number of past and of current pages')
+    parser.add_argument('--changed', type=int, default=20, help='number of current pages changed before crawl 3')
+    parser.add_argument('--max-size', type=int, default=0, help='cache size limit in bytes (0 for no limit)')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.versions = {f'/{kind}/{page}': 1 for kind in ['past', 'current'] for page in range(args.pages)}
+    server.requests = Counter()
+    Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    print(f'{"crawl":<18}{"server 200":>11}{"server 304":>11}' + ''.join(f'{stat[10:]:>11}' for stat in CACHE_STATS) +
+          f'{"cache MiB":>11}')
+    with TemporaryDirectory() as cache_dir:
+        for crawl in ['cold', 'repeat', 'current changed']:
+            if crawl == 'current changed':
+                for page in range(args.changed):
+                    server.versions[f'/current/{page}'] += 1
+            server.requests.clear()
+
+            process = context.Process(target=run_crawl, args=(base_url, args.pages, cache_dir, args.max_size, results))
+            process.start()
+            stats = results.get()
+            process.join()
+            print(f'{crawl:<18}{server.requests[200]:>11}{server.requests[304]:>11}' +
+                  ''.join(f'{stats[stat]:>11}' for stat in CACHE_STATS) + f'{cache_size(cache_dir) / 2 ** 20:>11.2f}')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Compare the time and text normalization against the per-cell implementations it replaced, over millions of cells in
+the formats the results website uses (times with and without minutes, record marks, result codes and missing cells).
+
+    python -m benchmarks.normalize --cells 2000000
+"""
+import argparse
+import re
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import format_times
+from benchmarks.utils import time_call
+from shorttrack_scrapy.constants import REGEX_BAD_CHARS
+from shorttrack_scrapy.normalize import seconds_column, regex_replace
+
+RESULT_CODES = ['DNF', 'DNS', 'DQ', 'PEN', 'YC']
+
+
+def legacy_seconds_column(column: pd.Series) -> pd.Series:
+    """
+    The original processing.seconds_column, kept as the reference.
+    """
+    if column.dtype != object:
+        return column.astype(float)
+    times = column.astype(str).str.strip().str.extract(r'^(?:(?P<minutes>\d+):)?(?P<seconds>\d+(?:\.\d*)?)$')
+    return times['minutes'].astype(float).fillna(0) * 60 + times['seconds'].astype(float)
+
+
+def legacy_regex_replace(s: str, regex_str: str = None, replacement_chars: str = ''):
+    """
+    The original utils.regex_replace, kept as the reference.
+    """
+    regex_str = REGEX_BAD_CHARS if regex_str is None else regex_str
+    return re.sub(regex_str, replacement_chars, s)
+
+
+def time_cells(num_cells: int, seed: int = 0) -> pd.Series:
+    """
+    Time cells as scraped: laptimes, elapsed times over a minute, result codes (on their own, or after a time, which
+    is then not a valid time) and missing cells.
+    """
+    rng = np.random.default_rng(seed)
+    cells = pd.Series(format_times(rng.uniform(8, 420, num_cells), 3), dtype=object)
+    kind = rng.random(num_cells)
+    cells[kind < 0.3] = np.nan
+    codes = (kind >= 0.3) & (kind < 0.32)
+    cells[codes] = np.array(RESULT_CODES)[rng.integers(0, len(RESULT_CODES), codes.sum())]
+    coded_times = (kind >= 0.32) & (kind < 0.33)
+    cells[coded_times] = cells[coded_times] + ' ' + np.array(RESULT_CODES)[rng.integers(0, len(RESULT_CODES),
+                                                                                      coded_times.sum())]
+    return cells
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cells', type=int, default=2000000, help='number of cells')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs (the best is kept)')
+    args = parser.parse_args()
+
+    cells = time_cells(args.cells)
+    text = ('\n\t\t' + cells.fillna('').astype(str) + ' \n\t').tolist()
+    print(f'{args.cells} cells')
+
+    benchmarks = [('seconds_column', lambda: legacy_seconds_column(cells), lambda: seconds_column(cells)),
+                  ('regex_replace (per cell)', lambda: [legacy_regex_replace(s) for s in text],
+                   lambda: [regex_replace(s) for s in text])]
+    print(f'{"":<26}{"legacy":>10}{"new":>10}{"speed-up":>10}')
+    for name, legacy, new in benchmarks:
+        legacy_seconds, expected = time_call(legacy, repeat=args.repeat)
+        new_seconds, result = time_call(new, repeat=args.repeat)
+        if isinstance(expected, pd.Series):
+            identical = np.array_equal(expected.to_numpy(), result.to_numpy(), equal_nan=True)
+        else:
+            identical = expected == result
+        print(f'{name:<26}{legacy_seconds:>9.3f}s{new_seconds:>9.3f}s{legacy_seconds / new_seconds:>9.1f}x'
+              f'{"" if identical else "  OUTPUT DIFFERS"}')
+
+
+if __name__ == '__main__':
+    main()
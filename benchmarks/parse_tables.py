@@ -0,0 +1,191 @@
+"""
+Compare the precompiled XPath table extractor against the original per-cell CSS selectors, over saved round and split
+pages.
+
+    python -m benchmarks.parse_tables --repeat 3
+
+Pages are read from the raw HTML archive (saved by the spider when ARCHIVE_RAW_HTML is on). When none have been
+archived, synthetic pages with the same structure are used: 2 races of 8 athletes per round page, 12 athletes over 45 laps per
+split page.
+"""
+import argparse
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+import pandas as pd
+from scrapy.http import HtmlResponse, Request
+
+from benchmarks.utils import time_call
+from shorttrack_scrapy.archive import archived_pages, read_shard
+from shorttrack_scrapy.constants import MAX_ATHLETES_IN_RACE
+from shorttrack_scrapy.spiders.shorttrack_spider import ShortTrackEventSpider
+from shorttrack_scrapy.normalize import regex_replace, parse_time_string
+
+PAGE_META = dict(season_title='2019-2020', competition_title='World Cup 1', event_title='1500m',
+                 instance_of_event_in_competition=-1, event_gender='m', round_title='Final A', race_number='1')
+ROUND_HEADERS = ['Place', 'Start Pos.', 'Warn.', '#', 'Name', 'ISU Member', 'Results', 'Qual.', '\xa0']
+
+
+def synthetic_round_html(num_races: int = 2, num_athletes: int = 8) -> str:
+    """
+    A round page with num_races race tables of num_athletes athletes each.
+    """
+    header = ''.join(f'<th scope="col">{col}</th>' for col in ROUND_HEADERS)
+    races = list()
+    for race in range(1, num_races + 1):
+        rows = ''.join(f'<tr class="tablecol{athlete % 2 + 1}"><td>{athlete}</td><td>{athlete}</td><td>&nbsp;</td>'
+                       f'<td>{race * 100 + athlete}</td><td><a href="Athlete.aspx?ath={race * 100 + athlete}">'
+                       f'ATHLETE {race}-{athlete}</a></td><td>KOR</td><td>2:{10 + athlete}.{athlete * 111:03d}</td>'
+                       f'<td>Q</td><td>&nbsp;</td></tr>'
+                       for athlete in range(1, num_athletes + 1))
+        races.append(f'<div class="tabletitle"><p><a href="http://shorttrack.sportresult.com/Splits.aspx?rac={race}">'
+                     f'Race {race}</a></p></div><table cellspacing="0" align="Center" border="0">'
+                     f'<tr class="tablehead">{header}</tr>{rows}</table>')
+    return f'<html><body>{"".join(races)}</body></html>'
+
+
+def synthetic_split_html(num_athletes: int = MAX_ATHLETES_IN_RACE, num_laps: int = 45) -> str:
+    """
+    A split page for num_athletes athletes over num_laps laps.
+    """
+    header = '<th scope="col">Lap</th>' + ''.join(f'<th scope="col">ATHLETE {athlete}</th>'
+                                                  for athlete in range(1, num_athletes + 1))
+    laps = ''.join(f'<tr class="tablecol{lap % 2 + 1}"><td>{lap}</td>' +
+                   ''.join(f'<td>\n<span>[{athlete}]</span>\n {lap * 9}.{athlete:03d} ( 9.{athlete:03d} )</td>'
+                           for athlete in range(1, num_athletes + 1)) + '</tr>'
+                   for lap in range(1, num_laps + 1))
+    return f'<html><body><table><tr class="tablehead">{header}</tr>{laps}</table></body></html>'
+
+
+def load_pages(page: str, synthetic_page: str) -> list:
+    """
+    Responses for the archived 'round' or 'split' pages, or for a set of synthetic pages if none have been archived.
+    """
+    responses = list()
+    for shard_name, entries in archived_pages().items():
+        for entry, body in read_shard(shard_name, [entry for entry in entries if entry['page'] == page]):
+            responses.append(HtmlResponse(url=entry['url'], body=body, encoding=entry['encoding'],
+                                          request=Request(entry['url'], meta=entry['meta'])))
+    if not responses:
+        url = 'http://shorttrack.sportresult.com/'
+        responses = [HtmlResponse(url=url, body=synthetic_page.encode(), encoding='utf-8',
+                                  request=Request(url, meta=dict(PAGE_META))) for _ in range(200)]
+    return responses
+
+
+def legacy_round_rows(response) -> list:
+    """
+    The original CSS selector extraction of ShortTrackEventSpider.parse_round, kept as the reference.
+    """
+    races = response.css('table[cellspacing="0"][align="Center"]')
+    races_out = list()
+    for i, race in enumerate(races):
+        column_headers = race.css('tr.tablehead th::text').getall()
+        athletes = race.css('tr[class*=tablecol]')
+        for athlete in athletes:
+            athlete_out = dict(season=response.meta["season_title"],
+                               competition=response.meta["competition_title"],
+                               event=response.meta["event_title"],
+                               instance_of_event_in_competition=response.meta['instance_of_event_in_competition'],
+                               gender=response.meta["event_gender"],
+                               round=response.meta["round_title"],
+                               race=i + 1)
+            for col, data_point in zip(column_headers, athlete.css('td')):
+                if col == "Name":
+                    athlete_out[col] = regex_replace(data_point.css('td a::text').get())
+                    athlete_out["ISU ID"] = parse_qs(urlsplit(data_point.css('a::attr(href)').get()).query).get(
+                        "ath", [np.nan])[0]
+                elif col == "Results":
+                    athlete_out[col] = parse_time_string(data_point.css('td::text').get())
+                elif col == "Relay Team":
+                    athlete_out["Warn."] = np.nan
+                    athlete_out[col] = regex_replace(data_point.css('td::text').get())
+                elif col == "Warn.":
+                    athlete_out[col] = regex_replace(data_point.css('td::text').get())
+                    athlete_out["Relay Team"] = np.nan
+                elif col != "\xa0":
+                    athlete_out[col] = regex_replace(data_point.css('td::text').get())
+            races_out.append(athlete_out)
+    return races_out
+
+
+def legacy_split_rows(response) -> list:
+    """
+    The original CSS selector extraction of ShortTrackEventSpider.parse_split, kept as the reference.
+    """
+    athlete_names = response.css('tr.tablehead th[scope="col"]::text')[1:].getall()
+    laps = response.css('tr[class*=tablecol]')
+
+    num_laps = len(laps)
+    split_data = {
+        "season": [response.meta["season_title"]] * num_laps,
+        "competition": [response.meta["competition_title"]] * num_laps,
+        "event": [response.meta["event_title"]] * num_laps,
+        "instance_of_event_in_competition": [response.meta["instance_of_event_in_competition"]] * num_laps,
+        "gender": [response.meta["event_gender"]] * num_laps,
+        "round": [response.meta["round_title"]] * num_laps,
+        "race": [response.meta["race_number"]] * num_laps
+    }
+    col_ids = list()
+    for start_position in range(1, MAX_ATHLETES_IN_RACE + 1):
+        col_id = f'START_POS_{str(start_position)}'
+        if start_position <= len(athlete_names):
+            col_ids.append(col_id)
+        split_data[f'{col_id} POSITION'] = [np.nan] * num_laps
+        split_data[f'{col_id} LAP TIME'] = [np.nan] * num_laps
+        split_data[f'{col_id} ELAPSED TIME'] = [np.nan] * num_laps
+
+    for lap_index, lap in enumerate(laps):
+        for athlete_col, col_id in zip(lap.css('td')[1:], col_ids):
+            athlete_position = athlete_col.css('td span::text').get()
+            athlete_position_cleaned = athlete_position.strip('[]') if athlete_position is not None else np.nan
+            split_data[f'{col_id} POSITION'][lap_index] = athlete_position_cleaned
+
+            laptime_field = athlete_col.css('td::text').getall()
+            if len(laptime_field):
+                both_times = regex_replace(laptime_field[1]).strip(')').split('(')
+            else:
+                both_times = [np.nan, np.nan]
+            split_data[f'{col_id} LAP TIME'][lap_index] = parse_time_string(both_times[1])
+            split_data[f'{col_id} ELAPSED TIME'][lap_index] = parse_time_string(both_times[0])
+
+    return pd.DataFrame(split_data).to_dict('records')
+
+
+def item_rows(callback, response) -> list:
+    """
+    The rows of the item yielded by a spider callback, ignoring the requests it yields.
+    """
+    return next(output for output in callback(response) if not isinstance(output, Request))['rows']
+
+
+def compare(name: str, responses: list, legacy, callback, repeat: int):
+    # parsed trees are cached on each response, so parse them before timing the extraction
+    for response in responses:
+        response.selector
+
+    legacy_time, legacy_rows = time_call(lambda: [legacy(response) for response in responses], repeat=repeat)
+    fast_time, fast_rows = time_call(lambda: [item_rows(callback, response) for response in responses], repeat=repeat)
+    identical = pd.DataFrame(sum(legacy_rows, [])).equals(pd.DataFrame(sum(fast_rows, [])))
+
+    print(f'{name} ({len(responses)} pages)')
+    print(f'  css selectors: {legacy_time:8.3f}s ({len(responses) / legacy_time:8.0f} pages/s)')
+    print(f'  xpath:         {fast_time:8.3f}s ({len(responses) / fast_time:8.0f} pages/s, '
+          f'{legacy_time / fast_time:.1f}x)')
+    print(f'  identical rows: {identical}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs per implementation')
+    args = parser.parse_args()
+
+    spider = ShortTrackEventSpider()
+    compare('round pages', load_pages('round', synthetic_round_html()), legacy_round_rows, spider.parse_round,
+            args.repeat)
+    compare('split pages', load_pages('split', synthetic_split_html()), legacy_split_rows, spider.parse_split,
+            args.repeat)
+
+
+if __name__ == '__main__':
+    main()
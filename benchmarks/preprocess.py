@@ -0,0 +1,46 @@
+"""
+Compare the parallel preprocessing (partitioned across a pool of worker processes) against the pipeline's merge and
+lap extraction in a single process, on synthetic scraped data.
+
+    python -m benchmarks.preprocess --races 20000 --workers 1 2 4 8
+"""
+import argparse
+
+from benchmarks.synthetic import synthetic_scraped
+from benchmarks.utils import time_call, csv_round_trip
+from shorttrack_scrapy.preprocess import preprocess
+from shorttrack_scrapy.processing import merge_rounds_splits, extract_laptimes
+
+
+def serial_preprocess(all_rounds, all_splits):
+    rounds_splits_df = merge_rounds_splits(all_rounds, all_splits)
+    return rounds_splits_df, extract_laptimes(rounds_splits_df, list(rounds_splits_df.columns[:17]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--races', type=int, default=20000, help='number of synthetic races')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='worker pool sizes to time')
+    parser.add_argument('--shards', type=int, default=None,
+                        help='number of partitions by race key hash (default: one partition per season)')
+    parser.add_argument('--repeat', type=int, default=1, help='number of timed runs (the best is kept)')
+    args = parser.parse_args()
+
+    # the scraped files are read back from CSV, so match their dtypes
+    all_rounds, all_splits = map(csv_round_trip, synthetic_scraped(args.races))
+    print(f'{len(all_rounds)} athlete-races, {len(all_splits)} split rows')
+
+    serial_seconds, (serial_rounds_splits, serial_laptimes) = time_call(serial_preprocess, all_rounds, all_splits,
+                                                                        repeat=args.repeat)
+    print(f'{"single process":<16}{serial_seconds:>9.2f}s')
+    for workers in args.workers:
+        seconds, (rounds_splits_df, laptimes_df) = time_call(preprocess, all_rounds, all_splits, workers=workers,
+                                                             shards=args.shards, repeat=args.repeat)
+        identical = rounds_splits_df.to_csv(index=False) == serial_rounds_splits.to_csv(index=False) and \
+            laptimes_df.to_csv(index=False) == serial_laptimes.to_csv(index=False)
+        print(f'{f"{workers} workers":<16}{seconds:>9.2f}s  {serial_seconds / seconds:>5.2f}x  '
+              f'{"identical output" if identical else "OUTPUT DIFFERS"}')
+
+
+if __name__ == '__main__':
+    main()
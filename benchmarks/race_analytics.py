@@ -0,0 +1,82 @@
+"""
+Compare the race analytics computed over every race in one pass with a loop over the (athletes x laps) position matrix
+of each race, on synthetic races.
+
+    python -m benchmarks.race_analytics --races 20000
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import synthetic_scraped
+from benchmarks.utils import time_call
+from shorttrack_scrapy.packed_races import PackedRaces
+from shorttrack_scrapy.processing import merge_rounds_splits
+from shorttrack_scrapy.race_analytics import race_analytics, NO_ATHLETE
+
+ANALYTICS_COLUMNS = ['leader_laps', 'lead_changes', 'decisive_lap', 'pace_setter_laps', 'final_leader_isu_id',
+                     'pace_setter_isu_id']
+
+
+def race_by_race_analytics(packed: PackedRaces) -> pd.DataFrame:
+    """
+    The race analytics, one race at a time, as the reference.
+    """
+    isu_ids = packed.athletes['ISU ID'].to_numpy()
+    race_rows = packed.athletes.sort_values(['race_index', 'slot']).groupby('race_index').indices
+    analytics = list()
+    for race in range(len(packed.races)):
+        rows = packed.athletes.index[race_rows[race]].to_numpy()
+        in_first = packed.race_laps(race, 'position') == 1
+        leaders = [rows[np.argmax(lap)] if lap.sum() == 1 else NO_ATHLETE for lap in in_first.T]
+        led = [leader for leader in leaders if leader != NO_ATHLETE]
+
+        changes = sum(leader != previous for previous, leader in zip(led, led[1:]))
+        final = leaders[-1] if leaders else NO_ATHLETE
+        decisive = np.nan
+        if final != NO_ATHLETE:
+            others = [lap for lap, leader in enumerate(leaders) if leader not in (NO_ATHLETE, final)]
+            decisive = next(lap for lap, leader in enumerate(leaders)
+                            if leader == final and lap > max(others, default=-1)) + 1
+        setter = NO_ATHLETE
+        if led:
+            setter = max(dict.fromkeys(led), key=led.count)
+        analytics.append({'leader_laps': len(led), 'lead_changes': changes, 'decisive_lap': decisive,
+                          'pace_setter_laps': led.count(setter),
+                          'final_leader_isu_id': isu_ids[final] if final != NO_ATHLETE else np.nan,
+                          'pace_setter_isu_id': isu_ids[setter] if setter != NO_ATHLETE else np.nan})
+    return pd.DataFrame(analytics)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--races', type=int, default=20000, help='number of races')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs (the best is kept)')
+    args = parser.parse_args()
+
+    all_rounds, all_splits = synthetic_scraped(args.races)
+    packed = PackedRaces.from_rounds_splits(merge_rounds_splits(all_rounds, all_splits))
+    print(f'{len(packed.races)} races, {int(packed.races["laps"].sum())} race-laps')
+
+    loop_seconds, expected = time_call(race_by_race_analytics, packed, repeat=1)
+    vectorized_seconds, result = time_call(race_analytics, packed, repeat=args.repeat)
+    identical = all(np.allclose(expected[col].astype(float), result[col].astype(float), equal_nan=True)
+                    for col in ANALYTICS_COLUMNS)
+    print(f'race by race: {loop_seconds:8.3f}s')
+    print(f'one pass:     {vectorized_seconds:8.3f}s ({loop_seconds / vectorized_seconds:.0f}x)'
+          f'{"" if identical else "  OUTPUT DIFFERS"}')
+
+    # races without any lap data have no race-laps at all
+    without_laps = packed.athletes.drop(columns=['race_index', 'slot'])
+    no_laps = race_analytics(PackedRaces.from_rounds_splits(without_laps))
+    print(f'without lap data: {len(no_laps)} races, '
+          f'{"no leaders" if (no_laps["leader_laps"] == 0).all() else "LEADERS FOUND"}')
+
+    decisive_laps = result.dropna(subset=['decisive_lap']).groupby('event', observed=True)['decisive_lap']
+    print('most frequent decisive lap by event: ' +
+          ', '.join(f'{event} lap {laps.mode().iat[0]:.0f}' for event, laps in decisive_laps))
+
+
+if __name__ == '__main__':
+    main()
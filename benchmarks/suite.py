@@ -0,0 +1,150 @@
+"""
+Time the whole data path on synthetic scraped data: the pipeline's combine_rounds_splits and generate_laptimes, the
+packing of the lap data race by race (and the laps and race analytics derived from it), the dashboard's data loading
+and athlete search, and the computation of each dashboard statistic and metric.
+
+    python -m benchmarks.suite --races 20000 --repeat 3
+
+Each run is appended to benchmarks/results.jsonl with the commit it was measured at, and compared with the latest
+earlier run for the same number of races, so regressions show up from one commit to the next. The results depend on
+the machine they were measured on, so the file is kept out of the repository.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from os.path import exists
+from tempfile import TemporaryDirectory
+
+import pandas as pd
+
+from benchmarks.synthetic import synthetic_scraped
+from benchmarks.utils import time_call
+from shorttrack_scrapy.constants import SCRAPED_DIR, FULL_DIR, LIGHT_DIR, ROUNDS_FILE, SPLITS_FILE
+from shorttrack_scrapy.packed_races import PackedRaces
+from shorttrack_scrapy.pipelines import ShorttrackScrapyPipeline
+from shorttrack_scrapy.processing import race_details_columns
+from shorttrack_scrapy.race_analytics import race_analytics
+
+RESULTS_FILE = 'benchmarks/results.jsonl'
+# benchmarks which take this much longer than in the previous run are flagged
+REGRESSION_THRESHOLD = 0.2
+# searches typed into the dashboard's athlete picker (the synthetic athletes are named "Skater00042SYNTHETIC")
+SEARCHES = ['s', 'sk', 'skater', 'skater0004', '00042', 'synthetic', 'skatr00042']
+
+
+def run_benchmarks(races: int, repeat: int) -> dict:
+    """
+    Generate synthetic data for the number of races and time each benchmark on it, returning the best time of each
+    in seconds.
+    """
+    all_rounds, all_splits = synthetic_scraped(races)
+    print(f'{len(all_rounds)} athlete-races, {len(all_splits)} split rows')
+    seconds = dict()
+    repository = os.getcwd()
+
+    # the pipeline and dashboard read and write their files relative to the working directory
+    with TemporaryDirectory() as data_root:
+        os.chdir(data_root)
+        try:
+            for directory in [SCRAPED_DIR, FULL_DIR, LIGHT_DIR]:
+                os.makedirs(directory)
+            all_rounds.to_csv(ROUNDS_FILE, index=False)
+            all_splits.to_csv(SPLITS_FILE, index=False)
+
+            pipeline = ShorttrackScrapyPipeline(incremental=False)
+            seconds['pipeline/combine_rounds_splits'], rounds_splits_df = time_call(pipeline.combine_rounds_splits,
+                                                                                    repeat=repeat)
+            seconds['pipeline/generate_laptimes'], _ = time_call(pipeline.generate_laptimes, rounds_splits_df,
+                                                                 repeat=repeat)
+            seconds['pipeline/pack_races'], packed = time_call(PackedRaces.from_rounds_splits, rounds_splits_df,
+                                                               repeat=repeat)
+            seconds['packed/laptimes'], _ = time_call(packed.laptimes, race_details_columns(rounds_splits_df),
+                                                      repeat=repeat)
+            seconds['packed/race_analytics'], _ = time_call(race_analytics, packed, repeat=repeat)
+            lap_memory = rounds_splits_df.filter(regex='^lap_').memory_usage(deep=True).sum()
+            print(f'lap data: {lap_memory / 1e6:.1f} MB in wide columns, {packed.nbytes / 1e6:.1f} MB packed')
+
+            # the dashboard modules read the dataset location when they are imported
+            os.environ['DATASET'] = 'full'
+            sys.path.insert(0, os.path.join(repository, 'athlete_profile'))
+            import athlete_data
+            from athlete_profiles import profile_statistics, metric_values, build_metric_distributions, METRIC_NAMES
+
+            seconds['dashboard/load_rounds'], rounds = time_call(athlete_data.load_rounds, repeat=repeat)
+            seconds['dashboard/load_laptimes'], laptimes = time_call(athlete_data.load_laptimes, repeat=repeat)
+            seconds['dashboard/athlete_index'], index = time_call(athlete_data.athlete_index.__wrapped__,
+                                                                  repeat=repeat)
+            seconds['dashboard/athlete_search'], _ = time_call(lambda: [index.search(query) for query in SEARCHES],
+                                                               repeat=repeat)
+
+            for statistic, compute in profile_statistics(rounds, laptimes).items():
+                if statistic != 'metrics':
+                    seconds[f'statistic/{statistic}'], _ = time_call(compute, repeat=repeat)
+            for statistic in METRIC_NAMES:
+                seconds[f'metric/{statistic}'], _ = time_call(metric_values, rounds, laptimes, ['ISU ID'], [statistic],
+                                                              repeat=repeat)
+            seconds['metric/distributions'], _ = time_call(build_metric_distributions, rounds, laptimes,
+                                                           repeat=repeat)
+        finally:
+            os.chdir(repository)
+    return seconds
+
+
+def current_commit() -> (str, bool):
+    """
+    The commit checked out, and whether the working tree has uncommitted changes.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True)
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                                text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit.stdout.strip(), bool(status.stdout.strip())
+
+
+def load_results() -> list:
+    if not exists(RESULTS_FILE):
+        return list()
+    with open(RESULTS_FILE) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--races', type=int, default=20000, help='number of synthetic races')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs per benchmark (the best is kept)')
+    parser.add_argument('--no-save', action='store_true', help="don't append the results to the results file")
+    args = parser.parse_args()
+
+    commit, dirty = current_commit()
+    seconds = run_benchmarks(args.races, args.repeat)
+    previous = [result for result in load_results() if result['races'] == args.races]
+    previous = previous[-1] if previous else None
+
+    print(f'{"benchmark":<44}{"seconds":>10}' + (f'{"previous":>10}{"change":>9}' if previous else ''))
+    for benchmark, time in seconds.items():
+        line = f'{benchmark:<44}{time:>10.3f}'
+        previous_time = previous['seconds'].get(benchmark) if previous else None
+        if previous_time:
+            change = time / previous_time - 1
+            line += f'{previous_time:>10.3f}{change:>+9.0%}' + ('  slower' if change > REGRESSION_THRESHOLD else '')
+        print(line)
+    if previous:
+        print(f'previous: commit {previous["commit"]}{" (with changes)" if previous["dirty"] else ""}, '
+              f'{previous["date"]}')
+
+    if not args.no_save:
+        result = dict(commit=commit, dirty=dirty, date=datetime.now().isoformat(timespec='seconds'),
+                      races=args.races, repeat=args.repeat, python=platform.python_version(), pandas=pd.__version__,
+                      seconds={benchmark: round(time, 4) for benchmark, time in seconds.items()})
+        with open(RESULTS_FILE, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Generate synthetic scraped data: all_rounds.csv and all_splits.csv in the exact format written by the spider, for any
+number of races.
+
+    python -m benchmarks.synthetic --races 20000 --output data/synthetic/
+
+Races are spread over seasons, competitions, events (individual and relay, with the half-lap events starting on a
+half lap), genders and rounds. Each race has up to 12 athletes (4 relay teams) with split data for every lap, up to 45
+laps for the 5000m relay. A few races have no split data, as when a split page is missing.
+"""
+import argparse
+from os import makedirs
+
+import numpy as np
+import pandas as pd
+
+from shorttrack_scrapy.constants import EVENT_500M, EVENT_1000M, EVENT_1500M, EVENT_3000M, EVENT_3000M_RELAY, \
+    EVENT_5000M_RELAY, HALF_LAP_EVENTS, MAX_ATHLETES_IN_RACE, LONGEST_EVENT_LAPS
+
+# the events of a competition, with two instances of the individual distances as at many World Cups
+COMPETITION_EVENTS = [(EVENT_500M, 1), (EVENT_500M, 2), (EVENT_1000M, 1), (EVENT_1000M, 2), (EVENT_1500M, 1),
+                      (EVENT_1500M, 2), (EVENT_3000M, -1), (EVENT_3000M_RELAY, -1), (EVENT_5000M_RELAY, -1)]
+EVENT_LAPS = {EVENT_500M: 5, EVENT_1000M: 9, EVENT_1500M: 14, EVENT_3000M: 27, EVENT_3000M_RELAY: 27,
+              EVENT_5000M_RELAY: LONGEST_EVENT_LAPS}
+RELAY_EVENTS = [EVENT_3000M_RELAY, EVENT_5000M_RELAY]
+ROUNDS = ['Heats', 'Quarterfinals', 'Semifinals', 'FinalB', 'FinalA']
+RACES_PER_ROUND = 8
+COMPETITIONS_PER_SEASON = 8
+FIRST_SEASON = 2000
+NATIONS = ['CAN', 'CHN', 'FRA', 'GBR', 'HUN', 'ITA', 'JPN', 'KOR', 'NED', 'RUS', 'USA']
+ROUND_COLUMNS = ['season', 'competition', 'event', 'instance_of_event_in_competition', 'gender', 'round', 'race',
+                 'Place', 'Start Pos.', 'Warn.', 'Relay Team', '#', 'Name', 'ISU ID', 'ISU Member', 'Results', 'Qual.',
+                 'Points']
+MISSING_SPLITS_SHARE = 0.03
+# a prime, so that the athletes drawn for a race are all different
+ATHLETE_STRIDE = 7919
+
+
+def format_times(seconds: np.ndarray, decimals: int) -> np.ndarray:
+    """
+    Format times in seconds as the results website shows them: 45.10, or 1:35.94 from one minute up.
+    """
+    seconds = pd.Series(seconds, dtype=float).round(decimals)
+    minutes = (seconds // 60).fillna(0).astype(int)
+    remainder = (seconds - minutes * 60).round(decimals)
+    short = remainder.map(f'{{:.{decimals}f}}'.format)
+    long = minutes.astype(str) + ':' + remainder.map(f'{{:0{decimals + 3}.{decimals}f}}'.format)
+    return short.where(minutes == 0, long).where(seconds.notna(), np.nan).to_numpy(dtype=object)
+
+
+def race_keys(num_races: int) -> pd.DataFrame:
+    """
+    The unique keys of num_races races, filling each round, event, competition and season in turn.
+    """
+    race = np.arange(num_races)
+    keys = pd.DataFrame({'race': race % RACES_PER_ROUND + 1})
+    rest = race // RACES_PER_ROUND
+    keys['round'] = np.array(ROUNDS)[rest % len(ROUNDS)]
+    rest //= len(ROUNDS)
+    keys['gender'] = np.array(['m', 'w'])[rest % 2]
+    rest //= 2
+    events = np.array(COMPETITION_EVENTS, dtype=object)[rest % len(COMPETITION_EVENTS)]
+    keys['event'] = events[:, 0]
+    keys['instance_of_event_in_competition'] = events[:, 1].astype(int)
+    rest //= len(COMPETITION_EVENTS)
+    season = FIRST_SEASON + rest // COMPETITIONS_PER_SEASON
+    keys['competition'] = [f'Synthetic World Cup {s}/{s + 1}, No. {c + 1}'
+                           for s, c in zip(season, rest % COMPETITIONS_PER_SEASON)]
+    keys['season'] = [f'{s}-{s + 1}' for s in season]
+    return keys[['season', 'competition', 'event', 'instance_of_event_in_competition', 'gender', 'round', 'race']]
+
+
+def synthetic_scraped(num_races: int, num_athletes: int = None, seed: int = 0) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Synthetic all_rounds and all_splits for num_races races, between num_athletes athletes (by default, enough for
+    each athlete to race about 100 times).
+    """
+    rng = np.random.default_rng(seed)
+    races = race_keys(num_races)
+    relay = races['event'].isin(RELAY_EVENTS).to_numpy()
+    half_lap = races['event'].isin(HALF_LAP_EVENTS).to_numpy()
+    num_laps = races['event'].map(EVENT_LAPS).to_numpy()
+    num_laps[rng.random(num_races) < MISSING_SPLITS_SHARE] = 0
+    race_size = np.where(relay, 4, rng.choice([4, 5, 6, 7, 8, MAX_ATHLETES_IN_RACE], num_races,
+                                              p=[0.2, 0.2, 0.25, 0.15, 0.15, 0.05]))
+
+    # one row per athlete (or relay team) in each race, in start position order
+    athlete_race = np.repeat(np.arange(num_races), race_size)
+    race_start = np.cumsum(race_size) - race_size
+    start_position = np.arange(len(athlete_race)) - race_start[athlete_race] + 1
+
+    # laptimes from each athlete's pace, with a standing start and a half-lap first split in the half-lap events
+    # athletes are drawn for each race without repeats, men with even and women with odd numbers
+    num_athletes = num_athletes or max(100, len(athlete_race) // 100)
+    first_athlete = rng.integers(0, num_athletes // 2, num_races)[athlete_race]
+    athlete = 2 * ((first_athlete + (start_position - 1) * ATHLETE_STRIDE) % (num_athletes // 2)) + \
+        (races['gender'].to_numpy()[athlete_race] == 'w')
+    pace = 8.6 + (athlete % 97) / 97 + rng.normal(0, 0.15, len(athlete_race))
+    laptimes = pace[:, None] + rng.gamma(2, 0.2, (len(athlete_race), LONGEST_EVENT_LAPS))
+    laptimes[:, 0] = np.where(half_lap[athlete_race], 6.5 + rng.gamma(4, 0.2, len(athlete_race)),
+                              laptimes[:, 0] + 2)
+    laptimes = laptimes.round(2)
+    laptimes[np.arange(LONGEST_EVENT_LAPS)[None, :] >= num_laps[athlete_race][:, None]] = np.nan
+    elapsed = np.cumsum(laptimes, axis=1).round(2)
+
+    # positions at the end of each lap, by elapsed time within the race
+    positions = np.full(elapsed.shape, np.nan)
+    for lap in range(LONGEST_EVENT_LAPS):
+        order = np.lexsort((elapsed[:, lap], athlete_race))
+        positions[order, lap] = np.arange(len(order)) - race_start[athlete_race[order]] + 1
+    positions[np.isnan(elapsed)] = np.nan
+
+    # results from a full race time for every athlete, including those without split data
+    finish = np.where(num_laps[athlete_race] > 0, np.nanmax(elapsed, axis=1, initial=0),
+                      pace * races['event'].map(EVENT_LAPS).to_numpy()[athlete_race])
+    order = np.lexsort((finish, athlete_race))
+    place = np.empty(len(order), dtype=int)
+    place[order] = np.arange(len(order)) - race_start[athlete_race[order]] + 1
+
+    # relay teams are named after their nation, and have no athlete details
+    rounds = races.iloc[athlete_race].reset_index(drop=True)
+    individual = pd.Series(~relay[athlete_race])
+    nations = pd.Series(np.array(NATIONS)[athlete % len(NATIONS)])
+    rounds['Place'] = place.astype(str)
+    rounds['Start Pos.'] = start_position
+    rounds['Warn.'] = np.nan
+    rounds['Relay Team'] = nations.where(~individual)
+    rounds['#'] = pd.Series(athlete % 200 + 1.0).where(individual)
+    rounds['Name'] = pd.Series(athlete).map('Skater{0:05d}SYNTHETIC'.format).where(individual)
+    rounds['ISU ID'] = pd.Series(athlete + 1000.0).where(individual)
+    rounds['ISU Member'] = nations
+    rounds['Results'] = format_times(finish, 3)
+    rounds['Qual.'] = pd.Series('Q', index=rounds.index).where((place <= 2) & ~rounds['round'].str.startswith('Final'))
+    rounds['Points'] = np.nan
+
+    # one split row per lap of each race, with the position, laptime and elapsed time of each start position
+    split_race = np.repeat(np.arange(num_races), num_laps)
+    split_lap = np.arange(len(split_race)) - (np.cumsum(num_laps) - num_laps)[split_race]
+    splits = races.iloc[split_race].reset_index(drop=True)
+    split_columns = dict()
+    for position in range(1, MAX_ATHLETES_IN_RACE + 1):
+        starter = race_start[split_race] + position - 1
+        present = position <= race_size[split_race]
+        starter = np.where(present, starter, 0)
+        split_columns[f'START_POS_{position} POSITION'] = np.where(present, positions[starter, split_lap], np.nan)
+        split_columns[f'START_POS_{position} LAP TIME'] = np.where(present, laptimes[starter, split_lap], np.nan)
+        split_columns[f'START_POS_{position} ELAPSED TIME'] = np.where(
+            present, format_times(elapsed[starter, split_lap], 2), np.nan)
+    splits = pd.concat([splits, pd.DataFrame(split_columns)], axis=1)
+
+    return rounds[ROUND_COLUMNS], splits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--races', type=int, default=20000, help='number of races')
+    parser.add_argument('--athletes', type=int, default=None, help='number of athletes (default: one per 100 athlete-races)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--output', default='data/synthetic/', help='directory to write the CSV files to')
+    args = parser.parse_args()
+
+    all_rounds, all_splits = synthetic_scraped(args.races, args.athletes, args.seed)
+    makedirs(args.output, exist_ok=True)
+    all_rounds.to_csv(f'{args.output}all_rounds.csv', index=False)
+    all_splits.to_csv(f'{args.output}all_splits.csv', index=False)
+    print(f'{len(all_rounds)} athlete-races and {len(all_splits)} split rows written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
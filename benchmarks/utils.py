@@ -0,0 +1,81 @@
+import io
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from shorttrack_scrapy.constants import ROUNDS_SPLITS_LIGHT_FILE, UNIQUE_RACE_COLUMNS, MAX_ATHLETES_IN_RACE
+
+ROUND_COLUMNS_COUNT = 18
+
+
+def csv_round_trip(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Write df to CSV and read it back, so that dtypes match what the pipeline reads from the scraped files.
+    """
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False)
+    buffer.seek(0)
+    return pd.read_csv(buffer)
+
+
+def scale_races(df: pd.DataFrame, scale: int) -> pd.DataFrame:
+    """
+    Repeat the races in df `scale` times, under renamed competitions.
+    """
+    return pd.concat([df.assign(competition=df['competition'] + f' #{i}') for i in range(scale)], ignore_index=True)
+
+
+def light_rounds_splits(scale: int = 1) -> pd.DataFrame:
+    """
+    The light rounds_with_splits dataset, repeated `scale` times.
+    """
+    return scale_races(pd.read_csv(ROUNDS_SPLITS_LIGHT_FILE), scale)
+
+
+def scraped_from_light(scale: int = 1) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Rebuild all_rounds and all_splits in the scraped format from the light rounds_with_splits dataset. The races are
+    repeated `scale` times (under renamed competitions) to produce larger inputs.
+    """
+    rounds_splits = pd.read_csv(ROUNDS_SPLITS_LIGHT_FILE)
+    rounds = rounds_splits[rounds_splits.columns[:ROUND_COLUMNS_COUNT]]
+
+    # one split row per lap of each race
+    laps_per_race = rounds_splits.groupby(UNIQUE_RACE_COLUMNS)['laps_of_split_data'].max().astype(int)
+    laps_per_race = laps_per_race[laps_per_race > 0]
+    skeleton = laps_per_race.index.repeat(laps_per_race.values).to_frame(index=False)
+    skeleton['lap'] = skeleton.groupby(UNIQUE_RACE_COLUMNS).cumcount() + 1
+
+    # move each athlete's lap_{i}_{field} values into the START_POS_n columns of lap i
+    lap_values = rounds_splits[UNIQUE_RACE_COLUMNS + ['Start Pos.'] +
+                               [c for c in rounds_splits.columns if c.startswith('lap_')]]
+    lap_values = lap_values[lap_values['Start Pos.'] <= MAX_ATHLETES_IN_RACE]
+    lap_values = lap_values.melt(id_vars=UNIQUE_RACE_COLUMNS + ['Start Pos.'])
+    lap_parts = lap_values['variable'].str.extract(r'lap_(?P<lap>\d+)_(?P<field>\w+)')
+    lap_values['lap'] = lap_parts['lap'].astype(int)
+    lap_values['split_column'] = 'START_POS_' + lap_values['Start Pos.'].astype(str) + ' ' + \
+        lap_parts['field'].map(dict(position='POSITION', laptime='LAP TIME', elapsedtime='ELAPSED TIME'))
+    lap_values = lap_values.drop_duplicates(UNIQUE_RACE_COLUMNS + ['lap', 'split_column'])
+    lap_values = lap_values.set_index(UNIQUE_RACE_COLUMNS + ['lap', 'split_column'])['value'].unstack()
+
+    split_columns = [f'START_POS_{start_position} {split_field}'
+                     for start_position in range(1, MAX_ATHLETES_IN_RACE + 1)
+                     for split_field in ['POSITION', 'LAP TIME', 'ELAPSED TIME']]
+    splits = skeleton.join(lap_values.reindex(columns=split_columns), on=UNIQUE_RACE_COLUMNS + ['lap'])
+    splits = splits.drop(columns='lap')
+
+    return csv_round_trip(scale_races(rounds, scale)), csv_round_trip(scale_races(splits, scale))
+
+
+def time_call(func, *args, repeat: int = 3, **kwargs):
+    """
+    Call func repeatedly, returning the best wall time in seconds and the result of the last call.
+    """
+    best = np.inf
+    result = None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, perf_counter() - start)
+    return best, result
@@ -0,0 +1,88 @@
+import json
+import logging
+import tarfile
+from collections import defaultdict
+from datetime import datetime
+from io import BytesIO
+from os import makedirs
+from os.path import exists, dirname
+from time import time
+
+from shorttrack_scrapy.constants import RAW_DIR, RAW_INDEX_FILE
+
+# the response metadata that the round and split parsers read, recorded with each archived page
+ROUND_PAGE_META = ['season_title', 'competition_title', 'event_title', 'instance_of_event_in_competition',
+                   'event_gender', 'round_title']
+SPLIT_PAGE_META = ROUND_PAGE_META + ['race_number']
+PAGE_META = dict(round=ROUND_PAGE_META, split=SPLIT_PAGE_META)
+
+
+class RawHtmlArchive(object):
+    """
+    Archive of the round and split pages scraped in one crawl. Pages are written to one gzip-compressed tar shard per
+    season as they arrive, and recorded in the archive index (one JSON line per page) when the crawl closes.
+    """
+
+    def __init__(self, crawl_id: str = None):
+        self.crawl_id = datetime.now().strftime('%Y%m%d-%H%M%S') if crawl_id is None else crawl_id
+        self.shards = dict()
+        self.entries = list()
+
+    def add(self, page: str, response):
+        """
+        Add the body of a 'round' or 'split' page to the shard of its season.
+        """
+        meta = {key: response.meta[key] for key in PAGE_META[page]}
+        shard_name = f'{meta["season_title"]}/{self.crawl_id}.tar.gz'
+        if shard_name not in self.shards:
+            makedirs(dirname(RAW_DIR + shard_name), exist_ok=True)
+            self.shards[shard_name] = tarfile.open(RAW_DIR + shard_name, 'w:gz')
+        shard = self.shards[shard_name]
+
+        member = tarfile.TarInfo(f'{page}/{len(shard.members):06d}.html')
+        member.size = len(response.body)
+        member.mtime = time()
+        shard.addfile(member, BytesIO(response.body))
+        self.entries.append(dict(shard=shard_name, member=member.name, page=page, url=response.url,
+                                 encoding=response.encoding, meta=meta))
+
+    def close(self):
+        """
+        Finish writing the shards, and add their pages to the archive index.
+        """
+        for shard in self.shards.values():
+            shard.close()
+        if self.entries:
+            makedirs(RAW_DIR, exist_ok=True)
+            with open(RAW_INDEX_FILE, 'a') as f:
+                f.writelines(json.dumps(entry) + '\n' for entry in self.entries)
+            logging.info(f'Archived {len(self.entries)} pages to {len(self.shards)} shards.')
+
+
+def archived_pages() -> dict:
+    """
+    The archive index, as the entries of each shard. Shards are sorted by season and crawl. Pages which were archived
+    more than once (e.g. current season rounds revisited by a later crawl) are only listed from the latest crawl.
+    """
+    latest = dict()
+    if exists(RAW_INDEX_FILE):
+        with open(RAW_INDEX_FILE) as f:
+            entries = [json.loads(line) for line in f]
+        for entry in sorted(entries, key=lambda e: e['shard'].split('/')[1]):
+            latest[(entry['page'], *(entry['meta'][key] for key in PAGE_META[entry['page']]))] = entry
+
+    shards = defaultdict(list)
+    for entry in latest.values():
+        shards[entry['shard']].append(entry)
+    return dict(sorted(shards.items()))
+
+
+def read_shard(shard_name: str, entries: list):
+    """
+    Yield (entry, page body) for the entries of one shard, decompressing the shard in a single sequential pass.
+    """
+    wanted = {entry['member']: entry for entry in entries}
+    with tarfile.open(RAW_DIR + shard_name, 'r:gz') as shard:
+        for member in shard:
+            if member.name in wanted:
+                yield wanted[member.name], shard.extractfile(member).read()
@@ -51,22 +51,39 @@ UNTREATABLE_EVENTS = ["TeamClassification", "OverallClassification", "BRACKET#1"
 
 DATA_DIR = 'data/'
 SCRAPED_DIR = f'{DATA_DIR}scraped/'
-FULL_DIR = f'{DATA_DIR}full/'
-LIGHT_DIR = f'{DATA_DIR}light/'
+# the full and light datasets, each read by the dashboard when run with DATASET=<name>
+FULL_DATASET = 'full'
+LIGHT_DATASET = 'light'
+FULL_DIR = f'{DATA_DIR}{FULL_DATASET}/'
+LIGHT_DIR = f'{DATA_DIR}{LIGHT_DATASET}/'
+# builds the dashboard's profile store and percentile index of the dataset named by DATASET
+ATHLETE_PROFILES_SCRIPT = 'athlete_profile/athlete_profiles.py'
 
+# scraped round and split pages, in one compressed shard per season and crawl
 RAW_DIR = f'{SCRAPED_DIR}raw/'
-RAW_ROUND_DIR = f'{RAW_DIR}round/'
-RAW_SPLIT_DIR = f'{RAW_DIR}split/'
+RAW_INDEX_FILE = f'{RAW_DIR}index.jsonl'
 
 ROUNDS_FILE = f'{SCRAPED_DIR}all_rounds.csv'
 SPLITS_FILE = f'{SCRAPED_DIR}all_splits.csv'
+CRAWL_MANIFEST_FILE = f'{SCRAPED_DIR}crawl_manifest.json'
+# integer IDs of every competition, round, race and athlete scraped, by their key
+ID_REGISTRY_FILE = f'{SCRAPED_DIR}id_registry.json'
+# one JSON report of metrics per crawl
+CRAWL_REPORTS_DIR = f'{SCRAPED_DIR}crawl_reports/'
 
 ROUNDS_SPLITS_FILE = f'{FULL_DIR}rounds_with_splits.csv'
 LAPTIMES_FILE = f'{FULL_DIR}individual_athlete_lap_data.csv'
 COMPRESSED_LAPTIMES_FILE = f'{FULL_DIR}individual_athlete_lap_data.pk'
 PREVIOUS_LAPTIMES_FILE = f'{FULL_DIR}individual_athlete_lap_data_PREVIOUS.csv'
 PREVIOUS_COMPRESSED_LAPTIMES_FILE = f'{FULL_DIR}individual_athlete_lap_data_PREVIOUS.pk'
+ROUNDS_SPLITS_PARQUET_FILE = f'{FULL_DIR}rounds_with_splits.parquet'
+LAPTIMES_PARQUET_FILE = f'{FULL_DIR}individual_athlete_lap_data.parquet'
+# lap data packed race by race into flat arrays, with lookup tables of the races and athletes
+PACKED_RACES_FILE = f'{FULL_DIR}packed_races.npz'
+# one row per race with how the lead was fought for (lead changes, decisive pass, pace setter)
+RACE_ANALYTICS_FILE = f'{FULL_DIR}race_analytics.csv'
 
+# athletes of the light datasets, by any one spelling of their name: every row with their ISU ID is included
 LIGHT_ATHLETE_NAMES = ["FrancoisHAMELIN",
                        "KNEGTSjinkie",
                        "KWAKYoon-Gy",
@@ -77,9 +94,33 @@ LIGHT_ATHLETE_NAMES = ["FrancoisHAMELIN",
                        "Marie-EveDROLET"]
 ROUNDS_SPLITS_LIGHT_FILE = f'{LIGHT_DIR}rounds_with_splits.csv'
 LAPTIMES_LIGHT_FILE = f'{LIGHT_DIR}individual_athlete_lap_data.csv'
+ROUNDS_SPLITS_LIGHT_PARQUET_FILE = f'{LIGHT_DIR}rounds_with_splits.parquet'
+LAPTIMES_LIGHT_PARQUET_FILE = f'{LIGHT_DIR}individual_athlete_lap_data.parquet'
+PACKED_RACES_LIGHT_FILE = f'{LIGHT_DIR}packed_races.npz'
+RACE_ANALYTICS_LIGHT_FILE = f'{LIGHT_DIR}race_analytics.csv'
+
+# Parquet datasets are split into row groups by combination of the group columns, sorted by athlete (ISU ID) within
+# each, so that each athlete's rows are contiguous and row groups can be skipped by their ISU ID statistics
+PARQUET_GROUP_COLUMNS = ['event', 'gender']
+PARQUET_SORT_COLUMN = 'ISU ID'
+PARQUET_ROW_GROUP_SIZE = 20000
+# rows read at a time when only some races of a CSV dataset are needed
+CSV_CHUNK_ROWS = 100000
 
 UNIQUE_ROUND_COLUMNS = ['season', 'competition', 'event', 'instance_of_event_in_competition', 'gender', 'round']
 UNIQUE_RACE_COLUMNS = ['season', 'competition', 'event', 'instance_of_event_in_competition', 'gender', 'round', 'race']
+UNIQUE_COMPETITION_COLUMNS = ['season', 'competition']
+UNIQUE_ATHLETE_COLUMNS = ['ISU ID']
+
+# integer ID columns added to the derived datasets, one per kind of key in the ID registry
+COMPETITION_ID_COLUMN = 'competition_id'
+ROUND_ID_COLUMN = 'round_id'
+RACE_ID_COLUMN = 'race_id'
+ATHLETE_ID_COLUMN = 'athlete_id'
+ID_COLUMNS = [COMPETITION_ID_COLUMN, ROUND_ID_COLUMN, RACE_ID_COLUMN, ATHLETE_ID_COLUMN]
+
+# a current-season competition is considered finished once no new rounds have appeared for this many days
+COMPETITION_CLOSE_DAYS = 7
 
 MAX_ATHLETES_IN_RACE = 12
 LONGEST_EVENT_LAPS = 45
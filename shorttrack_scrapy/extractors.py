@@ -0,0 +1,51 @@
+from lxml import etree
+
+# precompiled expressions for the results tables, equivalent to the CSS selectors they replace
+RACE_TABLES = etree.XPath('descendant-or-self::table[@cellspacing="0" and @align="Center"]')
+HEADER_TEXT = etree.XPath("descendant-or-self::tr[@class and contains(concat(' ', normalize-space(@class), ' '), "
+                          "' tablehead ')]//th/text()", smart_strings=False)
+ATHLETE_HEADER_TEXT = etree.XPath("descendant-or-self::tr[@class and contains(concat(' ', normalize-space(@class), "
+                                  "' '), ' tablehead ')]//th[@scope='col']/text()", smart_strings=False)
+TABLE_ROWS = etree.XPath("descendant-or-self::tr[@class and contains(@class, 'tablecol')]")
+ROW_CELLS = etree.XPath('descendant::td')
+CELL_TEXT = etree.XPath('descendant-or-self::td/text()', smart_strings=False)
+CELL_LINK_TEXT = etree.XPath('descendant::a/text()', smart_strings=False)
+CELL_LINK = etree.XPath('descendant-or-self::a/@href', smart_strings=False)
+CELL_SPAN_TEXT = etree.XPath('descendant::span/text()', smart_strings=False)
+
+
+def first(values: list):
+    """
+    The first of the values, or None if there are none.
+    """
+    return values[0] if values else None
+
+
+def round_tables(root) -> list:
+    """
+    The column headers and athlete rows of each race table on a round page, in one pass over the parsed page.
+
+    Each athlete row is a list of (text, link text, link) tuples, one per cell: the first text directly in the cell,
+    the first text of a link in the cell and the first link target (each None when missing).
+    """
+    tables = list()
+    for table in RACE_TABLES(root):
+        rows = list()
+        for row in TABLE_ROWS(table):
+            rows.append([(first(CELL_TEXT(cell)), first(CELL_LINK_TEXT(cell)), first(CELL_LINK(cell)))
+                         for cell in ROW_CELLS(row)])
+        tables.append((HEADER_TEXT(table), rows))
+    return tables
+
+
+def split_table(root) -> (list, list):
+    """
+    The athlete names and lap rows of a split page, in one pass over the parsed page.
+
+    Each lap row holds one (position text, cell text) tuple per athlete, skipping the lap number column: the first
+    text of a span in the cell (None when missing) and the list of text nodes directly in the cell.
+    """
+    athlete_names = ATHLETE_HEADER_TEXT(root)[1:]
+    laps = [[(first(CELL_SPAN_TEXT(cell)), CELL_TEXT(cell)) for cell in ROW_CELLS(lap)[1:]]
+            for lap in TABLE_ROWS(root)]
+    return athlete_names, laps
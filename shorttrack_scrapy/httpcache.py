@@ -0,0 +1,90 @@
+import logging
+import os
+from shutil import rmtree
+
+from scrapy.extensions.httpcache import RFC2616Policy, FilesystemCacheStorage
+
+logger = logging.getLogger(__name__)
+
+
+class SeasonCachePolicy(RFC2616Policy):
+    """
+    Results of past seasons never change, so their pages (requests with the `cache_permanently` meta key) are served
+    from the cache without contacting the server. Every other page is revalidated with the server using the ETag and
+    Last-Modified of the cached copy, and is only downloaded again if it has changed.
+    """
+
+    def should_cache_response(self, response, request) -> bool:
+        return response.status == 200 and super().should_cache_response(response, request)
+
+    def is_cached_response_fresh(self, cachedresponse, request) -> bool:
+        if request.meta.get('cache_permanently'):
+            return True
+        self._set_conditional_validators(request, cachedresponse)
+        return False
+
+
+class BoundedFilesystemCacheStorage(FilesystemCacheStorage):
+    """
+    Filesystem cache storage limited to HTTPCACHE_MAX_SIZE bytes on disk. Once the limit is exceeded, the least
+    recently used pages are evicted until the cache is back under HTTPCACHE_EVICTION_TARGET of the limit.
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.max_size = settings.getint('HTTPCACHE_MAX_SIZE', 0)
+        self.eviction_target = settings.getfloat('HTTPCACHE_EVICTION_TARGET', 0.9)
+
+        # size on disk and last use of each cached page, by cache entry directory
+        self.entries = dict()
+        self.size = 0
+        self.evicted = 0
+
+    def open_spider(self, spider):
+        super().open_spider(spider)
+        spider_dir = os.path.join(self.cachedir, spider.name)
+        if os.path.isdir(spider_dir):
+            for prefix in os.scandir(spider_dir):
+                for entry in os.scandir(prefix.path):
+                    self.entries[entry.path] = [entry.stat().st_mtime, self.entry_size(entry.path)]
+        self.size = sum(size for _, size in self.entries.values())
+        logger.info(f'HTTP cache holds {len(self.entries)} pages ({self.size / 2 ** 20:.1f} MiB).')
+
+    def close_spider(self, spider):
+        super().close_spider(spider)
+        logger.info(f'HTTP cache holds {len(self.entries)} pages ({self.size / 2 ** 20:.1f} MiB), '
+                    f'{self.evicted} evicted during the crawl.')
+
+    @staticmethod
+    def entry_size(path: str) -> int:
+        return sum(file.stat().st_size for file in os.scandir(path))
+
+    def retrieve_response(self, spider, request):
+        response = super().retrieve_response(spider, request)
+        if response is not None:
+            # the entry directory's modification time records when the page was last used
+            path = self._get_request_path(spider, request)
+            os.utime(path)
+            self.entries[path][0] = os.stat(path).st_mtime
+        return response
+
+    def store_response(self, spider, request, response):
+        super().store_response(spider, request, response)
+        path = self._get_request_path(spider, request)
+        _, previous_size = self.entries.get(path, (None, 0))
+        self.entries[path] = [os.stat(path).st_mtime, self.entry_size(path)]
+        self.size += self.entries[path][1] - previous_size
+        if self.max_size and self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used pages until the cache is under its eviction target.
+        """
+        target = self.max_size * self.eviction_target
+        for path in sorted(self.entries, key=lambda p: self.entries[p][0]):
+            if self.size <= target:
+                break
+            rmtree(path, ignore_errors=True)
+            self.size -= self.entries.pop(path)[1]
+            self.evicted += 1
@@ -7,8 +7,26 @@
 
 import scrapy
 
+from shorttrack_scrapy.constants import ROUNDS_FILE, SPLITS_FILE
+
 
 class ShorttrackScrapyItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    # scraped data file that the item's rows are saved to
+    file_path = None
+
+    # one dict per row, keyed by column name
+    rows = scrapy.Field()
+
+
+class RoundItem(ShorttrackScrapyItem):
+    """
+    Athlete data and basic timing/position data for every race of one round, one row per athlete per race.
+    """
+    file_path = ROUNDS_FILE
+
+
+class SplitItem(ShorttrackScrapyItem):
+    """
+    Split times and positions for one race, one row per lap.
+    """
+    file_path = SPLITS_FILE
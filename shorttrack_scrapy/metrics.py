@@ -0,0 +1,177 @@
+import json
+import logging
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from os import makedirs
+from threading import Thread
+
+from scrapy import signals
+
+from shorttrack_scrapy.constants import CRAWL_REPORTS_DIR
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (in seconds) of the callback latency histogram buckets, as in Prometheus histograms
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# crawl stats holding the metrics, by kind; each is followed by a callback or pipeline stage name
+CALLBACK_SECONDS_STAT = 'metrics/callback_seconds/'
+CALLBACK_COUNT_STATS = dict(pages='metrics/pages/', bytes='metrics/bytes/', items='metrics/items/',
+                            rows='metrics/rows/', requests='metrics/requests/')
+PIPELINE_SECONDS_STAT = 'metrics/pipeline_seconds/'
+ROUNDS_NEW_STAT = 'metrics/rounds/new'
+ROUNDS_ALREADY_SCRAPED_STAT = 'metrics/rounds/already_scraped'
+
+
+def observe_latency(stats, callback: str, seconds: float):
+    """
+    Add a callback's processing time to its latency histogram in the crawl stats.
+    """
+    histogram = stats.get_value(CALLBACK_SECONDS_STAT + callback)
+    if histogram is None:
+        histogram = dict(count=0, sum=0.0, buckets=[0] * len(LATENCY_BUCKETS))
+        stats.set_value(CALLBACK_SECONDS_STAT + callback, histogram)
+    histogram['count'] += 1
+    histogram['sum'] += seconds
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if seconds <= bound:
+            histogram['buckets'][i] += 1
+
+
+def histogram_quantile(histogram: dict, quantile: float) -> float:
+    """
+    Estimate a quantile of a latency histogram, interpolating within the bucket it falls in (as Prometheus does).
+    """
+    rank = quantile * histogram['count']
+    lower, below = 0.0, 0
+    for bound, cumulative in zip(LATENCY_BUCKETS, histogram['buckets']):
+        if cumulative >= rank:
+            return lower + (bound - lower) * (rank - below) / max(cumulative - below, 1)
+        lower, below = bound, cumulative
+    return LATENCY_BUCKETS[-1]
+
+
+def stats_by_name(stats: dict, prefix: str) -> dict:
+    return {key[len(prefix):]: value for key, value in stats.items() if key.startswith(prefix)}
+
+
+def crawl_report(stats: dict) -> dict:
+    """
+    Summarise the metrics in a crawl's stats: the latency of each callback, the pages, bytes, items and requests of
+    each level of the crawl, how many rounds were skipped as already scraped, and the time taken by each pipeline stage.
+    """
+    callbacks = dict()
+    for callback, histogram in stats_by_name(stats, CALLBACK_SECONDS_STAT).items():
+        callbacks[callback] = dict(count=histogram['count'], seconds=round(histogram['sum'], 6),
+                                   mean_seconds=round(histogram['sum'] / max(histogram['count'], 1), 6),
+                                   **{f'p{int(q * 100)}_seconds': round(histogram_quantile(histogram, q), 6)
+                                      for q in [0.5, 0.9, 0.99]},
+                                   buckets=dict(zip(map(str, LATENCY_BUCKETS), histogram['buckets'])))
+
+    levels = dict()
+    for kind, prefix in CALLBACK_COUNT_STATS.items():
+        for callback, value in stats_by_name(stats, prefix).items():
+            levels.setdefault(callback, dict.fromkeys(CALLBACK_COUNT_STATS, 0))[kind] = value
+
+    new_rounds = stats.get(ROUNDS_NEW_STAT, 0)
+    already_scraped = stats.get(ROUNDS_ALREADY_SCRAPED_STAT, 0)
+    return dict(callbacks=callbacks,
+                levels=levels,
+                rounds=dict(new=new_rounds, already_scraped=already_scraped,
+                            skip_ratio=round(already_scraped / max(new_rounds + already_scraped, 1), 4)),
+                pipeline_seconds={stage: round(seconds, 3)
+                                  for stage, seconds in stats_by_name(stats, PIPELINE_SECONDS_STAT).items()})
+
+
+def prometheus_text(stats: dict) -> str:
+    """
+    Render a crawl's metrics in the Prometheus text exposition format.
+    """
+    lines = ['# TYPE shorttrack_callback_seconds histogram']
+    for callback, histogram in stats_by_name(stats, CALLBACK_SECONDS_STAT).items():
+        for bound, cumulative in zip(LATENCY_BUCKETS, histogram['buckets']):
+            lines.append(f'shorttrack_callback_seconds_bucket{{callback="{callback}",le="{bound}"}} {cumulative}')
+        lines += [f'shorttrack_callback_seconds_bucket{{callback="{callback}",le="+Inf"}} {histogram["count"]}',
+                  f'shorttrack_callback_seconds_sum{{callback="{callback}"}} {histogram["sum"]}',
+                  f'shorttrack_callback_seconds_count{{callback="{callback}"}} {histogram["count"]}']
+
+    for kind, prefix in CALLBACK_COUNT_STATS.items():
+        lines.append(f'# TYPE shorttrack_{kind}_total counter')
+        lines += [f'shorttrack_{kind}_total{{callback="{callback}"}} {value}'
+                  for callback, value in stats_by_name(stats, prefix).items()]
+
+    lines += ['# TYPE shorttrack_rounds_total counter',
+              f'shorttrack_rounds_total{{status="new"}} {stats.get(ROUNDS_NEW_STAT, 0)}',
+              f'shorttrack_rounds_total{{status="already_scraped"}} {stats.get(ROUNDS_ALREADY_SCRAPED_STAT, 0)}',
+              '# TYPE shorttrack_pipeline_seconds gauge']
+    lines += [f'shorttrack_pipeline_seconds{{stage="{stage}"}} {seconds}'
+              for stage, seconds in stats_by_name(stats, PIPELINE_SECONDS_STAT).items()]
+
+    # the live crawl rate recorded by the adaptive concurrency middleware
+    for stat in ['requests_per_second', 'queue_depth', 'in_progress']:
+        if f'adaptive/{stat}' in stats:
+            lines += [f'# TYPE shorttrack_{stat} gauge', f'shorttrack_{stat} {stats[f"adaptive/{stat}"]}']
+    return '\n'.join(lines) + '\n'
+
+
+class PrometheusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_text(dict(self.server.stats.get_stats())).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class CrawlMetrics(object):
+    """
+    Writes a JSON report of the crawl's metrics to CRAWL_REPORTS_DIR when the crawl closes, and serves them in the
+    Prometheus text format at http://localhost:METRICS_PROMETHEUS_PORT/metrics during the crawl (if the port is set).
+
+    The metrics are recorded in the crawl stats: callback latencies, pages, bytes and items by the spider middleware,
+    rounds skipped as already scraped by the spider, and pipeline stage times by the pipeline.
+    """
+
+    def __init__(self, stats, prometheus_port: int = 0):
+        self.stats = stats
+        self.prometheus_port = prometheus_port
+        self.server = None
+        self.started = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        extension = cls(crawler.stats, prometheus_port=crawler.settings.getint('METRICS_PROMETHEUS_PORT', 0))
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        self.started = datetime.now()
+        if self.prometheus_port:
+            self.server = ThreadingHTTPServer(('127.0.0.1', self.prometheus_port), PrometheusHandler)
+            self.server.daemon_threads = True
+            self.server.stats = self.stats
+            Thread(target=self.server.serve_forever, daemon=True).start()
+            logger.info(f'Serving crawl metrics at http://127.0.0.1:{self.server.server_address[1]}/metrics')
+
+    def spider_closed(self, spider, reason):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+        finished = datetime.now()
+        report = dict(spider=spider.name, started=self.started.isoformat(), finished=finished.isoformat(),
+                      elapsed_seconds=round((finished - self.started).total_seconds(), 3), finish_reason=reason,
+                      **crawl_report(self.stats.get_stats()))
+        makedirs(CRAWL_REPORTS_DIR, exist_ok=True)
+        report_file = f'{CRAWL_REPORTS_DIR}{self.started.strftime("%Y%m%d-%H%M%S")}.json'
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f'Saved crawl report to {report_file}.')
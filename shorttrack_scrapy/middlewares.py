@@ -5,35 +5,90 @@
 # See documentation in:
 # https://doc.scrapy.org/en/latest/topics/spider-middleware.html
 
-from scrapy import signals
+from time import monotonic, perf_counter
+
+from scrapy import signals, Request
+from scrapy.downloadermiddlewares.retry import get_retry_request
+from scrapy.exceptions import IgnoreRequest
+from scrapy.utils.misc import load_object
+from scrapy.utils.response import response_status_message
+from twisted.internet import task
+
+from shorttrack_scrapy.metrics import CALLBACK_COUNT_STATS, observe_latency
+
+# responses which mean the server is asking for fewer requests
+THROTTLE_HTTP_CODES = {429, 503}
 
 
 class ShorttrackScrapySpiderMiddleware(object):
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the spider middleware does not modify the
-    # passed objects.
+    """
+    Records crawl metrics for each callback in the crawl stats: how long it takes to process a page (as a latency
+    histogram), and the pages and bytes it receives and the items, rows and requests it yields. It's placed next to the
+    spider so that the times don't include other spider middlewares.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        s = cls(crawler.stats)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
-    def process_spider_input(self, response, spider):
-        # Called for each response that goes through the spider
-        # middleware and into the spider.
+    @staticmethod
+    def callback_name(response) -> str:
+        return getattr(response.request.callback, '__name__', 'parse')
 
-        # Should return None or raise an exception.
+    def process_spider_input(self, response, spider):
+        callback = self.callback_name(response)
+        self.stats.inc_value(CALLBACK_COUNT_STATS['pages'] + callback)
+        self.stats.inc_value(CALLBACK_COUNT_STATS['bytes'] + callback, len(response.body))
         return None
 
     def process_spider_output(self, response, result, spider):
-        # Called with the results returned from the Spider, after
-        # it has processed the response.
+        # callbacks are generators, so time each step of the iteration and not the processing of what they yield
+        callback = self.callback_name(response)
+        seconds = 0.0
+        result = iter(result)
+        while True:
+            start = perf_counter()
+            try:
+                i = next(result)
+            except StopIteration:
+                break
+            finally:
+                seconds += perf_counter() - start
+
+            self.count_output(callback, i)
+            yield i
+        observe_latency(self.stats, callback, seconds)
+
+    async def process_spider_output_async(self, response, result, spider):
+        # the same, for asynchronous output (Scrapy 2.13+ needs both)
+        callback = self.callback_name(response)
+        seconds = 0.0
+        result = result.__aiter__()
+        while True:
+            start = perf_counter()
+            try:
+                i = await result.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                seconds += perf_counter() - start
 
-        # Must return an iterable of Request, dict or Item objects.
-        for i in result:
+            self.count_output(callback, i)
             yield i
+        observe_latency(self.stats, callback, seconds)
+
+    def count_output(self, callback: str, output):
+        if isinstance(output, Request):
+            self.stats.inc_value(CALLBACK_COUNT_STATS['requests'] + callback)
+        else:
+            self.stats.inc_value(CALLBACK_COUNT_STATS['items'] + callback)
+            self.stats.inc_value(CALLBACK_COUNT_STATS['rows'] + callback, len(output.get('rows', ())))
 
     def process_spider_exception(self, response, exception, spider):
         # Called when a spider or process_spider_input() method
@@ -57,47 +112,169 @@ class ShorttrackScrapySpiderMiddleware(object):
 
 
 class ShorttrackScrapyDownloaderMiddleware(object):
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+    """
+    Adapts the request rate of each download slot (one per host) to how well the server is coping, and retries failed
+    requests after backing off.
+
+    Each host has a target concurrency, adjusted every ADAPTIVE_WINDOW responses: halved if any of them failed or were
+    rate limited, reduced by one if their mean latency was over ADAPTIVE_LATENCY_TOLERANCE times the fastest seen from
+    the host, and otherwise increased by one (up to ADAPTIVE_MAX_CONCURRENCY). Requests are paced at the host's latency
+    divided by its target concurrency, which keeps that many requests in progress. Failures also add a backoff delay
+    (doubling up to ADAPTIVE_MAX_DELAY, or as long as a Retry-After header asks), which each successful response
+    shortens again. Responses to requests sent before a host backed off don't count towards its next window.
+
+    Live request rate, queue depth and per-host limits are logged and recorded in the crawl stats every
+    ADAPTIVE_STATS_INTERVAL seconds.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.start_concurrency = settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN')
+        self.max_concurrency = settings.getint('ADAPTIVE_MAX_CONCURRENCY', 64)
+        self.min_delay = settings.getfloat('ADAPTIVE_MIN_DELAY', 0)
+        self.max_delay = settings.getfloat('ADAPTIVE_MAX_DELAY', 60)
+        self.backoff_delay = settings.getfloat('ADAPTIVE_BACKOFF_DELAY', 1)
+        self.window = settings.getint('ADAPTIVE_WINDOW', 20)
+        self.latency_tolerance = settings.getfloat('ADAPTIVE_LATENCY_TOLERANCE', 2)
+        self.stats_interval = settings.getfloat('ADAPTIVE_STATS_INTERVAL', 30)
+
+        # retries, with the same settings as Scrapy's RetryMiddleware (which this replaces)
+        self.max_retry_times = settings.getint('RETRY_TIMES')
+        self.retry_http_codes = {int(code) for code in settings.getlist('RETRY_HTTP_CODES')}
+        self.exceptions_to_retry = tuple(load_object(exception) if isinstance(exception, str) else exception
+                                         for exception in settings.getlist('RETRY_EXCEPTIONS'))
+
+        # the state of each host: its target concurrency, latency estimate and backoff delay, the responses, failures
+        # and total latency since its last adjustment, its fastest window and when it last backed off
+        self.hosts = dict()
+        self.downloaded = 0
+        self.last_report = (monotonic(), 0)
+        self.report_task = None
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        s = cls(crawler)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
     def process_request(self, request, spider):
-        # Called for each request that goes through the downloader
-        # middleware.
-
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
+        request.meta['adaptive_sent_time'] = monotonic()
         return None
 
     def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
-
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
+        if 'cached' in response.flags:
+            return response
+        failed = response.status in self.retry_http_codes
+        self.observe(request, failed or response.status in THROTTLE_HTTP_CODES,
+                     retry_after=response.headers.get('Retry-After'))
+        if failed and not request.meta.get('dont_retry', False):
+            return get_retry_request(request, spider=spider, reason=response_status_message(response.status),
+                                     max_retry_times=request.meta.get('max_retry_times', self.max_retry_times)) \
+                or response
         return response
 
     def process_exception(self, request, exception, spider):
-        # Called when a download handler or a process_request()
-        # (from other downloader middleware) raises an exception.
+        if isinstance(exception, IgnoreRequest):
+            return None
+        self.observe(request, failed=True)
+        if isinstance(exception, self.exceptions_to_retry) and not request.meta.get('dont_retry', False):
+            return get_retry_request(request, spider=spider, reason=exception,
+                                     max_retry_times=request.meta.get('max_retry_times', self.max_retry_times))
+        return None
 
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
-        pass
+    def observe(self, request, failed: bool, retry_after=None):
+        """
+        Record the outcome of a download, adjusting its host once a full window of outcomes has been seen.
+        """
+        key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return
+        host = self.hosts.setdefault(key, dict(concurrency=self.start_concurrency, latency_estimate=None, backoff=0.0,
+                                               responses=0, failures=0, latency=0.0, fastest=float('inf'),
+                                               backed_off=0.0))
+        self.downloaded += 1
+
+        # a rate limited host says how long to wait
+        if retry_after is not None:
+            try:
+                host['backoff'] = min(self.max_delay, max(host['backoff'], float(retry_after)))
+            except ValueError:
+                pass
+
+        latency = request.meta.get('download_latency')
+        if not failed:
+            host['latency_estimate'] = latency if host['latency_estimate'] is None else \
+                0.8 * host['latency_estimate'] + 0.2 * latency
+            host['backoff'] = host['backoff'] * 0.8 if host['backoff'] * 0.8 >= 0.01 else 0.0
+
+        # requests wait in the slot before being sent, so tell when they were sent from their latency if possible
+        sent = monotonic() - latency if latency is not None else request.meta.get('adaptive_sent_time', 0.0)
+        if sent >= host['backed_off']:
+            host['responses'] += 1
+            if failed:
+                host['failures'] += 1
+            else:
+                host['latency'] += latency
+            if host['responses'] >= self.window:
+                self.adjust(key, host)
+
+        # pace requests so that the target concurrency is in progress, plus any backoff
+        slot.concurrency = host['concurrency']
+        slot.delay = min(self.max_delay, max(self.min_delay, host['backoff'],
+                                             (host['latency_estimate'] or 0) / host['concurrency']))
+
+    def adjust(self, key: str, host: dict):
+        """
+        Additive increase/multiplicative decrease of the host's target concurrency over the last window, backing off
+        its delay as well after failures.
+        """
+        successes = host['responses'] - host['failures']
+        mean_latency = host['latency'] / successes if successes else None
+        if host['failures']:
+            host['concurrency'] = max(1, host['concurrency'] // 2)
+            host['backoff'] = min(self.max_delay, max(host['backoff'] * 2, self.backoff_delay))
+            host['backed_off'] = monotonic()
+        elif mean_latency > self.latency_tolerance * host['fastest']:
+            host['concurrency'] = max(1, host['concurrency'] - 1)
+        else:
+            host['concurrency'] = min(self.max_concurrency, host['concurrency'] + 1)
+
+        if mean_latency is not None:
+            host['fastest'] = min(host['fastest'], mean_latency)
+        host.update(responses=0, failures=0, latency=0.0)
+        self.crawler.stats.set_value(f'adaptive/{key}/concurrency', host['concurrency'])
+
+    def report(self):
+        """
+        Log and record the live request rate, the number of requests waiting in the scheduler and being downloaded,
+        and the current limits of each host.
+        """
+        stats = self.crawler.stats
+        now = monotonic()
+        last_time, last_downloaded = self.last_report
+        requests_per_second = (self.downloaded - last_downloaded) / max(now - last_time, 1e-9)
+        self.last_report = (now, self.downloaded)
+        queue_depth = stats.get_value('scheduler/enqueued', 0) - stats.get_value('scheduler/dequeued', 0)
+        in_progress = len(self.crawler.engine.downloader.active)
+
+        stats.set_value('adaptive/requests_per_second', round(requests_per_second, 2))
+        stats.set_value('adaptive/queue_depth', queue_depth)
+        stats.set_value('adaptive/in_progress', in_progress)
+        limits = ', '.join(f'{key}: concurrency {slot.concurrency}, delay {slot.delay:.2f}s'
+                           for key, slot in self.crawler.engine.downloader.slots.items())
+        self.crawler.spider.logger.info(f'{requests_per_second:.1f} requests/s, {queue_depth} queued, '
+                                        f'{in_progress} downloading ({limits})')
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+        if self.stats_interval:
+            self.report_task = task.LoopingCall(self.report)
+            self.report_task.start(self.stats_interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.report_task is not None and self.report_task.running:
+            self.report_task.stop()
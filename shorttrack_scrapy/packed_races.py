@@ -0,0 +1,320 @@
+from os.path import exists
+
+import numpy as np
+import pandas as pd
+
+from shorttrack_scrapy.constants import UNIQUE_RACE_COLUMNS, LONGEST_EVENT_LAPS, HALF_LAP_EVENTS, RACE_ID_COLUMN
+from shorttrack_scrapy.processing import LAP_FIELDS, MIN_VALID_LAPTIME, lap_matrix, lap_columns, float_column, \
+    seconds_column
+from shorttrack_scrapy.utils import normalize_key_value, select_keys
+
+# lap values are stored as float32, which holds the scraped times (to 4 decimal places) to within rounding
+PACKED_DTYPE = np.float32
+TIME_DECIMALS = 4
+
+
+def encode_column(column: pd.Series) -> dict:
+    """
+    Arrays storing a column without pickling: numeric columns as they are (nullable integers with a mask of their
+    missing values), any other column as integer codes into an array of its values (as strings, with -1 for missing
+    values).
+    """
+    if pd.api.types.is_extension_array_dtype(column) and pd.api.types.is_integer_dtype(column):
+        return dict(values=column.fillna(0).to_numpy(dtype=column.dtype.numpy_dtype), mask=column.isna().to_numpy())
+    if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+        return dict(values=column.to_numpy())
+    codes, uniques = pd.factorize(column.astype(object).where(column.isna(), column.astype(str)))
+    return dict(codes=codes.astype(np.int32), categories=np.asarray(uniques, dtype=str))
+
+
+def decode_column(arrays: dict) -> pd.Series:
+    if 'mask' in arrays:
+        return pd.Series(pd.arrays.IntegerArray(arrays['values'], arrays['mask']))
+    if 'values' in arrays:
+        return pd.Series(arrays['values'])
+    return pd.Series(pd.Categorical.from_codes(arrays['codes'], categories=arrays['categories']))
+
+
+def seconds_matrix(rounds_splits_df: pd.DataFrame, field: str, num_laps: int) -> np.ndarray:
+    """
+    As lap_matrix, reading the times ("1:26.345") as seconds. Only the laps present are parsed, rather than the 45 lap
+    columns of every athlete-race.
+    """
+    laps = rounds_splits_df.reindex(columns=lap_columns(field, num_laps))
+    present = laps.stack()
+    matrix = np.full(laps.shape, np.nan)
+    matrix[laps.index.get_indexer(present.index.get_level_values(0)),
+           laps.columns.get_indexer(present.index.get_level_values(1))] = seconds_column(present.astype(object))
+    return matrix
+
+
+def concat_tables(tables: list) -> pd.DataFrame:
+    """
+    Concatenate lookup tables which may have been typed differently (e.g. one loaded from a file and one packed from
+    a CSV read). A column which is numeric in some tables and text in others is written as text in all of them, with
+    whole numbers written the same way (2, 2.0 and '2' all become '2').
+    """
+    tables = [table.copy() for table in tables]
+    for col in {col for table in tables for col in table.columns}:
+        if len({pd.api.types.is_numeric_dtype(table[col]) for table in tables if col in table.columns}) > 1:
+            for table in tables:
+                if col in table.columns:
+                    column = table[col].astype(object)
+                    table[col] = column.where(column.isna(), column.map(normalize_key_value))
+    return pd.concat(tables, ignore_index=True)
+
+
+def rounded(values: np.ndarray) -> np.ndarray:
+    """
+    float32 lap values as the float64 values they were read from.
+    """
+    return np.round(values.astype(float), TIME_DECIMALS)
+
+
+def categorical_races(races: pd.DataFrame) -> pd.DataFrame:
+    """
+    The races table with its text race columns as categoricals.
+    """
+    for col in UNIQUE_RACE_COLUMNS:
+        if races[col].dtype == object:
+            races[col] = races[col].astype('category')
+    return races
+
+
+class PackedRaces(object):
+    """
+    The lap data of every athlete-race, packed race by race into flat float32 arrays rather than a lap_{i}_{field}
+    column for each of the 45 laps of the longest event. Each race takes a block of (athletes x laps) values in each
+    array, starting at its offset, so the value for athlete slot s on lap l (counting from 0) of race r is at
+    offset[r] + s * laps[r] + l. Races without lap data take no space.
+
+    Two lookup tables go with the arrays:
+     - races: one row per race, with its UNIQUE_RACE_COLUMNS (as categoricals), race ID (if the dataset has them),
+       offset, athletes and laps
+     - athletes: one row per athlete-race (in the order of the rounds_with_splits rows it was packed from), with its
+       round result columns, race_index and slot
+    """
+
+    def __init__(self, races: pd.DataFrame, athletes: pd.DataFrame, laps: dict):
+        self.races = races
+        self.athletes = athletes
+        # one flat float32 array per lap field
+        self.laps = laps
+
+    @classmethod
+    def from_rounds_splits(cls, rounds_splits_df: pd.DataFrame) -> 'PackedRaces':
+        """
+        Pack the wide lap columns of a rounds_with_splits dataset. Positions and laptimes are read as numbers as in
+        extract_laptimes, and elapsed times as seconds. Each race keeps as many laps as its longest run of lap data.
+        """
+        rounds_splits_df = rounds_splits_df.reset_index(drop=True)
+        athletes = rounds_splits_df[[col for col in rounds_splits_df.columns if not col.startswith('lap_')]].copy()
+        race_index = athletes.groupby(UNIQUE_RACE_COLUMNS, sort=False, dropna=False).ngroup().to_numpy()
+        athletes['race_index'] = race_index
+        athletes['slot'] = athletes.groupby('race_index', sort=False).cumcount().to_numpy()
+
+        num_laps = max([LONGEST_EVENT_LAPS] + [int(col.split('_')[1]) for col in rounds_splits_df.columns
+                                               if col.startswith('lap_') and col.endswith('_position')])
+        matrices = dict(position=lap_matrix(rounds_splits_df, 'position', num_laps),
+                        laptime=lap_matrix(rounds_splits_df, 'laptime', num_laps),
+                        elapsedtime=seconds_matrix(rounds_splits_df, 'elapsedtime', num_laps))
+
+        # each race keeps its laps up to the last one any of its athletes has a value for
+        has_value = np.zeros((len(athletes), num_laps), dtype=bool)
+        for matrix in matrices.values():
+            has_value |= ~np.isnan(matrix)
+        athlete_laps = np.where(has_value.any(axis=1), num_laps - np.argmax(has_value[:, ::-1], axis=1), 0)
+
+        race_columns = UNIQUE_RACE_COLUMNS + [col for col in [RACE_ID_COLUMN] if col in athletes.columns]
+        races = athletes.drop_duplicates('race_index')[race_columns + ['race_index']] \
+            .sort_values('race_index').set_index('race_index')
+        races.index.name = None
+        races = categorical_races(races)
+        races['athletes'] = np.bincount(race_index, minlength=len(races)).astype(np.int32)
+        races['laps'] = np.zeros(len(races), dtype=np.int32)
+        np.maximum.at(races['laps'].values, race_index, athlete_laps.astype(np.int32))
+        block_sizes = races['athletes'].to_numpy(dtype=np.int64) * races['laps'].to_numpy(dtype=np.int64)
+        races['offset'] = np.cumsum(block_sizes) - block_sizes
+
+        # scatter each athlete's laps into their slot of the race block
+        packed = cls(races, athletes, dict())
+        rows, lap_indices = packed.lap_indices()
+        destinations = packed.athlete_offsets()[rows] + lap_indices
+        for field, matrix in matrices.items():
+            values = np.full(int(block_sizes.sum()), np.nan, dtype=PACKED_DTYPE)
+            values[destinations] = matrix[rows, lap_indices]
+            packed.laps[field] = values
+        return packed
+
+    def select_races(self, races: np.ndarray) -> 'PackedRaces':
+        """
+        The packed lap data of only some races (by index), renumbered in the order given.
+        """
+        races = np.asarray(races, dtype=np.int64)
+        block_sizes = self.races['athletes'].to_numpy(dtype=np.int64) * self.races['laps'].to_numpy(dtype=np.int64)
+        block_sizes = block_sizes[races]
+        offsets = np.cumsum(block_sizes) - block_sizes
+        sources = np.repeat(self.races['offset'].to_numpy(dtype=np.int64)[races] - offsets, block_sizes) + \
+            np.arange(int(block_sizes.sum()))
+
+        new_index = np.full(len(self.races), -1, dtype=np.int64)
+        new_index[races] = np.arange(len(races))
+        athletes = self.athletes[new_index[self.athletes['race_index'].to_numpy()] >= 0].reset_index(drop=True)
+        athletes['race_index'] = new_index[athletes['race_index'].to_numpy()]
+        selected = self.races.iloc[races].reset_index(drop=True)
+        selected['offset'] = offsets
+        return PackedRaces(selected, athletes, {field: values[sources] for field, values in self.laps.items()})
+
+    @classmethod
+    def concat(cls, packs: list) -> 'PackedRaces':
+        """
+        The races of several PackedRaces one after the other, e.g. the races kept from a saved file and newly packed
+        races replacing the rest.
+        """
+        race_counts = np.array([len(packed.races) for packed in packs], dtype=np.int64)
+        lap_counts = np.array([len(packed.laps['position']) for packed in packs], dtype=np.int64)
+        races = concat_tables([packed.races.assign(offset=packed.races['offset'] + lap_start)
+                               for packed, lap_start in zip(packs, np.cumsum(lap_counts) - lap_counts)])
+        athletes = concat_tables([packed.athletes.assign(race_index=packed.athletes['race_index'] + race_start)
+                                  for packed, race_start in zip(packs, np.cumsum(race_counts) - race_counts)])
+        laps = {field: np.concatenate([packed.laps[field] for packed in packs]).astype(PACKED_DTYPE)
+                for field in LAP_FIELDS}
+        return cls(categorical_races(races), athletes, laps)
+
+    @classmethod
+    def load(cls, file_path: str) -> 'PackedRaces':
+        with np.load(file_path) as arrays:
+            tables = dict()
+            for table in ['races', 'athletes']:
+                columns = arrays[f'{table}_columns']
+                tables[table] = pd.DataFrame({col: decode_column({part: arrays[f'{table}:{col}:{part}']
+                                                                  for part in ['values', 'mask', 'codes', 'categories']
+                                                                  if f'{table}:{col}:{part}' in arrays.files})
+                                              for col in columns})
+            return cls(tables['races'], tables['athletes'], {field: arrays[f'laps:{field}'] for field in LAP_FIELDS})
+
+    def save(self, file_path: str):
+        """
+        Save the arrays and lookup tables to an uncompressed .npz file.
+        """
+        arrays = {f'laps:{field}': values for field, values in self.laps.items()}
+        for table, df in [('races', self.races), ('athletes', self.athletes)]:
+            arrays[f'{table}_columns'] = np.asarray(df.columns, dtype=str)
+            for col in df.columns:
+                arrays.update({f'{table}:{col}:{part}': values for part, values in encode_column(df[col]).items()})
+        with open(file_path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(values.nbytes for values in self.laps.values())
+
+    def athlete_offsets(self) -> np.ndarray:
+        """
+        The position of each athlete-race's first lap in the lap arrays.
+        """
+        race_index = self.athletes['race_index'].to_numpy()
+        return self.races['offset'].to_numpy()[race_index] + \
+            self.athletes['slot'].to_numpy() * self.races['laps'].to_numpy()[race_index]
+
+    def lap_indices(self) -> (np.ndarray, np.ndarray):
+        """
+        The athlete row and lap index (from 0) of every packed lap, by athlete row then lap.
+        """
+        athlete_laps = self.races['laps'].to_numpy()[self.athletes['race_index'].to_numpy()]
+        rows = np.repeat(np.arange(len(self.athletes)), athlete_laps)
+        lap_indices = np.arange(len(rows)) - np.repeat(np.cumsum(athlete_laps) - athlete_laps, athlete_laps)
+        return rows, lap_indices
+
+    def find_races(self, **key) -> np.ndarray:
+        """
+        The indices of the races matching the given race column values, e.g. find_races(season='2019-2020',
+        event='1500m').
+        """
+        matches = np.ones(len(self.races), dtype=bool)
+        for col, value in key.items():
+            matches &= (self.races[col] == value).to_numpy()
+        return np.flatnonzero(matches)
+
+    def race_laps(self, race: int, field: str = 'laptime') -> np.ndarray:
+        """
+        A (athletes x laps) view of one lap field for a race, with a row per athlete slot.
+        """
+        offset, athletes, laps = self.races.iloc[race][['offset', 'athletes', 'laps']].astype(int)
+        return self.laps[field][offset:offset + athletes * laps].reshape(athletes, laps)
+
+    def race_athletes(self, race: int) -> pd.DataFrame:
+        """
+        The athletes of a race, in slot order (the rows of race_laps).
+        """
+        athletes = self.athletes[self.athletes['race_index'] == race]
+        return athletes.sort_values('slot')
+
+    def athlete_laps(self, row: int, field: str = 'laptime') -> np.ndarray:
+        """
+        A view of one lap field for one athlete-race (a row of athletes), with a value per lap of the race.
+        """
+        race = self.athletes['race_index'].iat[row]
+        laps = int(self.races['laps'].iat[race])
+        offset = int(self.races['offset'].iat[race]) + int(self.athletes['slot'].iat[row]) * laps
+        return self.laps[field][offset:offset + laps]
+
+    def to_wide(self, num_laps: int = LONGEST_EVENT_LAPS) -> pd.DataFrame:
+        """
+        Unpack into the wide rounds_with_splits layout, with lap times and elapsed times as float seconds.
+        """
+        rows, lap_indices = self.lap_indices()
+        destinations = self.athlete_offsets()[rows] + lap_indices
+        num_laps = max(num_laps, int(self.races['laps'].max()) if len(self.races) else 0)
+        wide = dict()
+        for field in LAP_FIELDS:
+            matrix = np.full((len(self.athletes), num_laps), np.nan)
+            matrix[rows, lap_indices] = rounded(self.laps[field][destinations])
+            wide.update(zip(lap_columns(field, num_laps), matrix.T))
+        wide = pd.DataFrame(wide, index=self.athletes.index)
+        wide = wide[[f'lap_{lap}_{field}' for lap in range(1, num_laps + 1) for field in LAP_FIELDS]]
+        return pd.concat([self.athletes.drop(columns=['race_index', 'slot']), wide], axis=1)
+
+    def laptimes(self, race_details_cols: list) -> pd.DataFrame:
+        """
+        One row per athlete per lap with the positions gained/lost during that lap, as extract_laptimes derives from
+        the wide columns, but scanning only the laps each race has.
+        """
+        rows, lap_indices = self.lap_indices()
+        destinations = self.athlete_offsets()[rows] + lap_indices
+        laptimes = rounded(self.laps['laptime'][destinations])
+        end_positions = rounded(self.laps['position'][destinations])
+
+        # the first lap starts from the start position, and every other lap from the end of the previous lap
+        first_lap = lap_indices == 0
+        start_positions = np.where(first_lap, float_column(self.athletes['Start Pos.']).to_numpy()[rows],
+                                   np.roll(end_positions, 1))
+
+        start_lap = np.where(self.athletes['event'].isin(HALF_LAP_EVENTS), 2, 1)
+        with np.errstate(invalid='ignore'):
+            valid_laps = (lap_indices + 1 >= start_lap[rows]) & (laptimes > MIN_VALID_LAPTIME)
+        previous_laptimes = np.where(~first_lap & np.roll(valid_laps, 1), np.roll(laptimes, 1), np.nan)
+
+        kept = np.flatnonzero(valid_laps)
+        laptimes_df = self.athletes[race_details_cols].iloc[rows[kept]].reset_index(drop=True)
+        laptimes_df['lap'] = lap_indices[kept] + 1
+        laptimes_df['laptime'] = laptimes[kept]
+        laptimes_df['lap_start_position'] = start_positions[kept]
+        laptimes_df['lap_end_position'] = end_positions[kept]
+        laptimes_df['position_change'] = (-1) * (laptimes_df['lap_end_position'] - laptimes_df['lap_start_position'])
+        laptimes_df['previous_laptime'] = previous_laptimes[kept]
+        laptimes_df['lap_delta'] = laptimes_df['laptime'] - laptimes_df['previous_laptime']
+        return laptimes_df
+
+
+def upsert_packed_races(packed: PackedRaces, file_path: str, keys: set) -> PackedRaces:
+    """
+    Replace the races of the packed file_path whose UNIQUE_RACE_COLUMNS match one of the normalized keys with the
+    races of packed, keeping the arrays of every other race as they are. Returns the races saved.
+    """
+    if exists(file_path):
+        existing = PackedRaces.load(file_path)
+        kept = np.flatnonzero(~select_keys(existing.races, UNIQUE_RACE_COLUMNS, keys))
+        packed = PackedRaces.concat([existing.select_races(kept), packed])
+    packed.save(file_path)
+    return packed
@@ -4,28 +4,220 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://doc.scrapy.org/en/latest/topics/item-pipeline.html
-from logging import info
-from os import replace
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from logging import info, warning
+from os import replace, environ
 from os.path import exists
+from shutil import copyfile
+import subprocess
+import sys
+from time import monotonic, perf_counter
 
-import numpy as np
 import pandas as pd
-from tqdm import tqdm
 
 from shorttrack_scrapy.constants import ROUNDS_SPLITS_FILE, ROUNDS_FILE, SPLITS_FILE, LAPTIMES_FILE, \
-    PREVIOUS_LAPTIMES_FILE, UNIQUE_RACE_COLUMNS, HALF_LAP_EVENTS, LONGEST_EVENT_LAPS, LIGHT_ATHLETE_NAMES, \
-    ROUNDS_SPLITS_LIGHT_FILE, LAPTIMES_LIGHT_FILE, COMPRESSED_LAPTIMES_FILE, PREVIOUS_COMPRESSED_LAPTIMES_FILE
-from shorttrack_scrapy.utils import save_parsed_data
+    PREVIOUS_LAPTIMES_FILE, LIGHT_ATHLETE_NAMES, ROUNDS_SPLITS_LIGHT_FILE, LAPTIMES_LIGHT_FILE, \
+    COMPRESSED_LAPTIMES_FILE, PREVIOUS_COMPRESSED_LAPTIMES_FILE, UNIQUE_RACE_COLUMNS, ROUNDS_SPLITS_PARQUET_FILE, \
+    LAPTIMES_PARQUET_FILE, ROUNDS_SPLITS_LIGHT_PARQUET_FILE, LAPTIMES_LIGHT_PARQUET_FILE, PACKED_RACES_FILE, \
+    PACKED_RACES_LIGHT_FILE, ID_COLUMNS, RACE_ID_COLUMN, RACE_ANALYTICS_FILE, RACE_ANALYTICS_LIGHT_FILE, \
+    FULL_DATASET, LIGHT_DATASET, ATHLETE_PROFILES_SCRIPT
+from shorttrack_scrapy.metrics import PIPELINE_SECONDS_STAT
+from shorttrack_scrapy.packed_races import PackedRaces, upsert_packed_races
+from shorttrack_scrapy.processing import merge_rounds_splits, extract_laptimes, race_details_columns, \
+    LAP_DELTA_COLUMNS
+from shorttrack_scrapy.items import RoundItem
+from shorttrack_scrapy.race_analytics import race_analytics
+from shorttrack_scrapy.registry import IdRegistry
+from shorttrack_scrapy.utils import read_keys, upsert_parsed_data, save_parsed_data, normalize_key, save_parquet, \
+    upsert_parquet
+
+
+def light_athlete_ids(rounds_splits_df: pd.DataFrame) -> list:
+    """
+    The ISU IDs of the athletes of the light datasets: those who appear under any of the LIGHT_ATHLETE_NAMES, so that
+    the rows with any other spelling of their names are included too.
+    """
+    return rounds_splits_df.loc[rounds_splits_df['Name'].isin(LIGHT_ATHLETE_NAMES), 'ISU ID'].dropna().unique().tolist()
 
 
 class ShorttrackScrapyPipeline(object):
+    def __init__(self, incremental: bool = True, batch_size: int = 5000, flush_interval: float = 30, stats=None):
+        self.incremental = incremental
+        self.new_races = set()
+        # integer IDs of the competitions, rounds, races and athletes, assigned as their rounds are scraped
+        self.registry = IdRegistry.load()
+
+        # time spent in each stage of the pipeline, also recorded in the crawl stats (if run by a crawl)
+        self.stats = stats
+        self.stage_seconds = defaultdict(float)
+
+        # parsed rows waiting to be written, by file; batches are written in order on a single background thread
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = defaultdict(list)
+        self.buffered_rows = 0
+        self.last_flush = monotonic()
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        self.pending_writes = list()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(incremental=crawler.settings.getbool('INCREMENTAL_PROCESSING', True),
+                   batch_size=crawler.settings.getint('OUTPUT_BATCH_SIZE', 5000),
+                   flush_interval=crawler.settings.getfloat('OUTPUT_FLUSH_INTERVAL', 30),
+                   stats=crawler.stats)
+
+    @contextmanager
+    def timed(self, stage: str):
+        """
+        Add the time taken by the block to the total of a pipeline stage.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_seconds(stage, perf_counter() - start)
+
+    def add_stage_seconds(self, stage: str, seconds: float):
+        """
+        Add to the total of a pipeline stage. Only called from the crawl's thread, as the crawl stats aren't
+        thread-safe.
+        """
+        self.stage_seconds[stage] += seconds
+        if self.stats is not None:
+            self.stats.inc_value(PIPELINE_SECONDS_STAT + stage, seconds)
+
     def process_item(self, item, spider):
+        with self.timed('process_item'):
+            self.buffer[item.file_path].extend(item['rows'])
+            self.buffered_rows += len(item['rows'])
+
+            # keep track of the races scraped in this crawl
+            if isinstance(item, RoundItem):
+                self.new_races.update(normalize_key(row[col] for col in UNIQUE_RACE_COLUMNS) for row in item['rows'])
+                self.registry.register_rows(item['rows'])
+
+            if self.buffered_rows >= self.batch_size or monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
         return item
 
+    def flush(self):
+        """
+        Hand the buffered rows over to the writer thread, to be appended to their files.
+        """
+        buffer, self.buffer = self.buffer, defaultdict(list)
+        self.buffered_rows = 0
+        self.last_flush = monotonic()
+        if buffer:
+            self.pending_writes.append(self.writer.submit(self.write_buffer, buffer))
+        self.collect_writes()
+
+    def collect_writes(self):
+        """
+        Add the time taken by each finished write to the write_buffer stage, here on the crawl's thread.
+        """
+        finished = [write for write in self.pending_writes if write.done()]
+        self.pending_writes = [write for write in self.pending_writes if write not in finished]
+        for write in finished:
+            self.add_stage_seconds('write_buffer', write.result())
+
+    @staticmethod
+    def write_buffer(buffer: dict) -> float:
+        """
+        Append buffered rows to their files, on the writer thread. Returns the time taken, in seconds.
+        """
+        start = perf_counter()
+        for file_path, rows in buffer.items():
+            save_parsed_data(df=pd.DataFrame(rows), file_path=file_path)
+        return perf_counter() - start
+
     def close_spider(self, spider):
-        rounds_splits_df = self.combine_rounds_splits()
-        self.generate_laptimes(rounds_splits_df)
-        self.generate_light(rounds_splits_df)
+        # write out everything parsed before processing it
+        with self.timed('finish_writes'):
+            self.flush()
+            self.writer.shutdown(wait=True)
+            self.collect_writes()
+
+        # laptimes saved before the lap-over-lap or ID columns were added have to be rebuilt in full
+        incremental = self.incremental and exists(ROUNDS_SPLITS_FILE) and exists(LAPTIMES_FILE) and \
+            set(LAP_DELTA_COLUMNS + ID_COLUMNS).issubset(pd.read_csv(LAPTIMES_FILE, nrows=0).columns)
+        if incremental:
+            with self.timed('update_new_races'):
+                self.update_new_races(self.new_races)
+        else:
+            with self.timed('combine_rounds_splits'):
+                rounds_splits_df = self.combine_rounds_splits()
+            with self.timed('generate_laptimes'):
+                self.generate_laptimes(rounds_splits_df)
+            with self.timed('generate_light'):
+                self.generate_light(rounds_splits_df)
+        self.registry.save()
+
+        # the dashboard's precomputed stores are out of date as soon as the derived data changes
+        if not incremental or self.new_races:
+            with self.timed('build_athlete_profiles'):
+                self.build_athlete_profiles()
+
+        info('Pipeline stage times: ' + ', '.join(f'{stage} {seconds:.2f}s'
+                                                   for stage, seconds in self.stage_seconds.items()))
+
+    def update_new_races(self, new_races: set):
+        """
+        Merge and extract lap data for only the races scraped in this crawl, and upsert them into the existing full and
+        light datasets.
+        """
+        if not new_races:
+            info('No new races scraped. Derived data is already up to date.')
+            return
+        info(f'Updating derived data for {len(new_races)} new races.')
+
+        # load in the scraped data for the new races
+        new_rounds, new_splits = self.registry.scraped_with_ids(read_keys(ROUNDS_FILE, UNIQUE_RACE_COLUMNS, new_races),
+                                                                read_keys(SPLITS_FILE, UNIQUE_RACE_COLUMNS, new_races))
+
+        # merge and extract lap data for the new races
+        rounds_splits_df = merge_rounds_splits(new_rounds, new_splits, race_columns=[RACE_ID_COLUMN])
+        laptimes_df = extract_laptimes(rounds_splits_df, race_details_columns(rounds_splits_df))
+
+        # upsert into the full datasets, keeping a backup of the existing laptime data
+        upsert_parsed_data(rounds_splits_df, ROUNDS_SPLITS_FILE, UNIQUE_RACE_COLUMNS, new_races)
+        copyfile(LAPTIMES_FILE, PREVIOUS_LAPTIMES_FILE)
+        upsert_parsed_data(laptimes_df, LAPTIMES_FILE, UNIQUE_RACE_COLUMNS, new_races)
+
+        # upsert into the light datasets, finding the light athletes' ISU IDs under any spelling of their names so far
+        light_athletes = light_athlete_ids(pd.read_csv(ROUNDS_SPLITS_FILE, usecols=['Name', 'ISU ID']))
+        light_rounds_splits_df = rounds_splits_df[rounds_splits_df['ISU ID'].isin(light_athletes)]
+        light_laptimes_df = laptimes_df[laptimes_df['ISU ID'].isin(light_athletes)]
+        upsert_parsed_data(light_rounds_splits_df, ROUNDS_SPLITS_LIGHT_FILE, UNIQUE_RACE_COLUMNS, new_races)
+        upsert_parsed_data(light_laptimes_df, LAPTIMES_LIGHT_FILE, UNIQUE_RACE_COLUMNS, new_races)
+
+        # upsert into the Parquet datasets
+        upsert_parquet(rounds_splits_df, ROUNDS_SPLITS_PARQUET_FILE, UNIQUE_RACE_COLUMNS, new_races)
+        upsert_parquet(laptimes_df, LAPTIMES_PARQUET_FILE, UNIQUE_RACE_COLUMNS, new_races)
+        upsert_parquet(light_rounds_splits_df, ROUNDS_SPLITS_LIGHT_PARQUET_FILE, UNIQUE_RACE_COLUMNS, new_races)
+        upsert_parquet(light_laptimes_df, LAPTIMES_LIGHT_PARQUET_FILE, UNIQUE_RACE_COLUMNS, new_races)
+
+        # pack the lap data of the new races into the packed datasets
+        self.pack_races(rounds_splits_df, PACKED_RACES_FILE, RACE_ANALYTICS_FILE, new_races)
+        self.pack_races(light_rounds_splits_df, PACKED_RACES_LIGHT_FILE, RACE_ANALYTICS_LIGHT_FILE, new_races)
+
+        # the compressed Pickle of every lap is only rebuilt by a full rebuild, as it can't be updated in place
+        info(f'{COMPRESSED_LAPTIMES_FILE} is left as it was; it is rebuilt with INCREMENTAL_PROCESSING=False.')
+
+    @staticmethod
+    def build_athlete_profiles():
+        """
+        Rebuild the dashboard's profile store and percentile index of the full and light datasets. The dashboard modules
+        read which dataset to use when they are imported, so each dataset is built by a separate process. A failed build
+        doesn't stop the pipeline, as the dashboard can still build each athlete's profile from their data.
+        """
+        for dataset in [FULL_DATASET, LIGHT_DATASET]:
+            info(f'Building the athlete profiles of the {dataset} dataset.')
+            if subprocess.run([sys.executable, ATHLETE_PROFILES_SCRIPT], env=dict(environ, DATASET=dataset)).returncode:
+                warning(f'The athlete profiles of the {dataset} dataset could not be built. Build them with '
+                        f'`DATASET={dataset} python {ATHLETE_PROFILES_SCRIPT}`.')
 
     def combine_rounds_splits(self):
         """
@@ -34,93 +226,41 @@ class ShorttrackScrapyPipeline(object):
         """
         info('Merging laptime data with round-by-round data.')
 
-        # load in the scraped data
-        all_rounds = pd.read_csv(ROUNDS_FILE)
-        all_splits = pd.read_csv(SPLITS_FILE)
-
-        # separate each race into its own group
-        individual_races = all_rounds.groupby(UNIQUE_RACE_COLUMNS)
-        rounds_splits_df = all_rounds.copy()
-
-        for race_details, athlete_race_data in tqdm(individual_races):
-            athlete_indices = athlete_race_data.index
-
-            # find the laptime data corresponding to this race
-            laps = all_splits[(all_splits['season'] == race_details[0]) &
-                              (all_splits['competition'] == race_details[1]) &
-                              (all_splits['event'] == race_details[2]) &
-                              (all_splits['instance_of_event_in_competition'] == race_details[3]) &
-                              (all_splits['gender'] == race_details[4]) &
-                              (all_splits['round'] == race_details[5]) &
-                              (all_splits['race'] == race_details[6])]
-
-            # indicate how many laps' worth of split data were found for this race
-            rounds_splits_df.loc[athlete_indices, 'laps_of_split_data'] = laps.shape[0]
-
-            # append lap data columns to the race data
-            if laps.shape[0] > 1:
-                for athlete_index in athlete_indices:
-                    athlete_start_position = f'START_POS_{rounds_splits_df.loc[athlete_index, "Start Pos."]}'
-
-                    if f'{athlete_start_position} POSITION' in laps.columns:
-                        for lap_number, (lap_index, lap_data) in enumerate(laps.iterrows()):
-                            rounds_splits_df.loc[athlete_index, f'lap_{lap_number + 1}_position'] = lap_data[
-                                f'{athlete_start_position} POSITION'] if lap_data[
-                                f'{athlete_start_position} POSITION'] else np.nan
-                            rounds_splits_df.loc[athlete_index, f'lap_{lap_number + 1}_laptime'] = lap_data[
-                                f'{athlete_start_position} LAP TIME']
-                            rounds_splits_df.loc[athlete_index, f'lap_{lap_number + 1}_elapsedtime'] = lap_data[
-                                f'{athlete_start_position} ELAPSED TIME']
-
-        # replace zeros with NaNs
-        pos_cols = [f'lap_{x}_position' for x in range(1, 46)]
-        laptime_cols = [f'lap_{x}_laptime' for x in range(1, 46)]
-        rounds_splits_df[pos_cols] = rounds_splits_df[pos_cols].replace(0.0, np.nan)
-        rounds_splits_df[laptime_cols] = rounds_splits_df[laptime_cols].replace(0.0, np.nan)
-
-        # save to CSV for loading in dashboard
-        rounds_splits_df.to_csv(ROUNDS_SPLITS_FILE, index=False)
+        # load in the scraped data, with the integer IDs of its keys
+        all_rounds, all_splits = self.registry.scraped_with_ids(pd.read_csv(ROUNDS_FILE), pd.read_csv(SPLITS_FILE))
+
+        # join each athlete's laps onto their race result
+        rounds_splits_df = merge_rounds_splits(all_rounds, all_splits, race_columns=[RACE_ID_COLUMN])
+        self.save_rounds_splits(rounds_splits_df)
         return rounds_splits_df
 
+    def save_rounds_splits(self, rounds_splits_df: pd.DataFrame):
+        """
+        Save the full rounds_with_splits dataset.
+        """
+        # save to CSV, to Parquet for loading in dashboard, and packed race by race for race-level analysis
+        rounds_splits_df.to_csv(ROUNDS_SPLITS_FILE, index=False)
+        save_parquet(rounds_splits_df, ROUNDS_SPLITS_PARQUET_FILE)
+        self.pack_races(rounds_splits_df, PACKED_RACES_FILE, RACE_ANALYTICS_FILE)
+
     def generate_laptimes(self, rounds_splits_df: pd.DataFrame):
         """
         Extract positions gained/lost from laptime data.
         """
         info(f'Extracting passing data for {len(rounds_splits_df)} athletes.')
 
-        # make a backup of existing laptime data
+        # derive every athlete's laps at once and write them in one go
+        laptimes_df = extract_laptimes(rounds_splits_df, race_details_columns(rounds_splits_df))
+        self.save_laptimes(laptimes_df)
+
+    def save_laptimes(self, laptimes_df: pd.DataFrame):
+        """
+        Save the full laptimes dataset, keeping a backup of the existing one.
+        """
         if exists(LAPTIMES_FILE):
             replace(LAPTIMES_FILE, PREVIOUS_LAPTIMES_FILE)
-
-        race_details_cols = list(rounds_splits_df.columns[:17])
-        lap_details_cols = race_details_cols.copy()
-        lap_details_cols.extend(['lap', 'laptime', 'lap_start_position', 'lap_end_position', 'position_change'])
-
-        for index, athlete_race in tqdm(rounds_splits_df.iterrows()):
-            laptimes = pd.DataFrame(columns=lap_details_cols)
-
-            # detect if the event starts with a half-lap
-            start_lap = 2 if athlete_race['event'] in HALF_LAP_EVENTS else 1
-
-            for i in range(start_lap, LONGEST_EVENT_LAPS + 1):
-                try:
-                    laptime = float(athlete_race[f'lap_{i}_laptime'])
-                except Exception:
-                    laptime = np.nan
-
-                # TODO use standard deviation to filter out erroneous laptimes instead of the 7.8 threshold
-                if not np.isnan(laptime) and laptime > 7.8:
-                    # if we have laptime data for lap i, append it to the list
-                    lap_details = athlete_race[race_details_cols]
-                    lap_details['lap'] = i
-                    lap_details['laptime'] = laptime
-                    lap_details['lap_start_position'] = float(athlete_race[f'lap_{i - 1}_position']) if i > 1 else float(athlete_race['Start Pos.'])
-                    lap_details['lap_end_position'] = float(athlete_race[f'lap_{i}_position'])
-                    lap_details['position_change'] = (-1) * (lap_details['lap_end_position'] - lap_details['lap_start_position'])
-
-                    laptimes = laptimes.append(lap_details)
-
-            save_parsed_data(df=laptimes, file_path=LAPTIMES_FILE)
+        laptimes_df.to_csv(LAPTIMES_FILE, index=False)
+        save_parquet(laptimes_df, LAPTIMES_PARQUET_FILE)
 
     def generate_light(self, rounds_splits_df: pd.DataFrame):
         """
@@ -129,13 +269,44 @@ class ShorttrackScrapyPipeline(object):
         """
         info('Generating lightweight dataset.')
 
-        light_rounds_splits_df = rounds_splits_df[rounds_splits_df["Name"].isin(LIGHT_ATHLETE_NAMES)]
+        light_athletes = light_athlete_ids(rounds_splits_df)
+        light_rounds_splits_df = rounds_splits_df[rounds_splits_df['ISU ID'].isin(light_athletes)]
         light_rounds_splits_df.to_csv(ROUNDS_SPLITS_LIGHT_FILE, index=False)
+        save_parquet(light_rounds_splits_df, ROUNDS_SPLITS_LIGHT_PARQUET_FILE)
+        self.pack_races(light_rounds_splits_df, PACKED_RACES_LIGHT_FILE, RACE_ANALYTICS_LIGHT_FILE)
 
         laptimes_df = pd.read_csv(LAPTIMES_FILE)
-        light_laptimes_df = laptimes_df[laptimes_df["Name"].isin(LIGHT_ATHLETE_NAMES)]
+        light_laptimes_df = laptimes_df[laptimes_df['ISU ID'].isin(light_athletes)]
         light_laptimes_df.to_csv(LAPTIMES_LIGHT_FILE, index=False)
+        save_parquet(light_laptimes_df, LAPTIMES_LIGHT_PARQUET_FILE)
+
+        self.compress_laptimes(laptimes_df)
 
-        if exists(COMPRESSED_LAPTIMES_FILE):
-            replace(COMPRESSED_LAPTIMES_FILE, PREVIOUS_COMPRESSED_LAPTIMES_FILE)
-        laptimes_df.to_pickle(COMPRESSED_LAPTIMES_FILE, compression='zip')
+    def pack_races(self, rounds_splits_df: pd.DataFrame, file_path: str, analytics_file_path: str,
+                   new_races: set = None):
+        """
+        Save the lap data of a rounds_with_splits dataset packed race by race into flat arrays (see PackedRaces), and
+        the race analytics computed from them. With new_races, rounds_splits_df only has the new races, which replace
+        any earlier version of them among the saved races and analytics (the analytics of each race only depend on its
+        own laps).
+        """
+        with self.timed('pack_races'):
+            packed = PackedRaces.from_rounds_splits(rounds_splits_df)
+            if new_races is None:
+                packed.save(file_path)
+            else:
+                upsert_packed_races(packed, file_path, new_races)
+        with self.timed('race_analytics'):
+            if new_races is None:
+                race_analytics(packed).to_csv(analytics_file_path, index=False)
+            else:
+                upsert_parsed_data(race_analytics(packed), analytics_file_path, UNIQUE_RACE_COLUMNS, new_races)
+
+    def compress_laptimes(self, laptimes_df: pd.DataFrame):
+        """
+        Save the full laptimes dataset as a compressed Pickle file, keeping a backup of the existing one.
+        """
+        with self.timed('compress_laptimes'):
+            if exists(COMPRESSED_LAPTIMES_FILE):
+                replace(COMPRESSED_LAPTIMES_FILE, PREVIOUS_COMPRESSED_LAPTIMES_FILE)
+            laptimes_df.to_pickle(COMPRESSED_LAPTIMES_FILE, compression='zip')
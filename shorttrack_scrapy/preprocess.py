@@ -0,0 +1,132 @@
+"""
+Rebuild the derived datasets from the scraped data across a pool of worker processes, instead of in the single
+process that runs the pipeline at the end of a crawl:
+
+    python -m shorttrack_scrapy.preprocess --workers 8
+
+Races are independent of each other, so the scraped rounds and splits are partitioned by season (or with --shards, by
+a hash of the race key), and each partition is merged and broken into laps by one worker. The partitions are combined
+in the order of the scraped rows, so the datasets are the same as the pipeline's whatever the number of workers or
+partitions.
+"""
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from logging import info
+
+import pandas as pd
+
+from shorttrack_scrapy.constants import ROUNDS_FILE, SPLITS_FILE, UNIQUE_RACE_COLUMNS, RACE_ID_COLUMN
+from shorttrack_scrapy.pipelines import ShorttrackScrapyPipeline
+from shorttrack_scrapy.processing import merge_rounds_splits, extract_laptimes, race_details_columns
+from shorttrack_scrapy.utils import normalize_key_columns
+
+# carries the scraped row of each athlete-race through the workers, to put the combined partitions back in order
+ROW_COLUMN = 'scraped_row'
+
+
+def partition_keys(df: pd.DataFrame, shards: int = None) -> pd.Series:
+    """
+    The partition of each row of all_rounds or all_splits: its season, or the hash of its race key into one of
+    `shards` partitions. Key values are normalized first, so that a race's rounds and splits share a partition.
+    """
+    if shards:
+        race_keys = normalize_key_columns(df, UNIQUE_RACE_COLUMNS)
+        return (pd.util.hash_pandas_object(race_keys, index=False) % shards).astype(str)
+    return normalize_key_columns(df, ['season'])['season']
+
+
+def preprocess_partition(all_rounds: pd.DataFrame, all_splits: pd.DataFrame) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Merge the rounds and splits of one partition and extract their laps. The rounds_with_splits rows keep the index of
+    all_rounds, and each lap the all_rounds index of its athlete-race in ROW_COLUMN. Races are matched on their integer
+    IDs if both frames have them.
+    """
+    race_columns = [RACE_ID_COLUMN] if RACE_ID_COLUMN in all_rounds.columns and RACE_ID_COLUMN in all_splits.columns \
+        else UNIQUE_RACE_COLUMNS
+    rounds_splits_df = merge_rounds_splits(all_rounds, all_splits, race_columns=race_columns)
+    race_details_cols = race_details_columns(rounds_splits_df)
+    # added in place for the extraction, rather than copying the wide lap columns
+    rounds_splits_df[ROW_COLUMN] = rounds_splits_df.index
+    laptimes_df = extract_laptimes(rounds_splits_df, race_details_cols + [ROW_COLUMN])
+    del rounds_splits_df[ROW_COLUMN]
+    return rounds_splits_df, laptimes_df
+
+
+def combine_partitions(results: list) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Put the rounds_with_splits and laptimes of every partition back in the order of the scraped rows.
+    """
+    if len(results) == 1:
+        rounds_splits_df, laptimes_df = results[0]
+        return rounds_splits_df, laptimes_df.drop(columns=ROW_COLUMN)
+
+    # a partition with longer races has more lap columns, in the same order
+    columns = max((rounds_splits_df.columns for rounds_splits_df, _ in results), key=len)
+    rounds_splits_df = pd.concat([rounds_splits_df for rounds_splits_df, _ in results])
+    rounds_splits_df = rounds_splits_df.sort_index(kind='mergesort')[columns]
+
+    # each athlete's laps are already in lap order within their partition
+    laptimes_df = pd.concat([laptimes_df for _, laptimes_df in results], ignore_index=True)
+    laptimes_df = laptimes_df.sort_values(ROW_COLUMN, kind='mergesort').drop(columns=ROW_COLUMN)
+    return rounds_splits_df, laptimes_df.reset_index(drop=True)
+
+
+def preprocess(all_rounds: pd.DataFrame, all_splits: pd.DataFrame, workers: int = None,
+               shards: int = None) -> (pd.DataFrame, pd.DataFrame):
+    """
+    merge_rounds_splits and extract_laptimes for the whole scraped dataset, one partition per task across a pool of
+    worker processes.
+    """
+    # a single worker merges everything at once in this process, without the cost of handing partitions over
+    if workers == 1:
+        return combine_partitions([preprocess_partition(all_rounds, all_splits)])
+
+    rounds_partitions = dict(list(all_rounds.groupby(partition_keys(all_rounds, shards), sort=True)))
+    splits_partitions = dict(list(all_splits.groupby(partition_keys(all_splits, shards), sort=True)))
+    no_splits = all_splits.iloc[:0]
+
+    # hand out the largest partitions first, so the pool isn't left waiting on a large one at the end
+    partitions = sorted(rounds_partitions, key=lambda partition: len(rounds_partitions[partition]), reverse=True)
+    if not partitions:
+        return combine_partitions([preprocess_partition(all_rounds, all_splits)])
+    info(f'Preprocessing {len(all_rounds)} athlete-races in {len(partitions)} partitions.')
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(preprocess_partition, [rounds_partitions[partition] for partition in partitions],
+                                [splits_partitions.get(partition, no_splits) for partition in partitions]))
+    return combine_partitions(results)
+
+
+def rebuild(workers: int = None, shards: int = None):
+    """
+    Rebuild the full and light datasets from the scraped data, as a crawl with INCREMENTAL_PROCESSING=False would.
+    """
+    pipeline = ShorttrackScrapyPipeline(incremental=False)
+    all_rounds, all_splits = pipeline.registry.scraped_with_ids(pd.read_csv(ROUNDS_FILE), pd.read_csv(SPLITS_FILE))
+    with pipeline.timed('preprocess'):
+        rounds_splits_df, laptimes_df = preprocess(all_rounds, all_splits, workers=workers, shards=shards)
+    with pipeline.timed('save_rounds_splits'):
+        pipeline.save_rounds_splits(rounds_splits_df)
+    with pipeline.timed('save_laptimes'):
+        pipeline.save_laptimes(laptimes_df)
+    with pipeline.timed('generate_light'):
+        pipeline.generate_light(rounds_splits_df)
+    pipeline.registry.save()
+    with pipeline.timed('build_athlete_profiles'):
+        pipeline.build_athlete_profiles()
+    info('Preprocessing stage times: ' + ', '.join(f'{stage} {seconds:.2f}s'
+                                                  for stage, seconds in pipeline.stage_seconds.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: one per CPU)')
+    parser.add_argument('--shards', type=int, default=None,
+                        help='number of partitions by race key hash (default: one partition per season)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    rebuild(args.workers, args.shards)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import numpy as np
+import pandas as pd
+
+from shorttrack_scrapy.constants import UNIQUE_RACE_COLUMNS, MAX_ATHLETES_IN_RACE, LONGEST_EVENT_LAPS, HALF_LAP_EVENTS, \
+    ID_COLUMNS
+from shorttrack_scrapy.normalize import seconds_column
+
+LAP_FIELDS = ['position', 'laptime', 'elapsedtime']
+SPLIT_FIELDS = {'position': 'POSITION', 'laptime': 'LAP TIME', 'elapsedtime': 'ELAPSED TIME'}
+LAP_DELTA_COLUMNS = ['previous_laptime', 'lap_delta']
+
+# columns stored as categoricals in the Parquet datasets
+CATEGORY_COLUMNS = ['season', 'competition', 'event', 'gender', 'round', 'Name']
+
+# TODO use standard deviation to filter out erroneous laptimes instead of the 7.8 threshold
+MIN_VALID_LAPTIME = 7.8
+
+
+def lap_columns(field: str, num_laps: int = LONGEST_EVENT_LAPS) -> list:
+    """
+    Names of the wide lap columns for one lap field (e.g. lap_1_position, lap_2_position, ...).
+    """
+    return [f'lap_{x}_{field}' for x in range(1, num_laps + 1)]
+
+
+def merge_rounds_splits(all_rounds: pd.DataFrame, all_splits: pd.DataFrame,
+                        race_columns: list = UNIQUE_RACE_COLUMNS) -> pd.DataFrame:
+    """
+    Join the split data onto the round data by race, reshaping the START_POS_n columns of each split row into the
+    lap_{i}_position/laptime/elapsedtime columns of the athlete who started in position n.
+
+    Splits are numbered into laps in the order they appear in all_splits. Athletes only receive lap data when their race
+    has more than one lap of splits.
+
+    Races are matched on race_columns, which can be the integer RACE_ID_COLUMN of the ID registry when both frames
+    have it, rather than the seven text columns of the race key.
+    """
+    rounds_splits_df = all_rounds.copy()
+
+    # rows with a missing key can never be matched to a race
+    splits = all_splits.dropna(subset=race_columns)
+    splits = splits.assign(lap=splits.groupby(race_columns, sort=False).cumcount() + 1)
+
+    # indicate how many laps' worth of split data were found for each race
+    laps_per_race = splits.groupby(race_columns, sort=False).size().rename('laps_of_split_data').reset_index()
+    athletes = rounds_splits_df[race_columns].dropna().reset_index()
+    athletes = athletes.merge(laps_per_race, on=race_columns, how='left').set_index('index')
+    athletes['laps_of_split_data'] = athletes['laps_of_split_data'].fillna(0)
+    rounds_splits_df['laps_of_split_data'] = athletes['laps_of_split_data'].astype(float)
+
+    # pair each athlete with the split columns of their start position, one start position at a time
+    athletes['start_pos_col'] = 'START_POS_' + rounds_splits_df.loc[athletes.index, 'Start Pos.'].astype(str)
+    athletes = athletes[athletes['laps_of_split_data'] > 1].reset_index()
+    athlete_laps = list()
+    for start_position in range(1, MAX_ATHLETES_IN_RACE + 1):
+        col_id = f'START_POS_{start_position}'
+        split_cols = {f'{col_id} {split_field}': field for field, split_field in SPLIT_FIELDS.items()}
+        starters = athletes.loc[athletes['start_pos_col'] == col_id, ['index'] + race_columns]
+        if len(starters) and set(split_cols).issubset(splits.columns):
+            laps = starters.merge(splits[race_columns + ['lap'] + list(split_cols)], on=race_columns)
+            athlete_laps.append(laps[['index', 'lap'] + list(split_cols)].rename(columns=split_cols))
+
+    # pivot to one row per athlete with lap_{i}_{field} columns, in lap order
+    if athlete_laps:
+        athlete_laps = pd.concat(athlete_laps, ignore_index=True).set_index(['index', 'lap'])[LAP_FIELDS]
+        num_laps = max(LONGEST_EVENT_LAPS, athlete_laps.index.get_level_values('lap').max())
+        wide_laps = athlete_laps.unstack('lap')
+    else:
+        num_laps = LONGEST_EVENT_LAPS
+        wide_laps = pd.DataFrame(index=pd.Index([], name='index'),
+                                 columns=pd.MultiIndex.from_product([LAP_FIELDS, []]))
+    wide_laps = wide_laps.reindex(columns=pd.MultiIndex.from_product([LAP_FIELDS, range(1, num_laps + 1)]))
+    wide_laps.columns = [f'lap_{lap}_{field}' for field, lap in wide_laps.columns]
+    wide_laps = wide_laps.reindex(index=rounds_splits_df.index,
+                                  columns=[f'lap_{lap}_{field}' for lap in range(1, num_laps + 1)
+                                           for field in LAP_FIELDS])
+    rounds_splits_df = pd.concat([rounds_splits_df, wide_laps.infer_objects()], axis=1)
+
+    # replace zeros with NaNs
+    pos_cols = lap_columns('position', num_laps)
+    laptime_cols = lap_columns('laptime', num_laps)
+    rounds_splits_df[pos_cols] = rounds_splits_df[pos_cols].replace(0.0, np.nan)
+    rounds_splits_df[laptime_cols] = rounds_splits_df[laptime_cols].replace(0.0, np.nan)
+
+    return rounds_splits_df
+
+
+def to_float(value) -> float:
+    """
+    float(value), or NaN if value can't be read as a number.
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def float_column(column: pd.Series) -> pd.Series:
+    """
+    Read a column as floats, with NaN wherever a value can't be read as a number.
+    """
+    if column.dtype == object:
+        return column.map(to_float).astype(float)
+    return column.astype(float)
+
+
+def lap_matrix(rounds_splits_df: pd.DataFrame, field: str, num_laps: int = LONGEST_EVENT_LAPS) -> np.ndarray:
+    """
+    One float row per athlete-race and one column per lap for the requested lap field. Missing laps and values which
+    can't be read as a number are NaN.
+    """
+    laps = rounds_splits_df.reindex(columns=lap_columns(field, num_laps))
+    return laps.apply(float_column).to_numpy(dtype=float)
+
+
+def race_details_columns(rounds_splits_df: pd.DataFrame) -> list:
+    """
+    The columns of a rounds_with_splits dataset which are carried onto each of its laps: the race and athlete details,
+    and their integer IDs if the dataset has them.
+    """
+    return list(rounds_splits_df.columns[:17]) + [col for col in ID_COLUMNS if col in rounds_splits_df.columns]
+
+
+def extract_laptimes(rounds_splits_df: pd.DataFrame, race_details_cols: list) -> pd.DataFrame:
+    """
+    Break the wide lap columns into one row per athlete per lap, with the positions gained/lost during that lap.
+
+    Rows keep the order of rounds_splits_df, then lap order. Half-lap events skip the opening half-lap, and laps
+    no slower than MIN_VALID_LAPTIME are dropped as erroneous. Each lap also carries the laptime of the athlete's
+    previous lap (if that lap was kept) and the change from it, for lap-over-lap metrics.
+    """
+    laptimes = lap_matrix(rounds_splits_df, 'laptime')
+    end_positions = lap_matrix(rounds_splits_df, 'position')
+    start_positions = np.column_stack([float_column(rounds_splits_df['Start Pos.']),
+                                       end_positions[:, :-1]])
+
+    # detect which events start with a half-lap
+    start_lap = np.where(rounds_splits_df['event'].isin(HALF_LAP_EVENTS), 2, 1)
+    lap_numbers = np.arange(1, LONGEST_EVENT_LAPS + 1)
+    with np.errstate(invalid='ignore'):
+        valid_laps = (lap_numbers >= start_lap[:, None]) & (laptimes > MIN_VALID_LAPTIME)
+    athlete_rows, lap_indices = np.nonzero(valid_laps)
+    previous_laptimes = np.where(valid_laps[:, :-1], laptimes[:, :-1], np.nan)
+    previous_laptimes = np.column_stack([np.full(len(laptimes), np.nan), previous_laptimes])
+
+    laptimes_df = rounds_splits_df[race_details_cols].iloc[athlete_rows].reset_index(drop=True)
+    laptimes_df['lap'] = lap_numbers[lap_indices]
+    laptimes_df['laptime'] = laptimes[athlete_rows, lap_indices]
+    laptimes_df['lap_start_position'] = start_positions[athlete_rows, lap_indices]
+    laptimes_df['lap_end_position'] = end_positions[athlete_rows, lap_indices]
+    laptimes_df['position_change'] = (-1) * (laptimes_df['lap_end_position'] - laptimes_df['lap_start_position'])
+    laptimes_df['previous_laptime'] = previous_laptimes[athlete_rows, lap_indices]
+    laptimes_df['lap_delta'] = laptimes_df['laptime'] - laptimes_df['previous_laptime']
+    return laptimes_df
+
+
+def text_column(column: pd.Series) -> pd.Series:
+    """
+    Write every value of a column as a string, keeping missing values missing.
+    """
+    # a categorical column (e.g. read back from Parquet for an upsert) can't take values outside its categories
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        column = column.astype(object)
+    return column.where(column.isna(), column.astype(str))
+
+
+def typed_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Give every column of a rounds_with_splits or laptimes dataset a single type for columnar storage: lap positions
+    become floats, lap times become float seconds, race/athlete labels become categoricals and any other text column
+    becomes strings. ID columns become nullable integers.
+    """
+    typed = df.copy()
+    for col in typed.columns:
+        if col.startswith('lap_') and col.endswith('_position'):
+            typed[col] = float_column(typed[col])
+        elif col.startswith('lap_') and col.endswith('time'):
+            typed[col] = seconds_column(typed[col])
+        elif col in ID_COLUMNS:
+            typed[col] = typed[col].astype('Int32')
+        elif col in CATEGORY_COLUMNS:
+            typed[col] = text_column(typed[col]).astype('category')
+        elif typed[col].dtype == object:
+            typed[col] = text_column(typed[col])
+    return typed
@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+
+from shorttrack_scrapy.packed_races import PackedRaces
+
+# athlete row of a race-lap without a single athlete in first (no lap data, or several athletes shown in first)
+NO_ATHLETE = -1
+# athlete columns with which the leaders of each race are identified in the race analytics
+ATHLETE_LABEL_COLUMNS = {'Name': 'name', 'ISU ID': 'isu_id'}
+
+
+def race_lap_starts(packed: PackedRaces) -> np.ndarray:
+    """
+    The index of each race's first race-lap. The laps of every race are numbered one after the other (race-laps),
+    race by race, so that a value per lap of every race is one flat array.
+    """
+    laps = packed.races['laps'].to_numpy(dtype=np.int64)
+    return np.cumsum(laps) - laps
+
+
+def lap_races(packed: PackedRaces) -> np.ndarray:
+    """
+    The race of each race-lap.
+    """
+    return np.repeat(np.arange(len(packed.races)), packed.races['laps'].to_numpy(dtype=np.int64))
+
+
+def lap_leaders(packed: PackedRaces) -> np.ndarray:
+    """
+    The athlete row (of packed.athletes) in first position at the end of each race-lap, or NO_ATHLETE where there is no
+    single athlete in first.
+    """
+    rows, lap_indices = packed.lap_indices()
+    destinations = packed.athlete_offsets()[rows] + lap_indices
+    leading = np.flatnonzero(packed.laps['position'][destinations] == 1)
+
+    race_laps = race_lap_starts(packed)[packed.athletes['race_index'].to_numpy()[rows[leading]]] + lap_indices[leading]
+    num_race_laps = int(packed.races['laps'].sum())
+    leaders = np.full(num_race_laps, NO_ATHLETE, dtype=np.int64)
+    leaders[race_laps] = rows[leading]
+    leaders[np.bincount(race_laps, minlength=num_race_laps) > 1] = NO_ATHLETE
+    return leaders
+
+
+def lead_changes(packed: PackedRaces, leaders: np.ndarray) -> np.ndarray:
+    """
+    The number of times the lead changes hands in each race: laps led by someone other than the leader of the previous
+    lap with a leader.
+    """
+    lap_race = lap_races(packed)
+    known = leaders != NO_ATHLETE
+    race_lap = np.arange(len(leaders))
+
+    # the latest earlier race-lap with a leader, if it is in the same race
+    latest_known = np.maximum.accumulate(np.where(known, race_lap, -1))
+    previous = np.concatenate([[-1], latest_known]).astype(np.int64)[:len(leaders)]
+    has_previous = previous >= race_lap_starts(packed)[lap_race]
+
+    changes = known & has_previous & (leaders != leaders[previous])
+    return np.bincount(lap_race[changes], minlength=len(packed.races))
+
+
+def final_leaders(packed: PackedRaces, leaders: np.ndarray) -> np.ndarray:
+    """
+    The athlete row in first at the end of the last lap of each race, or NO_ATHLETE.
+    """
+    laps = packed.races['laps'].to_numpy(dtype=np.int64)
+    final = np.full(len(laps), NO_ATHLETE, dtype=np.int64)
+    final[laps > 0] = leaders[(race_lap_starts(packed) + laps - 1)[laps > 0]]
+    return final
+
+
+def decisive_laps(packed: PackedRaces, leaders: np.ndarray, final: np.ndarray) -> np.ndarray:
+    """
+    The lap (from 1) on which the final leader of each race passed to the front for the last time, i.e. the first lap
+    of the run of laps they led to the finish, or NaN if the race has no final leader. A race led from the first lap
+    has decisive lap 1.
+    """
+    lap_race = lap_races(packed)
+    race_lap = np.arange(len(leaders))
+    known = leaders != NO_ATHLETE
+    final_lap_leader = leaders == final[lap_race]
+
+    # the last lap led by anyone else, then the first lap after it led by the final leader
+    last_other = np.full(len(packed.races), -1, dtype=np.int64)
+    others = known & ~final_lap_leader
+    np.maximum.at(last_other, lap_race[others], race_lap[others])
+    takes_lead = known & final_lap_leader & (race_lap > last_other[lap_race])
+    races, first_lead = np.unique(lap_race[takes_lead], return_index=True)
+
+    decisive = np.full(len(packed.races), np.nan)
+    decisive[races] = race_lap[takes_lead][first_lead] - race_lap_starts(packed)[races] + 1
+    return decisive
+
+
+def laps_led(packed: PackedRaces, leaders: np.ndarray) -> np.ndarray:
+    """
+    The number of laps each athlete row led.
+    """
+    return np.bincount(leaders[leaders != NO_ATHLETE], minlength=len(packed.athletes))
+
+
+def pace_setters(packed: PackedRaces, leaders: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    The athlete row who led the most laps of each race (the earliest of them to lead, if tied) and the number of laps
+    they led, or NO_ATHLETE and 0 for a race without a leader.
+    """
+    led = laps_led(packed, leaders)
+    known = leaders != NO_ATHLETE
+    first_led = np.full(len(packed.athletes), len(leaders), dtype=np.int64)
+    athlete_rows, first_lap = np.unique(leaders[known], return_index=True)
+    first_led[athlete_rows] = np.flatnonzero(known)[first_lap]
+
+    race_index = packed.athletes['race_index'].to_numpy()
+    candidates = np.flatnonzero(led > 0)
+    candidates = candidates[np.lexsort((first_led[candidates], -led[candidates], race_index[candidates]))]
+    races, best = np.unique(race_index[candidates], return_index=True)
+
+    setters = np.full(len(packed.races), NO_ATHLETE, dtype=np.int64)
+    setters[races] = candidates[best]
+    return setters, np.where(setters != NO_ATHLETE, led[setters], 0)
+
+
+def athlete_labels(packed: PackedRaces, rows: np.ndarray, column: str) -> pd.Series:
+    """
+    A column of packed.athletes at some athlete rows, missing at NO_ATHLETE.
+    """
+    return packed.athletes[column].reset_index(drop=True).reindex(rows).reset_index(drop=True)
+
+
+def race_analytics(packed: PackedRaces) -> pd.DataFrame:
+    """
+    One row per race with its race columns and how the lead was fought for, computed over every race in one pass:
+     - leader_laps: the number of laps with a single athlete in first
+     - lead_changes: the number of times the lead changed hands
+     - decisive_lap: the lap on which the final leader (the athlete in first at the end of the last lap) passed to the
+       front for the last time
+     - pace_setter_laps: the number of laps led by the pace setter, the athlete who led the most laps
+    The final leader and pace setter are identified by their name and ISU ID (final_leader_name, pace_setter_isu_id,
+    ...). Races without lap data for every athlete can be missing leaders on some laps, and their analytics only count
+    the laps with one.
+    """
+    leaders = lap_leaders(packed)
+    final = final_leaders(packed, leaders)
+    setters, setter_laps = pace_setters(packed, leaders)
+
+    analytics = packed.races.drop(columns=['offset']).reset_index(drop=True)
+    analytics['leader_laps'] = np.bincount(lap_races(packed)[leaders != NO_ATHLETE], minlength=len(packed.races))
+    analytics['lead_changes'] = lead_changes(packed, leaders)
+    analytics['decisive_lap'] = decisive_laps(packed, leaders, final)
+    analytics['pace_setter_laps'] = setter_laps
+    for role, rows in [('final_leader', final), ('pace_setter', setters)]:
+        for column, label in ATHLETE_LABEL_COLUMNS.items():
+            if column in packed.athletes.columns:
+                analytics[f'{role}_{label}'] = athlete_labels(packed, rows, column)
+    return analytics
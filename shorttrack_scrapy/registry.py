@@ -0,0 +1,120 @@
+import json
+import logging
+from os.path import exists
+
+import numpy as np
+import pandas as pd
+
+from shorttrack_scrapy.constants import ID_REGISTRY_FILE, UNIQUE_COMPETITION_COLUMNS, UNIQUE_ROUND_COLUMNS, \
+    UNIQUE_RACE_COLUMNS, UNIQUE_ATHLETE_COLUMNS, COMPETITION_ID_COLUMN, ROUND_ID_COLUMN, RACE_ID_COLUMN, \
+    ATHLETE_ID_COLUMN
+from shorttrack_scrapy.utils import normalize_key
+
+# the key columns of each kind of ID, and the column its IDs are saved to in the derived datasets
+REGISTRY_KEYS = {'competition': UNIQUE_COMPETITION_COLUMNS,
+                 'round': UNIQUE_ROUND_COLUMNS,
+                 'race': UNIQUE_RACE_COLUMNS,
+                 'athlete': UNIQUE_ATHLETE_COLUMNS}
+REGISTRY_ID_COLUMNS = {'competition': COMPETITION_ID_COLUMN,
+                       'round': ROUND_ID_COLUMN,
+                       'race': RACE_ID_COLUMN,
+                       'athlete': ATHLETE_ID_COLUMN}
+# nullable, so that rows without a key (e.g. the athlete of a relay team) have no ID
+ID_DTYPE = 'Int32'
+
+
+class IdRegistry(object):
+    """
+    Compact integer IDs for the competitions, rounds, races and athletes of the scraped data, so that the derived
+    datasets can be joined and grouped on a single integer column instead of several text columns.
+
+    IDs of each kind are assigned in the order their keys are first registered and never change once assigned. The
+    registry is saved alongside the scraped data as one list of normalized keys per kind, each key's ID being its
+    position in the list. Rows missing any value of a key have no ID of that kind.
+    """
+
+    def __init__(self, keys: dict = None):
+        keys = dict() if keys is None else keys
+        self.keys = {kind: [tuple(key) for key in keys.get(kind, [])] for kind in REGISTRY_KEYS}
+        self.key_ids = {kind: {key: key_id for key_id, key in enumerate(kind_keys)}
+                        for kind, kind_keys in self.keys.items()}
+
+    @classmethod
+    def load(cls, file_path: str = ID_REGISTRY_FILE) -> 'IdRegistry':
+        """
+        Load the saved registry, or start an empty one.
+        """
+        if exists(file_path):
+            with open(file_path) as f:
+                return cls(json.load(f))
+        return cls()
+
+    def save(self, file_path: str = ID_REGISTRY_FILE):
+        with open(file_path, 'w') as f:
+            json.dump(self.keys, f)
+            logging.debug(f'Saved {", ".join(f"{len(keys)} {kind}s" for kind, keys in self.keys.items())} to {f.name}')
+
+    def assign(self, kind: str, key: tuple) -> int:
+        """
+        The ID of a normalized key, assigning the next ID of its kind if the key is new.
+        """
+        key_id = self.key_ids[kind].get(key)
+        if key_id is None:
+            key_id = self.key_ids[kind][key] = len(self.keys[kind])
+            self.keys[kind].append(key)
+        return key_id
+
+    def register(self, kind: str, values) -> int:
+        """
+        The ID of one key (e.g. the UNIQUE_RACE_COLUMNS values of a race), assigning one if it is new.
+        """
+        return self.assign(kind, normalize_key(values))
+
+    def register_rows(self, rows: list):
+        """
+        Register every key of the scraped round rows (one dict per athlete-race, keyed by column name).
+        """
+        for row in rows:
+            for kind, key_columns in REGISTRY_KEYS.items():
+                values = [row.get(col) for col in key_columns]
+                if not any(pd.isna(value) for value in values):
+                    self.register(kind, values)
+
+    def column_ids(self, df: pd.DataFrame, kind: str, register: bool = True) -> pd.Series:
+        """
+        The ID of the key of each row of df. Only the distinct keys are normalized and looked up, so the cost hardly
+        grows with the number of rows sharing them. New keys are registered, or left without an ID if register is
+        False.
+        """
+        key_columns = REGISTRY_KEYS[kind]
+        # rows missing a key value are in no group, and keep code -1
+        codes = df.groupby(key_columns, sort=False).ngroup().fillna(-1).to_numpy(dtype=np.int64)
+        group_codes, first_rows = np.unique(codes, return_index=True)
+        keys = df[key_columns].iloc[first_rows[group_codes >= 0]].itertuples(index=False, name=None)
+        if register:
+            key_ids = [self.assign(kind, normalize_key(key)) for key in keys]
+        else:
+            key_ids = [self.key_ids[kind].get(normalize_key(key)) for key in keys]
+        # code -1 picks the missing ID appended at the end
+        return pd.Series(pd.array(key_ids + [None], dtype=ID_DTYPE)[codes], index=df.index,
+                         name=REGISTRY_ID_COLUMNS[kind])
+
+    def add_ids(self, df: pd.DataFrame, kinds: list = None, register: bool = True) -> pd.DataFrame:
+        """
+        df with an ID column for each kind of key (or only the given kinds) whose key columns it has.
+        """
+        kinds = [kind for kind in kinds or REGISTRY_KEYS if set(REGISTRY_KEYS[kind]).issubset(df.columns)]
+        return df.assign(**{REGISTRY_ID_COLUMNS[kind]: self.column_ids(df, kind, register) for kind in kinds})
+
+    def scraped_with_ids(self, all_rounds: pd.DataFrame, all_splits: pd.DataFrame) -> (pd.DataFrame, pd.DataFrame):
+        """
+        The scraped rounds with an ID column of each kind (registering any new keys), and the scraped splits with the
+        ID of their race, ready to be merged on RACE_ID_COLUMN.
+        """
+        return self.add_ids(all_rounds), self.add_ids(all_splits, kinds=['race'], register=False)
+
+    def keys_frame(self, kind: str) -> pd.DataFrame:
+        """
+        The normalized key of every ID of one kind, indexed by ID.
+        """
+        return pd.DataFrame(self.keys[kind], columns=REGISTRY_KEYS[kind]).rename_axis(REGISTRY_ID_COLUMNS[kind])
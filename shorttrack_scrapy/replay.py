@@ -0,0 +1,107 @@
+"""
+Parse the archived round and split pages again without crawling, and rebuild the scraped and derived datasets from
+them:
+
+    python -m shorttrack_scrapy.replay --workers 8
+
+Each season shard of the archive is parsed by one worker process with the spider's own parse_round and parse_split
+callbacks, and the results are combined in shard order so the output doesn't depend on the number of workers. The
+replayed rounds and races replace their rows in the scraped data, and rounds missing from the archive are kept.
+"""
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from logging import info
+
+import pandas as pd
+import scrapy
+from scrapy.http import HtmlResponse, Request
+
+from shorttrack_scrapy.archive import archived_pages, read_shard
+from shorttrack_scrapy.constants import ROUNDS_FILE, SPLITS_FILE, UNIQUE_ROUND_COLUMNS, UNIQUE_RACE_COLUMNS
+from shorttrack_scrapy.items import RoundItem, SplitItem
+from shorttrack_scrapy.preprocess import rebuild
+from shorttrack_scrapy.spiders.shorttrack_spider import ShortTrackEventSpider
+from shorttrack_scrapy.utils import normalize_key_columns, upsert_parsed_data
+
+
+class ReplaySpider(ShortTrackEventSpider):
+    """
+    The spider's parse callbacks without its crawl state: the rounds already scraped and the crawl manifest aren't
+    loaded, and the pages aren't archived again.
+    """
+
+    def __init__(self):
+        scrapy.Spider.__init__(self, name=self.name)
+        self.archive = None
+        self.already_scraped = set()
+
+
+@lru_cache(maxsize=1)
+def replay_spider() -> ReplaySpider:
+    """
+    The spider whose callbacks parse the archived pages, created once per worker process.
+    """
+    return ReplaySpider()
+
+
+def replay_shard(shard_name: str, entries: list) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Parse the archived pages of one shard, returning the round and split rows they contain.
+    """
+    spider = replay_spider()
+    callbacks = dict(round=spider.parse_round, split=spider.parse_split)
+    rows = {RoundItem: list(), SplitItem: list()}
+    for entry, body in read_shard(shard_name, entries):
+        response = HtmlResponse(url=entry['url'], body=body, encoding=entry['encoding'],
+                                request=Request(entry['url'], meta=entry['meta']))
+        for output in callbacks[entry['page']](response):
+            if not isinstance(output, Request):
+                rows[type(output)].extend(output['rows'])
+    return pd.DataFrame(rows[RoundItem]), pd.DataFrame(rows[SplitItem])
+
+
+def replay(workers: int = None) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Parse every page in the archive, across a pool of worker processes. An empty archive gives empty frames.
+    """
+    shards = archived_pages()
+    if not shards:
+        return pd.DataFrame(), pd.DataFrame()
+    info(f'Replaying {sum(len(entries) for entries in shards.values())} pages from {len(shards)} shards.')
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(replay_shard, shards.keys(), shards.values()))
+    return pd.concat([rounds for rounds, _ in results], ignore_index=True), \
+        pd.concat([splits for _, splits in results], ignore_index=True)
+
+
+def frame_keys(df: pd.DataFrame, key_columns: list) -> set:
+    """
+    The normalized keys of the rows of df.
+    """
+    return set(pd.MultiIndex.from_frame(normalize_key_columns(df, key_columns)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: one per CPU)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+    all_rounds, all_splits = replay(args.workers)
+    if all_rounds.empty:
+        info('The archive is empty. Crawl with ARCHIVE_RAW_HTML enabled first.')
+        return
+
+    # replace the replayed rounds and races in the scraped data (keeping those the archive doesn't have), then rebuild
+    # the derived datasets from it across the same pool size
+    upsert_parsed_data(all_rounds, ROUNDS_FILE, UNIQUE_ROUND_COLUMNS, frame_keys(all_rounds, UNIQUE_ROUND_COLUMNS))
+    if not all_splits.empty:
+        upsert_parsed_data(all_splits, SPLITS_FILE, UNIQUE_RACE_COLUMNS, frame_keys(all_splits, UNIQUE_RACE_COLUMNS))
+    info(f'Replaced {len(all_rounds)} round rows and {len(all_splits)} split rows.')
+    rebuild(args.workers)
+
+
+if __name__ == '__main__':
+    main()
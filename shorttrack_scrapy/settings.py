@@ -29,9 +29,11 @@ CONCURRENT_REQUESTS = 256
 # Configure a delay for requests for the same website (default: 0)
 # See https://doc.scrapy.org/en/latest/topics/settings.html#download-delay
 # See also autothrottle settings and docs
+# The adaptive concurrency middleware replaces this starting delay, and adapts the concurrency of each host from the
+# starting value below
 DOWNLOAD_DELAY = 0.1
 # The download delay setting will honor only one of:
-#CONCURRENT_REQUESTS_PER_DOMAIN = 16
+CONCURRENT_REQUESTS_PER_DOMAIN = 8
 #CONCURRENT_REQUESTS_PER_IP = 16
 
 # Disable cookies (enabled by default)
@@ -48,21 +50,43 @@ DOWNLOAD_DELAY = 0.1
 
 # Enable or disable spider middlewares
 # See https://doc.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
-#    'shorttrack_scrapy.middlewares.ShorttrackScrapySpiderMiddleware': 543,
-#}
+# The project middleware records the latency, pages, bytes and items of each callback for the crawl report; it's
+# placed after Scrapy's middlewares (nearest the spider) so that it only times the callbacks
+SPIDER_MIDDLEWARES = {
+    'shorttrack_scrapy.middlewares.ShorttrackScrapySpiderMiddleware': 950,
+}
 
 # Enable or disable downloader middlewares
 # See https://doc.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    'shorttrack_scrapy.middlewares.ShorttrackScrapyDownloaderMiddleware': 543,
-#}
+# The project middleware adapts each host's concurrency and delay, and replaces Scrapy's retry middleware with retries
+# that back off
+DOWNLOADER_MIDDLEWARES = {
+    'scrapy.downloadermiddlewares.retry.RetryMiddleware': None,
+    'shorttrack_scrapy.middlewares.ShorttrackScrapyDownloaderMiddleware': 550,
+}
+
+# Adaptive concurrency: each host's concurrency is adjusted every ADAPTIVE_WINDOW responses, between 1 and
+# ADAPTIVE_MAX_CONCURRENCY, and its requests are paced between ADAPTIVE_MIN_DELAY and ADAPTIVE_MAX_DELAY seconds apart.
+# Hosts whose latency rises above ADAPTIVE_LATENCY_TOLERANCE times their fastest are slowed down, and failures or rate
+# limiting back off the delay to at least ADAPTIVE_BACKOFF_DELAY seconds. The live request rate and queue depth are
+# logged every ADAPTIVE_STATS_INTERVAL seconds.
+ADAPTIVE_MAX_CONCURRENCY = 32
+ADAPTIVE_MIN_DELAY = 0
+ADAPTIVE_WINDOW = 20
+ADAPTIVE_LATENCY_TOLERANCE = 2
+ADAPTIVE_BACKOFF_DELAY = 1
+ADAPTIVE_MAX_DELAY = 60
+ADAPTIVE_STATS_INTERVAL = 30
 
 # Enable or disable extensions
 # See https://doc.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    'scrapy.extensions.telnet.TelnetConsole': None,
-#}
+EXTENSIONS = {
+    'shorttrack_scrapy.metrics.CrawlMetrics': 500,
+}
+
+# A JSON report of each crawl's metrics is saved in data/scraped/crawl_reports/. Set a port to also serve them in the
+# Prometheus text format during the crawl, at http://localhost:<port>/metrics
+METRICS_PROMETHEUS_PORT = 0
 
 # Configure item pipelines
 # See https://doc.scrapy.org/en/latest/topics/item-pipeline.html
@@ -70,6 +94,21 @@ ITEM_PIPELINES = {
    'shorttrack_scrapy.pipelines.ShorttrackScrapyPipeline': 300,
 }
 
+# Parsed rows are buffered and written to the scraped data files in batches of at least this many rows, or at least
+# this often (in seconds)
+OUTPUT_BATCH_SIZE = 5000
+OUTPUT_FLUSH_INTERVAL = 30
+
+# Only rebuild the derived datasets for the races found during the crawl (set to False for a full rebuild)
+INCREMENTAL_PROCESSING = True
+
+# Skip seasons and competitions recorded as completely scraped in data/scraped/crawl_manifest.json
+PRUNE_COMPLETED_COMPETITIONS = True
+
+# Archive the scraped round and split pages in data/scraped/raw/, so they can be parsed again without a crawl
+# (python -m shorttrack_scrapy.replay)
+ARCHIVE_RAW_HTML = True
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://doc.scrapy.org/en/latest/topics/autothrottle.html
 #AUTOTHROTTLE_ENABLED = True
@@ -85,8 +124,14 @@ ITEM_PIPELINES = {
 
 # Enable and configure HTTP caching (disabled by default)
 # See https://doc.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-#HTTPCACHE_ENABLED = True
-#HTTPCACHE_EXPIRATION_SECS = 0
-#HTTPCACHE_DIR = 'httpcache'
-#HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
+# Pages of past seasons are kept permanently, and current season pages are revalidated with ETag/Last-Modified. The
+# cache is limited to HTTPCACHE_MAX_SIZE bytes, evicting the least recently used pages.
+HTTPCACHE_ENABLED = True
+HTTPCACHE_EXPIRATION_SECS = 0
+HTTPCACHE_DIR = 'httpcache'
+HTTPCACHE_ALWAYS_STORE = True
+HTTPCACHE_GZIP = True
+HTTPCACHE_POLICY = 'shorttrack_scrapy.httpcache.SeasonCachePolicy'
+HTTPCACHE_STORAGE = 'shorttrack_scrapy.httpcache.BoundedFilesystemCacheStorage'
+HTTPCACHE_MAX_SIZE = 2 * 1024 ** 3
+HTTPCACHE_EVICTION_TARGET = 0.9
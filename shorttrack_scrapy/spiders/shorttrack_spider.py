@@ -1,3 +1,4 @@
+from datetime import datetime, timedelta
 from logging import INFO
 
 import numpy as np
@@ -5,9 +6,14 @@ import pandas as pd
 import scrapy
 from urllib.parse import urlsplit, parse_qs, urlparse
 
-from shorttrack_scrapy.constants import UNIQUE_ROUND_COLUMNS, ROUNDS_FILE, SPLITS_FILE, MAX_ATHLETES_IN_RACE
-from shorttrack_scrapy.utils import load_already_scraped, regex_replace, detect_event_multiple, clean_event_title, \
-    save_raw_html, parse_time_string, save_parsed_data, treatable_event
+from shorttrack_scrapy.archive import RawHtmlArchive
+from shorttrack_scrapy.constants import UNIQUE_ROUND_COLUMNS, MAX_ATHLETES_IN_RACE, COMPETITION_CLOSE_DAYS
+from shorttrack_scrapy.extractors import round_tables, split_table
+from shorttrack_scrapy.items import RoundItem, SplitItem
+from shorttrack_scrapy.metrics import ROUNDS_NEW_STAT, ROUNDS_ALREADY_SCRAPED_STAT
+from shorttrack_scrapy.normalize import regex_replace, parse_time_string
+from shorttrack_scrapy.utils import load_already_scraped, detect_event_multiple, clean_event_title, treatable_event, \
+    normalize_key, load_crawl_manifest, save_crawl_manifest
 
 
 class ShortTrackEventSpider(scrapy.Spider):
@@ -16,52 +22,120 @@ class ShortTrackEventSpider(scrapy.Spider):
     def __init__(self):
         super().__init__(name=self.name)
         self.start_url = "https://shorttrack.sportresult.com"
-        self.save_html = False
+        self.archive = None
         self.already_scraped = load_already_scraped(UNIQUE_ROUND_COLUMNS)
 
+        # record of completely scraped seasons/competitions, and the progress of each competition in this crawl
+        self.prune_completed = True
+        self.manifest = load_crawl_manifest()
+        self.current_season = None
+        self.season_competitions = dict()
+        self.competition_progress = dict()
+
     def check_already_scraped(self, season_title, competition_title, event_title, event_gender, round_title,
                               instance_of_event_in_competition) -> bool:
         """
         Return True if the queried round has already been scraped; False otherwise.
         """
-        if len(self.already_scraped[(self.already_scraped['season'] == season_title) &
-                                    (self.already_scraped['competition'] == competition_title) &
-                                    (self.already_scraped['event'] == event_title) &
-                                    (self.already_scraped['instance_of_event_in_competition'] ==
-                                     instance_of_event_in_competition) &
-                                    (self.already_scraped['gender'] == event_gender) &
-                                    (self.already_scraped['round'] == round_title)]):
+        if normalize_key([season_title, competition_title, event_title, instance_of_event_in_competition, event_gender,
+                          round_title]) in self.already_scraped:
+            self.crawler.stats.inc_value(ROUNDS_ALREADY_SCRAPED_STAT)
             self.log(message=f"Round already discovered: {season_title}-{competition_title}-"
                              f"{event_title}-{instance_of_event_in_competition}-"
                              f"{event_gender}-{round_title}",
                      level=INFO)
             return True
+        self.crawler.stats.inc_value(ROUNDS_NEW_STAT)
         self.log(message=f"New round discovered: {season_title}-{competition_title}-"
                          f"{event_title}-{instance_of_event_in_competition}-"
                          f"{event_gender}-{round_title}",
                  level=INFO)
         return False
 
+    def season_completed(self, season_title) -> bool:
+        """
+        Return True if every competition in the season has been completely scraped; False otherwise.
+        """
+        return self.prune_completed and season_title in self.manifest['seasons']
+
+    def competition_completed(self, season_title, competition_title) -> bool:
+        """
+        Return True if the competition has finished and all of its rounds have been scraped; False otherwise.
+        """
+        competition = self.manifest['competitions'].get(season_title, dict()).get(competition_title, dict())
+        return self.prune_completed and competition.get('completed') is not None
+
+    def update_crawl_manifest(self):
+        """
+        Mark competitions as completed once a crawl has visited every one of their events without finding any new
+        rounds, provided their season is over or they have not had new rounds for COMPETITION_CLOSE_DAYS. Past seasons
+        are completed once all of their competitions are.
+        """
+        now = datetime.now()
+        for (season_title, competition_title), progress in self.competition_progress.items():
+            competition = self.manifest['competitions'].setdefault(season_title, dict()).setdefault(
+                competition_title, dict(competition_id=progress['competition_id'], last_new_round=None,
+                                        completed=None))
+
+            if progress['new_rounds']:
+                competition['last_new_round'] = now.isoformat()
+            elif progress['parsed'] and progress['events_parsed'] == progress['events_requested']:
+                closed = competition['last_new_round'] is not None and \
+                    now - datetime.fromisoformat(competition['last_new_round']) > timedelta(days=COMPETITION_CLOSE_DAYS)
+                if season_title != self.current_season or closed:
+                    competition['completed'] = now.isoformat()
+                    self.log(message=f"Competition completed: {season_title}-{competition_title}", level=INFO)
+
+        for season_title, competition_titles in self.season_competitions.items():
+            completed = self.manifest['competitions'].get(season_title, dict())
+            if season_title != self.current_season and all(completed.get(competition_title, dict()).get('completed')
+                                                           for competition_title in competition_titles):
+                self.manifest['seasons'][season_title] = now.isoformat()
+                self.log(message=f"Season completed: {season_title}", level=INFO)
+
+        save_crawl_manifest(self.manifest)
+
+    async def start(self):
+        # Scrapy 2.13+ only calls start_requests through start
+        for request in self.start_requests():
+            yield request
+
     def start_requests(self):
+        self.prune_completed = self.settings.getbool('PRUNE_COMPLETED_COMPETITIONS', True)
+        if self.settings.getbool('ARCHIVE_RAW_HTML', False):
+            self.archive = RawHtmlArchive()
         yield scrapy.Request(url=self.start_url, callback=self.parse)
 
+    def closed(self, reason):
+        self.update_crawl_manifest()
+        if self.archive is not None:
+            self.archive.close()
+
     def parse(self, response):
         """
         Gather list of season IDs and call them individually.
         """
         # gather season numbers and titles from the page
         season_numbers = response.css('select[name="sea"] option::attr(value)').getall()
-        season_titles = response.css('select[name="sea"] option::text').getall()
+        season_titles = [season_title.split(" ")[0] for season_title in
+                         response.css('select[name="sea"] option::text').getall()]
+        self.current_season = max(season_titles, default=None)
 
         for season_number, season_title in zip(season_numbers, season_titles):
+            # skip seasons which have been completely scraped in an earlier scraping run
+            if self.season_completed(season_title):
+                self.log(message=f"Season already completed: {season_title}", level=INFO)
+                continue
+
             # assemble URL for this season
             season_url = response.url + "/?sea=" + season_number
 
-            # scrape the season page
+            # scrape the season page, keeping the pages of past seasons in the HTTP cache permanently
             yield scrapy.Request(url=season_url,
                                  callback=self.parse_season,
                                  meta=dict(season_id=season_number,
-                                           season_title=season_title.split(" ")[0]))
+                                           season_title=season_title,
+                                           cache_permanently=season_title != self.current_season))
 
     def parse_season(self, response):
         """
@@ -73,8 +147,17 @@ class ShortTrackEventSpider(scrapy.Spider):
         competition_numbers = response.css('select[name="evt"] optgroup option::attr(value)').getall()
         competition_titles = response.css('select[name="evt"] optgroup option::text').getall()
         url_components = urlparse(response.url)
+        season_title = response.meta['season_title']
+        self.season_competitions[season_title] = competition_titles
 
         for competition_number, competition_title in zip(competition_numbers, competition_titles):
+            # skip competitions which have finished and been completely scraped in an earlier scraping run
+            if self.competition_completed(season_title, competition_title):
+                self.log(message=f"Competition already completed: {season_title}-{competition_title}", level=INFO)
+                continue
+            self.competition_progress[(season_title, competition_title)] = dict(
+                competition_id=competition_number, parsed=False, events_requested=0, events_parsed=0, new_rounds=0)
+
             # assemble direct URL for this competition
             competition_url = f'{url_components.scheme}://{url_components.netloc}/Results.aspx?evt={competition_number}'
 
@@ -96,6 +179,8 @@ class ShortTrackEventSpider(scrapy.Spider):
         # gather events from the competition page
         event_urls = response.css('div.navilevel1 p a::attr(href)').getall()
         event_titles = response.css('div.navilevel1 p a::text').getall()
+        progress = self.competition_progress[(response.meta['season_title'], response.meta['competition_title'])]
+        progress['parsed'] = True
 
         for event_url, event_title in zip(event_urls, event_titles):
             # assemble direct URL for this event
@@ -111,6 +196,7 @@ class ShortTrackEventSpider(scrapy.Spider):
                                           event_gender=event_details.get("gen", [np.nan])[0]))
 
                 # scrape the event page
+                progress['events_requested'] += 1
                 yield scrapy.Request(url=full_event_url,
                                      callback=self.parse_event,
                                      meta=response.meta)
@@ -124,6 +210,8 @@ class ShortTrackEventSpider(scrapy.Spider):
         # gather rounds from the event page sidebar
         round_urls = response.css('div.navilevel3 p a::attr(href)').getall()
         round_titles = response.css('div.navilevel3 p a::text').getall()
+        progress = self.competition_progress[(response.meta['season_title'], response.meta['competition_title'])]
+        progress['events_parsed'] += 1
 
         for round_url, round_title in zip(round_urls, round_titles):
             # check if this round has already been scraped in an early scraping run
@@ -136,6 +224,7 @@ class ShortTrackEventSpider(scrapy.Spider):
                                               event_gender=response.meta['event_gender'],
                                               round_title=round_title):
                 # assemble direct URL for the round
+                progress['new_rounds'] += 1
                 full_round_url = response.urljoin(round_url)
 
                 # pass along metadata for use in next steps
@@ -154,20 +243,13 @@ class ShortTrackEventSpider(scrapy.Spider):
 
         Example round: "Semifinals". Each round has multiple races (e.g. the Semifinal round most commonly has 2 races).
         """
-        # save full HTML content for this round
-        if self.save_html:
-            unclean_file_name = f'{response.meta["season_title"]}-{response.meta["competition_title"]}-' \
-                                f'{response.meta["event_title"]}-{response.meta["event_gender"]}-' \
-                                f'{response.meta["round_title"]}'
-            response.meta.update(dict(round_file_name=regex_replace(regex_replace(unclean_file_name), '/', '_')))
-            save_raw_html(html_content=response.body, file_name=response.meta["round_file_name"])
+        # archive full HTML content for this round
+        if self.archive is not None:
+            self.archive.add('round', response)
 
         # extract athlete data and basic timing/position data for each race of the round
-        races = response.css('table[cellspacing="0"][align="Center"]')
         races_out = list()
-        for i, race in enumerate(races):
-            column_headers = race.css('tr.tablehead th::text').getall()
-            athletes = race.css('tr[class*=tablecol]')
+        for i, (column_headers, athletes) in enumerate(round_tables(response.selector.root)):
             for athlete in athletes:
                 athlete_out = dict(season=response.meta["season_title"],
                                    competition=response.meta["competition_title"],
@@ -176,25 +258,25 @@ class ShortTrackEventSpider(scrapy.Spider):
                                    gender=response.meta["event_gender"],
                                    round=response.meta["round_title"],
                                    race=i + 1)
-                for col, data_point in zip(column_headers, athlete.css('td')):
+                for col, (text, link_text, link) in zip(column_headers, athlete):
                     if col == "Name":
-                        athlete_out[col] = regex_replace(data_point.css('td a::text').get())
-                        athlete_out["ISU ID"] = parse_qs(urlsplit(data_point.css('a::attr(href)').get()).query).get(
-                            "ath", [np.nan])[0]
+                        athlete_out[col] = regex_replace(link_text)
+                        athlete_out["ISU ID"] = parse_qs(urlsplit(link).query).get("ath", [np.nan])[0]
                     elif col == "Results":
-                        athlete_out[col] = parse_time_string(data_point.css('td::text').get())
+                        athlete_out[col] = parse_time_string(text)
                     elif col == "Relay Team":
                         athlete_out["Warn."] = np.nan
-                        athlete_out[col] = regex_replace(data_point.css('td::text').get())
+                        athlete_out[col] = regex_replace(text)
                     elif col == "Warn.":
-                        athlete_out[col] = regex_replace(data_point.css('td::text').get())
+                        athlete_out[col] = regex_replace(text)
                         athlete_out["Relay Team"] = np.nan
                     elif col != "\xa0":
-                        athlete_out[col] = regex_replace(data_point.css('td::text').get())
+                        athlete_out[col] = regex_replace(text)
 
                 races_out.append(athlete_out)
+                self.already_scraped.add(normalize_key(athlete_out[col] for col in UNIQUE_ROUND_COLUMNS))
 
-        save_parsed_data(df=pd.DataFrame(races_out), file_path=ROUNDS_FILE)
+        yield RoundItem(rows=races_out)
 
         # call the dedicated parser to extract split data for each race of the round
         split_urls = response.css('div.tabletitle p a[href*="http://shorttrack.sportresult.com"]::attr(href)').getall()
@@ -209,14 +291,12 @@ class ShortTrackEventSpider(scrapy.Spider):
         """
         Gather split data for the race.
         """
-        # save full HTML content for this race's split data
-        if self.save_html:
-            race_file_name = f'{response.meta["round_file_name"]}-race_{response.meta["race_number"]}-splits'
-            save_raw_html(html_content=response.body, file_name=race_file_name, split=True)
+        # archive full HTML content for this race's split data
+        if self.archive is not None:
+            self.archive.add('split', response)
 
         # extract split times and positions for each athlete on each lap
-        athlete_names = response.css('tr.tablehead th[scope="col"]::text')[1:].getall()
-        laps = response.css('tr[class*=tablecol]')
+        athlete_names, laps = split_table(response.selector.root)
 
         num_laps = len(laps)
         split_data = {
@@ -238,12 +318,10 @@ class ShortTrackEventSpider(scrapy.Spider):
             split_data[f'{col_id} ELAPSED TIME'] = [np.nan] * num_laps
 
         for lap_index, lap in enumerate(laps):
-            for athlete_col, col_id in zip(lap.css('td')[1:], col_ids):
-                athlete_position = athlete_col.css('td span::text').get()
+            for (athlete_position, laptime_field), col_id in zip(lap, col_ids):
                 athlete_position_cleaned = athlete_position.strip('[]') if athlete_position is not None else np.nan
                 split_data[f'{col_id} POSITION'][lap_index] = athlete_position_cleaned
 
-                laptime_field = athlete_col.css('td::text').getall()
                 if len(laptime_field):
                     both_times = regex_replace(laptime_field[1]).strip(')').split('(')
                 else:
@@ -251,4 +329,4 @@ class ShortTrackEventSpider(scrapy.Spider):
                 split_data[f'{col_id} LAP TIME'][lap_index] = parse_time_string(both_times[1])
                 split_data[f'{col_id} ELAPSED TIME'][lap_index] = parse_time_string(both_times[0])
 
-        save_parsed_data(df=pd.DataFrame(split_data), file_path=SPLITS_FILE)
+        yield SplitItem(rows=pd.DataFrame(split_data).to_dict('records'))
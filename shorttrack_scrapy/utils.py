@@ -1,45 +1,175 @@
+import json
 import logging
-import re
 from os.path import exists
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-from shorttrack_scrapy.constants import RAW_SPLIT_DIR, REGEX_BAD_CHARS, RAW_ROUND_DIR, ROUNDS_FILE, EVENT_NAME_MAPPING, \
-    UNTREATABLE_EVENTS
+from shorttrack_scrapy.constants import ROUNDS_FILE, EVENT_NAME_MAPPING, \
+    UNTREATABLE_EVENTS, CRAWL_MANIFEST_FILE, PARQUET_GROUP_COLUMNS, PARQUET_SORT_COLUMN, PARQUET_ROW_GROUP_SIZE, \
+    CSV_CHUNK_ROWS
+from shorttrack_scrapy.processing import typed_columns
 
 
-def load_already_scraped(unique_column_set: list) -> pd.DataFrame:
+def load_already_scraped(unique_column_set: list) -> set:
     """
-    If some results have already been scraped, load in the details so it isn't downloaded again.
+    If some results have already been scraped, load in the details so it isn't downloaded again. Each scraped key is
+    normalized with normalize_key.
     """
     if exists(ROUNDS_FILE):
-        return pd.read_csv(ROUNDS_FILE)[unique_column_set].drop_duplicates()
+        already_scraped = normalize_key_columns(pd.read_csv(ROUNDS_FILE, usecols=unique_column_set), unique_column_set)
+        return set(already_scraped[unique_column_set].itertuples(index=False, name=None))
     else:
-        return pd.DataFrame(columns=unique_column_set)
+        return set()
 
 
-def save_raw_html(html_content, file_name: str, split: bool = False):
+def load_crawl_manifest() -> dict:
     """
-    Save the raw HTML content from a scraped page.
+    Load the record of seasons and competitions which have been completely scraped, so they aren't visited again.
+
+    Completed seasons map to the time they were completed. Competitions are grouped by season, and each records its ID,
+    when new rounds were last found in it and when it was completed (None while it is still open).
+    """
+    if exists(CRAWL_MANIFEST_FILE):
+        with open(CRAWL_MANIFEST_FILE) as f:
+            return json.load(f)
+    return dict(seasons=dict(), competitions=dict())
+
+
+def save_crawl_manifest(manifest: dict):
+    """
+    Save the record of completely scraped seasons and competitions.
+    """
+    with open(CRAWL_MANIFEST_FILE, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        logging.debug(f'Saved crawl manifest to {f.name}')
+
+
+def normalize_key_value(value) -> str:
+    """
+    Write a key value as a string, with whole numbers written the same way whether they were read as ints, floats or
+    text (e.g. 2, 2.0 and '2' all become '2').
+    """
+    try:
+        number = float(value)
+        if number.is_integer():
+            return str(int(number))
+    except (TypeError, ValueError):
+        pass
+    return str(value)
+
+
+def normalize_key_columns(df: pd.DataFrame, key_columns: list) -> pd.DataFrame:
+    """
+    The key columns of df, with every value passed through normalize_key_value.
+    """
+    keys = pd.DataFrame(index=df.index)
+    for col in key_columns:
+        if pd.api.types.is_integer_dtype(df[col]):
+            keys[col] = df[col].astype(str)
+        else:
+            keys[col] = df[col].map(normalize_key_value)
+    return keys
+
+
+def normalize_key(values) -> tuple:
+    """
+    Normalize one key (e.g. the UNIQUE_RACE_COLUMNS values of a race) for comparison with normalize_key_columns.
+    """
+    return tuple(normalize_key_value(value) for value in values)
+
+
+def select_keys(df: pd.DataFrame, key_columns: list, keys: set) -> np.ndarray:
+    """
+    Boolean mask of the rows of df whose key columns match one of the normalized keys.
+    """
+    if not len(df) or not keys:
+        return np.zeros(len(df), dtype=bool)
+    return pd.MultiIndex.from_frame(normalize_key_columns(df, key_columns)).isin(list(keys))
+
+
+def read_keys(file_path: str, key_columns: list, keys: set, chunksize: int = CSV_CHUNK_ROWS) -> pd.DataFrame:
+    """
+    The rows of a CSV file whose key columns match one of the normalized keys. The key columns are scanned in chunks
+    to find the matching rows, then only those rows are parsed, in one go so that each column has a single type.
     """
-    directory = RAW_SPLIT_DIR if split else RAW_ROUND_DIR
-    with open(directory + file_name + '.html', 'wb') as f:
-        f.write(html_content)
-        logging.debug(f'Saved file {f.name}')
+    selected = set()
+    with pd.read_csv(file_path, usecols=key_columns, chunksize=chunksize) as chunks:
+        for chunk in chunks:
+            # line 0 is the header
+            selected.update((chunk.index[select_keys(chunk, key_columns, keys)] + 1).tolist())
+    return pd.read_csv(file_path, skiprows=lambda line: line > 0 and line not in selected)
 
 
 def save_parsed_data(df: pd.DataFrame, file_path: str):
     """
-    Save df to requested file_path, appending if the file already exists.
+    Save df to requested file_path, appending if the file already exists. Appended columns are matched up with the
+    existing header.
     """
     if exists(file_path):
-        df.to_csv(file_path, mode='a', header=False, index=False)
+        header = pd.read_csv(file_path, nrows=0).columns
+        unknown_columns = set(df.columns).difference(header)
+        if unknown_columns:
+            logging.warning(f'Dropping columns not in the header of {file_path}: {sorted(unknown_columns)}')
+        df.reindex(columns=header).to_csv(file_path, mode='a', header=False, index=False)
         logging.debug(f'Appended to {file_path}.')
     else:
         df.to_csv(file_path, index=False)
         logging.debug(f'Created {file_path}.')
 
 
+def upsert_parsed_data(df: pd.DataFrame, file_path: str, key_columns: list, keys: set):
+    """
+    Replace the rows of file_path whose key columns match one of the normalized keys with df. When none of the keys
+    are present yet, df is appended without rewriting the rest of the file.
+    """
+    if not exists(file_path):
+        df.to_csv(file_path, index=False)
+        logging.debug(f'Created {file_path}.')
+        return
+
+    header = pd.read_csv(file_path, nrows=0).columns
+    stale_rows = select_keys(pd.read_csv(file_path, usecols=key_columns), key_columns, keys)
+    if not stale_rows.any() and set(df.columns).issubset(header):
+        df.reindex(columns=header).to_csv(file_path, mode='a', header=False, index=False)
+        logging.debug(f'Appended to {file_path}.')
+    else:
+        existing = pd.read_csv(file_path, float_precision='round_trip')
+        pd.concat([existing[~stale_rows], df], ignore_index=True).to_csv(file_path, index=False)
+        logging.debug(f'Replaced {stale_rows.sum()} rows of {file_path}.')
+
+
+def save_parquet(df: pd.DataFrame, file_path: str):
+    """
+    Save df as typed Parquet, with separate row groups for each event and gender so that readers can skip the groups
+    they don't need. Rows are sorted by athlete within each group, so reading one athlete's rows also skips most row
+    groups.
+    """
+    df = typed_columns(df).sort_values(PARQUET_GROUP_COLUMNS + [PARQUET_SORT_COLUMN], kind='mergesort')
+    df = df.reset_index(drop=True)
+    group_starts = np.flatnonzero(df.groupby(PARQUET_GROUP_COLUMNS, sort=False, dropna=False, observed=True).ngroup()
+                                  .diff().ne(0))
+    group_ends = np.append(group_starts[1:], len(df))
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(file_path, table.schema) as writer:
+        for start, end in zip(group_starts, group_ends):
+            writer.write_table(table.slice(start, end - start), row_group_size=PARQUET_ROW_GROUP_SIZE)
+    logging.debug(f'Saved {len(group_starts)} row groups to {file_path}.')
+
+
+def upsert_parquet(df: pd.DataFrame, file_path: str, key_columns: list, keys: set):
+    """
+    Replace the rows of the Parquet file_path whose key columns match one of the normalized keys with df.
+    """
+    if exists(file_path):
+        existing = pd.read_parquet(file_path)
+        df = pd.concat([existing[~select_keys(existing, key_columns, keys)], typed_columns(df)], ignore_index=True)
+    save_parquet(df, file_path)
+
+
 def clean_event_title(event_title):
     """
     Map the event title to a standardized format. If not found, log a warning and return the original.
@@ -51,22 +181,6 @@ def clean_event_title(event_title):
         return event_title
 
 
-def regex_replace(s: str, regex_str: str = None, replacement_chars: str = ''):
-    regex_str = REGEX_BAD_CHARS if regex_str is None else regex_str
-    return re.sub(regex_str, replacement_chars, s)
-
-
-def parse_time_string(s):
-    """
-    If fractions of a second are present in a time string, transform it into a Timedelta object.
-    """
-    if '.' in str(s):
-        m = re.match(r'(?P<days>[-\d]+) day[s]*, (?P<hours>\d+):(?P<minutes>\d+):(?P<seconds>\d[\.\d+]*)', str(s))
-        if m is not None:
-            return pd.Timedelta(**{key: float(val) for key, val in m.groupdict().iteritems()})
-    return s
-
-
 def detect_event_multiple(event_name):
     """
     Check if the title of the event indicates that the event was raced multiple times in the same competition.